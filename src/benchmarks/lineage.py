@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Lineage computation benchmark
+
+Compares, the way post_merge workers use them (documents in batches, in
+doc_feeder's _id order, each batch dropped once stored), the former
+per-document parent walk of LineageMapper against lineages sliced from the
+table computed once by TaxonomyTree.compute_lineages(), as
+LineageMapper.process() does. On a NCBI taxdump:
+
+    wget -N ftp://ftp.ncbi.nih.gov/pub/taxonomy/taxdump.tar.gz
+    python -m benchmarks.lineage taxdump.tar.gz
+
+(nodes.dmp can also be passed directly), or on a synthetic tree of the same
+scale (see benchmarks.synthetic):
+
+    python -m benchmarks.lineage --synthetic 2500000
+
+Keeping all lineages alive (one list per node) would mostly time the garbage
+collector, walking them again and again, hence the batches. Run from src folder.
+"""
+
+import sys
+import time
+import tarfile
+import argparse
+
+from utils.tree import TaxonomyTree
+
+BATCH_SIZE = 10000
+
+
+def read_nodes(path):
+    if path.endswith(".tar.gz"):
+        t = tarfile.open(path, mode="r:gz")
+        nodes_file = t.extractfile("nodes.dmp")
+    else:
+        nodes_file = open(path, "rb")
+    taxids = []
+    parents = []
+    for line in nodes_file:
+        split_line = line.split(b"\t", 3)
+        taxids.append(int(split_line[0]))
+        parents.append(int(split_line[2]))
+    return taxids, parents
+
+
+def walk_lineage(cache, taxid):
+    # former LineageMapper.get_lineage(), one dict lookup per level
+    parent_taxid = cache[taxid]
+    if taxid == parent_taxid:
+        return [taxid]
+    lineage = [taxid, parent_taxid]
+    while lineage[-1] != 1:
+        lineage.append(cache[lineage[-1]])
+    return lineage
+
+
+def iter_batches(taxids, batch_size):
+    # documents as found in target collection, sorted by _id (string)
+    taxids = sorted(taxids, key=str)
+    for i in range(0, len(taxids), batch_size):
+        yield [{"_id": str(taxid), "taxid": taxid} for taxid in taxids[i:i + batch_size]]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare lineage computation methods")
+    parser.add_argument("path", nargs="?", help="taxdump.tar.gz or nodes.dmp")
+    parser.add_argument("--synthetic", type=int, help="use a synthetic tree with this number of nodes instead")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(args)
+    if not args.path and not args.synthetic:
+        parser.error("path or --synthetic is required")
+
+    t0 = time.time()
+    if args.synthetic:
+        from benchmarks.synthetic import make_tree
+        taxids, parents, _ = make_tree(args.synthetic)
+        taxids, parents = taxids.tolist(), parents.tolist()
+    else:
+        taxids, parents = read_nodes(args.path)
+    print("Read %d nodes [%.1fs]" % (len(taxids), time.time() - t0))
+
+    t0 = time.time()
+    tree = TaxonomyTree(taxids, parents)
+    t_tree = time.time() - t0
+    tree.compute_lineages()
+    t_lineages = time.time() - t0 - t_tree
+    print("Tree %.1fs, lineage table %.1fs (%.1fMB)" % \
+            (t_tree, t_lineages, (tree.lineage_taxids.nbytes + tree.lineage_offsets.nbytes) / 1024. / 1024))
+
+    cache = dict(zip(taxids, parents))
+    t_walk = 0
+    t_sliced = 0
+    for docs in iter_batches(taxids, args.batch_size):
+        t0 = time.time()
+        walked = [walk_lineage(cache, doc["taxid"]) for doc in docs]
+        t_walk += time.time() - t0
+        t0 = time.time()
+        indices = tree.indices([doc["taxid"] for doc in docs])
+        sliced = [tree.lineage(idx) for idx in indices.tolist()]
+        t_sliced += time.time() - t0
+        assert walked == sliced, "lineages differ"
+    print("Per-document walk: %.1fs" % t_walk)
+    print("Sliced: %.1fs, speedup x%.1f (x%.1f including lineage table)" % \
+            (t_sliced, t_walk / t_sliced, t_walk / (t_sliced + t_lineages)))
+    print("Lineages are identical")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+"""
+Web API load test
+
+Starts the API (MySpeciesWebSettings.generate_app_list()) in a separate
+process, against an in-process fake Elasticsearch client serving a synthetic
+(see benchmarks.synthetic) or real NCBI taxonomy, optionally sampled, then
+drives mixed traffic (GET/POST /taxon, /query, include_children,
+expand_species...) from concurrent keep-alive clients and reports throughput
+and latency percentiles per kind of request. No ES cluster is needed, so
+web-side changes can be measured on a laptop. Run from src folder (config.py
+is needed, as for the API itself):
+
+    python -m benchmarks.loadtest /tmp/synthetic --generate 100000 --duration 30 --output tree.json
+    # children looked up from (fake) ES, each ES call taking 2ms
+    python -m benchmarks.loadtest /tmp/synthetic --children-from es --es-latency 2 --baseline es.json
+    # real taxonomy, 200K nodes sample (and their ancestors)
+    python -m benchmarks.loadtest /data/taxdump --sample 200000
+
+Folder contains nodes.dmp and names.dmp (or taxdump.tar.gz), and optionally
+gene_info_uniq (taxids with genes, one per line, as written by
+benchmarks.synthetic), otherwise no taxid has genes.
+
+The fake ES answers get, search and msearch (see FakeElasticsearch for the
+query subset supported) and get_mapping. Each call blocks for --es-latency
+ms, as the synchronous client would while ES is working. With --baseline,
+request kinds with lower throughput or higher p99 latency than the baseline
+(by more than --tolerance) are reported as regressions and exit status is 1.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import tarfile
+import platform
+import argparse
+import threading
+import http.client
+import multiprocessing
+from itertools import cycle
+from urllib.parse import urlencode
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.tree import TaxonomyTree, RANKS, RANK_CODES, NO_RANK, NAME_FIELDS
+
+INDEX_NAME = "taxonomy_loadtest"
+# names.dmp classes served, as document fields
+NAME_CLASSES = {"scientific name": "scientific_name", "common name": "common_name",
+                "genbank common name": "genbank_common_name"}
+# request kinds and their default share of traffic
+MIX = OrderedDict([
+    ("taxon_get", 30),
+    ("taxon_get_children", 15),
+    ("taxon_post", 15),
+    ("taxon_post_expand", 10),
+    ("query_get", 15),
+    ("query_get_children", 5),
+    ("query_post", 10),
+])
+PERCENTILES = [50, 90, 99]
+
+
+def open_dmp(folder, name):
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        return open(path, "rb")
+    return tarfile.open(os.path.join(folder, "taxdump.tar.gz"), mode="r:gz").extractfile(name)
+
+
+def read_dmp(fileobj):
+    for line in fileobj:
+        yield line.rstrip(b"\t|\n").split(b"\t|\t")
+
+
+def ancestors_closure(tree, indices):
+    """
+    Return sorted node indices of indices and all their ancestors
+    """
+    keep = np.zeros(len(tree), dtype=bool)
+    cur = np.unique(indices)
+    while len(cur):
+        keep[cur] = True
+        cur = np.unique(tree.parent[cur])
+        cur = cur[~keep[cur]]
+    return np.flatnonzero(keep)
+
+
+def read_taxonomy(folder, sample=None, seed=42):
+    """
+    Return TaxonomyTree (with names, lineages and subtree counts) read from
+    folder's flat files. If sample is given, only that many random nodes and
+    their ancestors are kept.
+    """
+    t0 = time.time()
+    taxids = []
+    parents = []
+    ranks = []
+    for fields in read_dmp(open_dmp(folder, "nodes.dmp")):
+        taxids.append(int(fields[0]))
+        parents.append(int(fields[1]))
+        ranks.append(RANK_CODES.get(fields[2].decode(), NO_RANK))
+    has_gene = np.zeros(len(taxids), dtype=bool)
+    gene_file = os.path.join(folder, "gene_info_uniq")
+    if os.path.exists(gene_file):
+        gene_taxids = np.array([int(line) for line in open(gene_file) if line.strip()], dtype=np.int64)
+        has_gene = np.isin(np.array(taxids, dtype=np.int64), gene_taxids)
+    tree = TaxonomyTree(taxids, parents, ranks, has_gene)
+    if sample and sample < len(tree):
+        rng = np.random.RandomState(seed)
+        keep = ancestors_closure(tree, rng.choice(len(tree), sample, replace=False))
+        tree = TaxonomyTree(tree.taxid[keep], tree.taxid[tree.parent[keep]], tree.rank[keep], tree.has_gene[keep])
+    names = []
+    for fields in read_dmp(open_dmp(folder, "names.dmp")):
+        field = NAME_CLASSES.get(fields[3].decode())
+        if field:
+            names.append((int(fields[0]), field, fields[1].decode()))
+    tree.set_names(names)
+    tree.compute_lineages()
+    tree.compute_aggregates()
+    print("Taxonomy: %d nodes, %d with genes [%.1fs]" % (len(tree), tree.has_gene.sum(), time.time() - t0))
+    return tree
+
+
+class FakeIndices(object):
+
+    def __init__(self, es):
+        self.es = es
+
+    def get_mapping(self, index=None, doc_type=None, **kwargs):
+        self.es.wait()
+        properties = dict((field, {"type": "string"}) for field in NAME_FIELDS)
+        properties.update(dict((field, {"type": "long"}) for field in
+                               ["taxid", "parent_taxid", "lineage", "left", "right", "depth", "num_descendants",
+                                "num_gene_descendants", "num_species_descendants"]))
+        properties.update({"rank": {"type": "string", "index": "not_analyzed"}, "has_gene": {"type": "boolean"}})
+        meta = {"build_version": self.es.build_version,
+                "stats": {"unique taxonomy ids": len(self.es.tree),
+                          "taxonomy ids with gene": int(self.es.tree.has_gene.sum())}}
+        return {INDEX_NAME: {"mappings": {self.es.doc_type: {"_meta": meta, "properties": properties}}}}
+
+
+class FakeElasticsearch(object):
+    """
+    Minimal in-process stand-in of the elasticsearch client, answering from a
+    TaxonomyTree the queries issued by the API:
+
+    - get() by taxid
+    - search(), msearch() with match_all, match/multi_match and bool queries,
+      and query_string queries made of "field:value", "field:(v1 OR v2)"
+      or "value" (names) clauses joined by AND. Fields are _id, taxid,
+      parent_taxid, lineage, rank, has_gene and name fields (exact, case
+      insensitive match), plus terms queries and range queries on taxid. Sorting by taxid,
+      from/size and _source filtering are supported, aggregations, scrolls
+      and search_after (ES 5) aren't. As ES >= 2.1 does, from + size past
+      max_result_window (index.max_result_window) is rejected.
+
+    Each call first waits latency seconds, simulating ES processing time.
+    """
+
+    def __init__(self, tree, doc_type="taxon", latency=0., build_version="loadtest", max_result_window=10000):
+        self.tree = tree
+        self.doc_type = doc_type
+        self.latency = latency
+        self.max_result_window = max_result_window
+        self.build_version = build_version
+        self.indices = FakeIndices(self)
+        self.calls = 0
+
+    def wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def doc(self, idx):
+        tree = self.tree
+        doc = {"taxid": int(tree.taxid[idx]), "parent_taxid": int(tree.taxid[tree.parent[idx]]),
+               "rank": RANKS[tree.rank[idx]], "lineage": tree.lineage(idx)}
+        if tree.has_gene[idx]:
+            doc["has_gene"] = True
+        for (field, name) in tree.names(idx):
+            doc.setdefault(field, name)
+        doc.update(tree.subtree_fields(idx))
+        return doc
+
+    def source(self, idx, includes):
+        doc = self.doc(idx)
+        if includes is None:
+            return doc
+        return dict((k, v) for (k, v) in doc.items() if k in includes)
+
+    def term(self, field, value):
+        """
+        Return sorted node indices of documents whose field matches value
+        """
+        tree = self.tree
+        if value == "*":
+            return np.arange(len(tree))
+        if field in ("_id", "taxid", "parent_taxid", "lineage"):
+            try:
+                idx = tree.index(int(value))
+            except ValueError:
+                return np.array([], dtype=np.int64)
+            if idx < 0:
+                return np.array([], dtype=np.int64)
+            if field == "parent_taxid":
+                return np.flatnonzero((tree.parent == idx) & (np.arange(len(tree)) != idx))
+            if field == "lineage":
+                return np.sort(tree.order[tree.left[idx]:tree.left[idx] + tree.size[idx]])
+            return np.array([idx])
+        if field == "rank":
+            return np.flatnonzero(tree.rank == RANK_CODES.get(value, NO_RANK))
+        if field == "has_gene":
+            return np.flatnonzero(tree.has_gene == (value.lower() == "true"))
+        if field in NAME_FIELDS:
+            code = NAME_FIELDS.index(field)
+            matches = [idx for (idx, entry) in tree.resolve_names([value])[0] if tree.name_class[entry] == code]
+            return np.unique(np.array(matches, dtype=np.int64))
+        raise ValueError("Field '%s' not supported by fake ES" % field)
+
+    def query_string(self, query, default_fields=None):
+        nodes = None
+        for clause in re.split(r"\s+AND\s+", query.strip()):
+            m = re.match(r"^(?:([\w.]+):)?\(?(.*?)\)?$", clause.strip())
+            fields = [m.group(1)] if m.group(1) else (default_fields or NAME_FIELDS)
+            found = np.array([], dtype=np.int64)
+            for value in re.split(r"\s+OR\s+", m.group(2)):
+                for field in fields:
+                    found = np.union1d(found, self.term(field, value.strip().strip('"')))
+            nodes = found if nodes is None else np.intersect1d(nodes, found, assume_unique=True)
+        return nodes
+
+    def match(self, query):
+        if "match_all" in query:
+            return np.arange(len(self.tree))
+        if "query_string" in query:
+            return self.query_string(query["query_string"]["query"], query["query_string"].get("fields"))
+        if "match" in query:
+            ((field, value),) = query["match"].items()
+            return self.term(field, str(value["query"] if isinstance(value, dict) else value))
+        if "multi_match" in query:
+            found = np.array([], dtype=np.int64)
+            for field in query["multi_match"]["fields"]:
+                found = np.union1d(found, self.term(field, str(query["multi_match"]["query"])))
+            return found
+        if "terms" in query:
+            ((field, values),) = query["terms"].items()
+            found = np.array([], dtype=np.int64)
+            for value in values:
+                found = np.union1d(found, self.term(field, str(value)))
+            return found
+        if "range" in query:
+            ((field, bounds),) = query["range"].items()
+            if field not in ("taxid", "_id"):
+                raise ValueError("Range on '%s' not supported by fake ES" % field)
+            taxids = self.tree.taxid
+            mask = np.ones(len(taxids), dtype=bool)
+            for (op, value) in bounds.items():
+                mask &= {"gt": taxids > int(value), "gte": taxids >= int(value),
+                         "lt": taxids < int(value), "lte": taxids <= int(value)}[op]
+            return np.flatnonzero(mask)
+        if "bool" in query:
+            clauses = dict((k, v if isinstance(v, list) else [v]) for (k, v) in query["bool"].items())
+            nodes = np.arange(len(self.tree)) if clauses.get("must") or clauses.get("filter") or \
+                                                 not clauses.get("should") else np.array([], dtype=np.int64)
+            for q in clauses.get("must", []) + clauses.get("filter", []):
+                nodes = np.intersect1d(nodes, self.match(q), assume_unique=True)
+            for q in clauses.get("must_not", []):
+                nodes = np.setdiff1d(nodes, self.match(q), assume_unique=True)
+            if not clauses.get("must") and not clauses.get("filter"):
+                for q in clauses.get("should", []):
+                    nodes = np.union1d(nodes, self.match(q))
+            return nodes
+        raise ValueError("Query %s not supported by fake ES" % json.dumps(query))
+
+    def _search(self, body, size=None, from_=None, _source=None, fields=None):
+        body = body or {}
+        if "aggs" in body or "aggregations" in body:
+            raise ValueError("Aggregations not supported by fake ES")
+        nodes = self.match(body.get("query", {"match_all": {}}))
+        sort = body.get("sort")
+        descending = False
+        if sort:
+            # node indices follow taxids order
+            (key,) = sort if isinstance(sort, list) else [sort]
+            if isinstance(key, dict):
+                ((field, order),) = key.items()
+                order = order.get("order", "asc") if isinstance(order, dict) else order
+            else:
+                field, _, order = key.lstrip("-").partition(":")
+                order = "desc" if key.startswith("-") else (order or "asc")
+            if field not in ("taxid", "_id"):
+                raise ValueError("Sorting on '%s' not supported by fake ES" % field)
+            descending = order == "desc"
+            if descending:
+                nodes = nodes[::-1]
+        start = int(body.get("from", from_ or 0))
+        size = int(body.get("size", size if size is not None else 10))
+        if start + size > self.max_result_window:
+            raise ValueError("Result window is too large, from + size must be less than or equal to: [%d] but was [%d]"
+                             % (self.max_result_window, start + size))
+        includes = body.get("_source", _source)
+        if isinstance(includes, str):
+            includes = includes.split(",")
+        hits = []
+        for idx in nodes[start:start + size].tolist():
+            hit = {"_index": INDEX_NAME, "_type": self.doc_type, "_id": str(self.tree.taxid[idx]), "_score": 1.0}
+            if includes is not False and not fields:
+                hit["_source"] = self.source(idx, includes)
+            if sort:
+                hit["sort"] = [int(self.tree.taxid[idx])]
+            hits.append(hit)
+        return {"took": 0, "timed_out": False, "_shards": {"total": 1, "successful": 1, "failed": 0},
+                "hits": {"total": len(nodes), "max_score": 1.0, "hits": hits}}
+
+    def search(self, body=None, index=None, doc_type=None, size=None, from_=None, _source=None, fields=None, **kwargs):
+        self.wait()
+        return self._search(body, size=size, from_=from_, _source=_source, fields=fields)
+
+    def msearch(self, body, index=None, doc_type=None, **kwargs):
+        self.wait()
+        lines = body.splitlines() if isinstance(body, str) else body
+        lines = [json.loads(line) if isinstance(line, str) else line for line in lines if line]
+        responses = []
+        for query in lines[1::2]:
+            try:
+                responses.append(self._search(query))
+            except ValueError as e:
+                responses.append({"error": {"root_cause": [{"type": "query_parsing_exception", "reason": str(e)}]}})
+        return {"responses": responses}
+
+    def get(self, index=None, doc_type=None, id=None, _source=None, **kwargs):
+        from elasticsearch import NotFoundError
+        self.wait()
+        idx = self.tree.index(int(id)) if str(id).isdigit() else -1
+        if idx < 0:
+            raise NotFoundError(404, "not_found", {"_index": INDEX_NAME, "_type": self.doc_type,
+                                                   "_id": str(id), "found": False})
+        if isinstance(_source, str):
+            _source = _source.split(",")
+        return {"_index": INDEX_NAME, "_type": self.doc_type, "_id": str(id), "_version": 1,
+                "found": True, "_source": self.source(idx, _source)}
+
+    def ping(self, **kwargs):
+        return True
+
+    def scroll(self, **kwargs):
+        raise ValueError("Scrolls not supported by fake ES")
+
+
+def serve(folder, sample, config, children_from, es_latency, queue):
+    """
+    Run the API on a free port (sent through queue, or the startup error),
+    until killed
+    """
+    try:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("tornado.access").setLevel(logging.WARNING)
+        from tornado.httpserver import HTTPServer
+        from tornado.ioloop import IOLoop
+        from tornado.netutil import bind_sockets
+        from tornado.web import Application
+        from web.settings import MySpeciesWebSettings
+
+        es = FakeElasticsearch(read_taxonomy(folder, sample), latency=es_latency / 1000.)
+
+        class LoadTestWebSettings(MySpeciesWebSettings):
+            def get_es_client(self):
+                return es
+
+            def load_taxonomy_tree(self, version=None):
+                return es.tree if children_from == "tree" else None
+
+        settings = LoadTestWebSettings(config=config)
+        # whatever TAXONOMY_TREE_PRELOAD is
+        settings.taxonomy_tree = settings.load_taxonomy_tree()
+        sockets = bind_sockets(0, "127.0.0.1")
+        server = HTTPServer(Application(settings.generate_app_list()))
+        server.add_sockets(sockets)
+    except Exception as e:
+        queue.put("%s: %s" % (type(e).__name__, e))
+        raise
+    queue.put(sockets[0].getsockname()[1])
+    IOLoop.current().start()
+
+
+def make_requests(tree, mix, num=10000, seed=42):
+    """
+    Return list of num (kind, method, path, body) requests, kinds being
+    picked according to mix ({kind: weight}), on random taxa
+    """
+    rng = random.Random(seed)
+    taxids = tree.taxid.tolist()
+    # taxa with children, for include_children/expand_species
+    internal = tree.taxid[tree.size > 1].tolist() or taxids
+    names = [name for i in rng.sample(range(len(tree)), min(len(tree), 1000))
+             for (field, name) in tree.names(i) if field == "scientific_name"]
+    kinds = list(mix)
+    requests = []
+    for kind in rng.choices(kinds, weights=[mix[k] for k in kinds], k=num):
+        has_gene = "true" if rng.random() < 0.5 else "false"
+        if kind == "taxon_get":
+            req = ("GET", "/v1/taxon/%d" % rng.choice(taxids), None)
+        elif kind == "taxon_get_children":
+            req = ("GET", "/v1/taxon/%d?%s" % (rng.choice(internal),
+                                              urlencode({"include_children": "true", "has_gene": has_gene})), None)
+        elif kind == "taxon_post":
+            req = ("POST", "/v1/taxon", {"ids": ",".join(str(t) for t in rng.sample(taxids, 10))})
+        elif kind == "taxon_post_expand":
+            req = ("POST", "/v1/taxon", {"ids": ",".join(str(t) for t in rng.sample(internal, 3)),
+                                         "expand_species": "true", "has_gene": has_gene})
+        elif kind == "query_get":
+            q = "lineage:%d" % rng.choice(internal) if rng.random() < 0.5 or not names else rng.choice(names)
+            req = ("GET", "/v1/query?%s" % urlencode({"q": q}), None)
+        elif kind == "query_get_children":
+            req = ("GET", "/v1/query?%s" % urlencode({"q": "lineage:%d" % rng.choice(internal),
+                                                      "include_children": "true", "has_gene": has_gene}), None)
+        elif kind == "query_post":
+            if rng.random() < 0.5 or not names:
+                req = ("POST", "/v1/query", {"q": ",".join(str(t) for t in rng.sample(taxids, 10)), "scopes": "taxid"})
+            else:
+                req = ("POST", "/v1/query", {"q": ",".join(rng.sample(names, min(len(names), 5))),
+                                             "scopes": "scientific_name"})
+        else:
+            raise ValueError("Unknown request kind '%s'" % kind)
+        requests.append((kind,) + req)
+    return requests
+
+
+class Client(threading.Thread):
+    """
+    Keep-alive HTTP client sending requests (shared iterator) until deadline,
+    recording (kind, latency, status) of those sent after record_from
+    """
+
+    def __init__(self, port, requests, lock, record_from, deadline):
+        super(Client, self).__init__(daemon=True)
+        self.port = port
+        self.requests = requests
+        self.lock = lock
+        self.record_from = record_from
+        self.deadline = deadline
+        self.results = []
+
+    def connect(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        conn.connect()
+        # requests are small, don't let Nagle's algorithm delay them
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    def run(self):
+        conn = None
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        while True:
+            with self.lock:
+                (kind, method, path, body) = next(self.requests)
+            t0 = time.time()
+            if t0 >= self.deadline:
+                break
+            try:
+                if conn is None:
+                    conn = self.connect()
+                conn.request(method, path, body and urlencode(body), headers if body else {})
+                res = conn.getresponse()
+                res.read()
+                status = res.status
+            except (OSError, http.client.HTTPException):
+                if conn is not None:
+                    conn.close()
+                conn = None
+                status = None
+            if t0 >= self.record_from:
+                self.results.append((kind, time.time() - t0, status))
+        if conn is not None:
+            conn.close()
+
+
+def summarize(results, duration):
+    """
+    Return {kind: stats} (plus "all") of results, a list of (kind, latency, status)
+    """
+    by_kind = OrderedDict([("all", results)])
+    for res in sorted(results, key=lambda r: r[0]):
+        by_kind.setdefault(res[0], []).append(res)
+    summary = OrderedDict()
+    for (kind, res) in by_kind.items():
+        latencies = np.array([r[1] for r in res]) * 1000
+        summary[kind] = {"requests": len(res), "errors": sum(1 for r in res if r[2] != 200),
+                         "throughput": round(len(res) / duration, 1),
+                         "mean_ms": round(float(latencies.mean()), 2) if len(res) else None,
+                         "max_ms": round(float(latencies.max()), 2) if len(res) else None}
+        for p in PERCENTILES:
+            summary[kind]["p%d_ms" % p] = round(float(np.percentile(latencies, p)), 2) if len(res) else None
+    return summary
+
+
+def print_summary(summary):
+    print("%-20s %9s %7s %9s %9s %9s %9s %9s" % ("kind", "requests", "errors", "req/s", "p50(ms)", "p90(ms)",
+                                                 "p99(ms)", "max(ms)"))
+    for (kind, res) in summary.items():
+        if not res["requests"]:
+            continue
+        print("%-20s %9d %7d %9.1f %9.1f %9.1f %9.1f %9.1f" % (kind, res["requests"], res["errors"], res["throughput"],
+                                                               res["p50_ms"], res["p90_ms"], res["p99_ms"], res["max_ms"]))
+
+
+def compare(summary, baseline, tolerance):
+    """
+    Return list of regressions (messages) of summary against baseline summary
+    """
+    regressions = []
+    for (kind, res) in summary.items():
+        base = baseline.get(kind)
+        if not base or not base["requests"] or not res["requests"]:
+            continue
+        if res["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append("%s: throughput %.1f req/s, baseline %.1f req/s" % \
+                    (kind, res["throughput"], base["throughput"]))
+        if res["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append("%s: p99 %.1fms, baseline %.1fms" % (kind, res["p99_ms"], base["p99_ms"]))
+        if res["errors"] > base["errors"]:
+            regressions.append("%s: %d errors, baseline %d" % (kind, res["errors"], base["errors"]))
+    return regressions
+
+
+def run(port, requests, clients, duration, warmup):
+    lock = threading.Lock()
+    requests = cycle(requests)
+    record_from = time.time() + warmup
+    deadline = record_from + duration
+    threads = [Client(port, requests, lock, record_from, deadline) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [res for thread in threads for res in thread.results]
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read().decode())
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        return {"error": "%s: %s" % (type(e).__name__, e)}
+    finally:
+        conn.close()
+
+
+def parse_mix(values):
+    mix = OrderedDict()
+    for value in values:
+        kind, _, weight = value.partition("=")
+        try:
+            if kind not in MIX:
+                raise ValueError(kind)
+            mix[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError("Expecting kind=weight, kind in %s" % ", ".join(MIX))
+    return mix
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Load test the web API against a fake ES backend")
+    parser.add_argument("folder", help="folder containing synthetic (or real) taxonomy flat files")
+    parser.add_argument("--generate", type=int, metavar="NODES", help="first generate synthetic files with NODES nodes")
+    parser.add_argument("--sample", type=int, metavar="NODES", help="keep only NODES random nodes (and their ancestors)")
+    parser.add_argument("--config", default="config", help="API config module")
+    parser.add_argument("--children-from", choices=["tree", "es"], default="tree",
+                        help="answer include_children/expand_species from the in-memory tree or from ES")
+    parser.add_argument("--es-latency", type=float, default=0., metavar="MS", help="time taken by each ES call")
+    parser.add_argument("--clients", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30., help="measured time (seconds)")
+    parser.add_argument("--warmup", type=float, default=5., help="unmeasured time before (seconds)")
+    parser.add_argument("--mix", nargs="+", metavar="KIND=WEIGHT",
+                        help="traffic mix (default %s)" % " ".join("%s=%s" % kw for kw in MIX.items()))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="save report (JSON) to this file")
+    parser.add_argument("--baseline", help="compare against this report (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput/p99 latency degradation ratio")
+    args = parser.parse_args(args)
+    try:
+        mix = parse_mix(args.mix) if args.mix else MIX
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    if args.generate:
+        from benchmarks.synthetic import generate
+        generate(args.folder, args.generate)
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    server = ctx.Process(target=serve, args=(args.folder, args.sample, args.config, args.children_from,
+                                             args.es_latency, queue), daemon=True)
+    server.start()
+    try:
+        port = queue.get()
+        if not isinstance(port, int):
+            sys.exit("Can't start API: %s" % port)
+        # same taxonomy as the server, to pick taxids and names from
+        tree = read_taxonomy(args.folder, args.sample)
+        requests = make_requests(tree, mix, seed=args.seed)
+        print("Running %d clients for %.0fs (+%.0fs warmup) on port %d" % (args.clients, args.duration,
+                                                                            args.warmup, port))
+        results = run(port, requests, args.clients, args.duration, args.warmup)
+        status = get_json(port, "/status?stats=1")
+    finally:
+        server.terminate()
+    summary = summarize(results, args.duration)
+    print_summary(summary)
+
+    report = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "machine": platform.node(),
+              "nodes": len(tree),
+              "options": {"children_from": args.children_from, "es_latency_ms": args.es_latency,
+                          "clients": args.clients, "duration": args.duration, "mix": mix},
+              "status": status,
+              "results": summary}
+    if args.output:
+        json.dump(report, open(args.output, "w"), indent=2)
+        print("Report saved to '%s'" % args.output)
+    if args.baseline:
+        baseline = json.load(open(args.baseline))
+        if baseline.get("nodes") != report["nodes"] or baseline.get("options") != report["options"]:
+            print("Warning: baseline was run with %s nodes, %s" % (baseline.get("nodes"), baseline.get("options")))
+        regressions = compare(summary, baseline["results"], args.tolerance)
+        for msg in regressions:
+            print("REGRESSION %s" % msg)
+        if regressions:
+            sys.exit(1)
+        print("No regression against baseline")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Hub benchmark suite
+
+Times parsers, mappers and the standalone taxonomy parser on synthetic flat
+files (see benchmarks.synthetic), recording throughput and peak RSS of each
+stage. Every stage runs in its own fresh process so peak RSS isn't polluted
+by previous stages. Run from src folder of a configured hub (config.py is
+needed by hub modules, no database is used):
+
+    python -m benchmarks.suite /tmp/synthetic --generate 1000000 --output baseline.json
+    # later, on the same machine and scale
+    python -m benchmarks.suite /tmp/synthetic --baseline baseline.json
+
+With --baseline, stages slower or using more memory than the baseline (by
+more than --tolerance) are reported as regressions and exit status is 1.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import platform
+import resource
+import argparse
+import multiprocessing
+from collections import OrderedDict
+
+BATCH_SIZE = 10000
+
+
+def count_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as fin:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: fin.read(16 * 1024 * 1024), b""))
+
+
+def consume(docs):
+    count = 0
+    for _ in docs:
+        count += 1
+    return count
+
+
+def iter_batches(docs, size=BATCH_SIZE):
+    for i in range(0, len(docs), size):
+        yield docs[i:i + size]
+
+
+def bench_parse_names(folder):
+    from hub.dataload.sources.taxonomy.parser import parse_refseq_names
+    path = os.path.join(folder, "names.dmp")
+    lines = count_lines(path)
+    t0 = time.time()
+    consume(parse_refseq_names(open(path, "rb")))
+    return lines, time.time() - t0
+
+
+def bench_parse_nodes(folder):
+    from hub.dataload.sources.taxonomy.parser import parse_refseq_nodes
+    path = os.path.join(folder, "nodes.dmp")
+    lines = count_lines(path)
+    t0 = time.time()
+    consume(parse_refseq_nodes(open(path, "rb")))
+    return lines, time.time() - t0
+
+
+def bench_parse_uniprot(folder):
+    from hub.dataload.sources.uniprot.parser import parse_uniprot_speclist
+    path = os.path.join(folder, "speclist.txt")
+    lines = count_lines(path)
+    t0 = time.time()
+    consume(parse_uniprot_speclist(open(path)))
+    return lines, time.time() - t0
+
+
+def bench_parse_geneinfo(folder):
+    from hub.dataload.sources.geneinfo.parser import parse_geneinfo_taxid
+    path = os.path.join(folder, "gene_info.gz")
+    lines = count_lines(path)
+    t0 = time.time()
+    consume(parse_geneinfo_taxid(path))
+    return lines, time.time() - t0
+
+
+def bench_has_gene_mapper(folder):
+    from hub.dataload.sources.geneinfo.parser import parse_geneinfo_taxid
+    from hub.dataload.sources.taxonomy.parser import parse_refseq_nodes
+    from hub.databuild.mapper import HasGeneMapper
+    gene_taxids = [int(d["_id"]) for d in parse_geneinfo_taxid(os.path.join(folder, "gene_info.gz"))]
+    docs = [{"_id": d["_id"]} for d in parse_refseq_nodes(open(os.path.join(folder, "nodes.dmp"), "rb"))]
+    t0 = time.time()
+    # same as load(), from parsed taxids instead of geneinfo collection
+    mapper = HasGeneMapper()
+    mapper.cache = mapper.build_cache(gene_taxids)
+    for batch in iter_batches(docs):
+        consume(mapper.process(batch))
+    return len(docs), time.time() - t0
+
+
+def bench_lineage_mapper(folder):
+    from hub.dataload.sources.taxonomy.parser import parse_refseq_nodes
+    from hub.databuild.mapper import LineageMapper
+    docs = list(parse_refseq_nodes(open(os.path.join(folder, "nodes.dmp"), "rb")))
+    t0 = time.time()
+    # same as load(), from parsed nodes instead of nodes collection
+    mapper = LineageMapper()
+    mapper.build_tree([d["taxid"] for d in docs], [d["parent_taxid"] for d in docs])
+    for batch in iter_batches(docs):
+        consume(mapper.process(batch))
+    return len(docs), time.time() - t0
+
+
+def bench_taxonomy_parser(folder):
+    from hub.dataload import taxonomy_parser
+    taxonomy_parser.FLAT_FILE_PATH = folder
+    t0 = time.time()
+    entries = taxonomy_parser.main()
+    return len(entries), time.time() - t0
+
+
+STAGES = OrderedDict([
+    ("parse_names", bench_parse_names),
+    ("parse_nodes", bench_parse_nodes),
+    ("parse_uniprot", bench_parse_uniprot),
+    ("parse_geneinfo", bench_parse_geneinfo),
+    ("has_gene_mapper", bench_has_gene_mapper),
+    ("lineage_mapper", bench_lineage_mapper),
+    ("taxonomy_parser", bench_taxonomy_parser),
+])
+
+
+def run_stage(name, folder):
+    items, elapsed = STAGES[name](folder)
+    # ru_maxrss is in KB on Linux (bytes on OSX)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        maxrss //= 1024
+    return {"items": items, "seconds": round(elapsed, 3),
+            "throughput": round(items / elapsed, 1) if elapsed else None,
+            "peak_rss_mb": round(maxrss / 1024., 1)}
+
+
+def run(folder, stages):
+    ctx = multiprocessing.get_context("spawn")
+    results = OrderedDict()
+    for name in stages:
+        with ctx.Pool(1) as pool:
+            try:
+                results[name] = pool.apply(run_stage, (name, folder))
+            except Exception as e:
+                results[name] = {"error": "%s: %s" % (type(e).__name__, e)}
+        print_result(name, results[name])
+    return results
+
+
+def print_result(name, res):
+    if "error" in res:
+        print("%-16s ERROR %s" % (name, res["error"]))
+    else:
+        print("%-16s %10d items %8.2fs %12.0f items/s %8.1fMB" % \
+                (name, res["items"], res["seconds"], res["throughput"] or 0, res["peak_rss_mb"]))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return list of regressions (messages) of results against baseline results
+    """
+    regressions = []
+    for (name, res) in results.items():
+        base = baseline.get(name)
+        if not base or "error" in base:
+            continue
+        if "error" in res:
+            regressions.append("%s: failed (%s)" % (name, res["error"]))
+            continue
+        if base["throughput"] and res["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append("%s: throughput %.0f items/s, baseline %.0f items/s" % \
+                    (name, res["throughput"], base["throughput"]))
+        if res["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append("%s: peak RSS %.1fMB, baseline %.1fMB" % \
+                    (name, res["peak_rss_mb"], base["peak_rss_mb"]))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark hub parsers, mappers and build")
+    parser.add_argument("folder", help="folder containing synthetic (or real) flat files")
+    parser.add_argument("--generate", type=int, metavar="NODES", help="first generate synthetic files with NODES nodes")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--output", help="save report (JSON) to this file")
+    parser.add_argument("--baseline", help="compare against this report (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slow-down/memory increase ratio")
+    args = parser.parse_args(args)
+
+    if args.generate:
+        from benchmarks.synthetic import generate
+        generate(args.folder, args.generate)
+
+    report = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "machine": platform.node(),
+              "nodes": count_lines(os.path.join(args.folder, "nodes.dmp")),
+              "results": run(args.folder, args.stages)}
+    if args.output:
+        json.dump(report, open(args.output, "w"), indent=2)
+        print("Report saved to '%s'" % args.output)
+    if args.baseline:
+        baseline = json.load(open(args.baseline))
+        if baseline.get("nodes") != report["nodes"]:
+            print("Warning: baseline has %s nodes, current run %s" % (baseline.get("nodes"), report["nodes"]))
+        regressions = compare(report["results"], baseline["results"], args.tolerance)
+        for msg in regressions:
+            print("REGRESSION %s" % msg)
+        if regressions:
+            sys.exit(1)
+        print("No regression against baseline")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic NCBI/UniProt flat files generator
+
+Creates, in a given folder, files shaped like the ones downloaded by the
+dumpers, at a chosen scale:
+
+    names.dmp, nodes.dmp, taxdump.tar.gz (both .dmp files)
+    speclist.txt
+    gene_info.gz, gene_info_uniq (as expected by hub.dataload.taxonomy_parser)
+
+    python -m benchmarks.synthetic /tmp/synthetic --nodes 1000000
+
+Tree shape: each node is attached to an earlier node picked so that depth
+grows with log(number of nodes), mean depth is set with --depth (NCBI
+taxonomy: ~2.5M nodes, mean depth around 25, leaves mostly species).
+Run from src folder.
+"""
+
+import os
+import sys
+import gzip
+import time
+import tarfile
+import argparse
+
+import numpy as np
+
+# ranks of internal nodes by depth, leaves are species/subspecies
+INTERNAL_RANKS = ["superkingdom", "kingdom", "phylum", "subphylum", "superclass", "class", "subclass",
+                  "superorder", "order", "suborder", "infraorder", "superfamily", "family", "subfamily",
+                  "tribe", "subtribe", "genus", "subgenus", "species group", "species subgroup"]
+# extra names.dmp classes, with their relative frequency (about 1.5 names per taxid overall)
+NAME_CLASSES = [("authority", 0.2), ("synonym", 0.1), ("type material", 0.08), ("includes", 0.02),
+                ("common name", 0.02), ("genbank common name", 0.02), ("equivalent name", 0.02),
+                ("in-part", 0.01), ("misspelling", 0.01), ("blast name", 0.005), ("acronym", 0.005)]
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "xo", "zu"]
+NODES_LINE = "%d\t|\t%d\t|\t%s\t|\t%s\t|\t%d\t|\t1\t|\t1\t|\t1\t|\t0\t|\t1\t|\t0\t|\t0\t|\t\t|\n"
+
+
+def make_tree(num_nodes, mean_depth=25, seed=42):
+    """
+    Return (taxids, parents, ranks) numpy/list of num_nodes nodes, the first
+    one being the root (taxid 1, its own parent). Taxids are sparse and
+    shuffled, like NCBI ones.
+    """
+    rng = np.random.RandomState(seed)
+    # parent position of node i is i * u**a, depth ~ log(n) / a
+    a = max(np.log(max(num_nodes, 2)) - 1, 1) / mean_depth
+    pos = np.arange(num_nodes)
+    parent_pos = (pos * rng.random_sample(num_nodes) ** a).astype(np.int64)
+    parent_pos[0] = 0
+    depth = np.zeros(num_nodes, dtype=np.int64)
+    for i in range(1, num_nodes, 1000000):
+        # parents are always before their children, chunks can be vectorized
+        # as long as a parent from the same chunk is resolved first
+        chunk = slice(i, min(i + 1000000, num_nodes))
+        d = depth[parent_pos[chunk]] + 1
+        while True:
+            depth[chunk] = d
+            nd = depth[parent_pos[chunk]] + 1
+            if (nd == d).all():
+                break
+            d = nd
+    has_children = np.zeros(num_nodes, dtype=bool)
+    has_children[parent_pos[1:]] = True
+    taxids = np.empty(num_nodes, dtype=np.int64)
+    taxids[0] = 1
+    taxids[1:] = rng.permutation(int(num_nodes * 1.3) + 2)[:num_nodes - 1] + 2
+    ranks = []
+    leaf_ranks = ["species"] * 8 + ["subspecies", "no rank"]
+    for (d, internal, r) in zip(depth.tolist(), has_children.tolist(), rng.randint(0, 10, num_nodes).tolist()):
+        if d == 0 or (internal and r < 3):
+            ranks.append("no rank")
+        elif internal:
+            ranks.append(INTERNAL_RANKS[min(d - 1, len(INTERNAL_RANKS) - 1)])
+        else:
+            ranks.append(leaf_ranks[r])
+    return taxids, taxids[parent_pos], ranks
+
+
+def make_name(rng_values):
+    return "".join(SYLLABLES[v % len(SYLLABLES)] for v in rng_values)
+
+
+def write_nodes(path, taxids, parents, ranks):
+    order = np.argsort(taxids)
+    with open(path, "w") as fout:
+        for (taxid, parent, idx) in zip(taxids[order].tolist(), parents[order].tolist(), order.tolist()):
+            fout.write(NODES_LINE % (taxid, parent, ranks[idx], "XX", idx % 12))
+
+
+def write_names(path, taxids, seed=42):
+    rng = np.random.RandomState(seed)
+    classes = [c for (c, _) in NAME_CLASSES]
+    probs = np.array([p for (_, p) in NAME_CLASSES])
+    num_extra = rng.poisson(probs.sum(), len(taxids)).tolist()
+    extra_classes = iter(rng.choice(len(classes), sum(num_extra), p=probs / probs.sum()).tolist())
+    syllables = rng.randint(0, 1000, (len(taxids), 4)).tolist()
+    with open(path, "w") as fout:
+        for (i, taxid) in enumerate(np.sort(taxids).tolist()):
+            name = "%s %s" % (make_name(syllables[i][:2]).capitalize(), make_name(syllables[i][2:]))
+            fout.write("%d\t|\t%s\t|\t\t|\tscientific name\t|\n" % (taxid, name))
+            for _ in range(num_extra[i]):
+                cls = classes[next(extra_classes)]
+                fout.write("%d\t|\t%s (%s)\t|\t\t|\t%s\t|\n" % (taxid, name, cls, cls))
+
+
+def write_speclist(path, taxids, ranks, ratio=0.011, seed=42):
+    rng = np.random.RandomState(seed)
+    species = [t for (t, r) in zip(taxids.tolist(), ranks) if r == "species"]
+    selected = sorted(rng.choice(species, min(len(species), max(1, int(len(taxids) * ratio))), replace=False).tolist())
+    with open(path, "w") as fout:
+        fout.write("Controlled vocabulary of species\n\n")
+        fout.write("Code    Taxon    N=Official (scientific) name\n")
+        fout.write("        Node     C=Common name\n")
+        fout.write("                 S=Synonym\n")
+        fout.write("_____ _ _______  ____________________________________________________________\n")
+        for (i, taxid) in enumerate(selected):
+            fout.write("%-5s E %7d: N=%s\n" % (make_name([i, i // 15, i // 225])[:5].upper(), taxid, make_name([i, taxid])))
+            if i % 3 == 0:
+                fout.write("                 C=%s\n" % make_name([taxid, i]))
+
+
+def write_gene_info(path, uniq_path, taxids, genes_per_node=5, ratio=0.015, seed=42):
+    """
+    Genes are spread over ratio of taxids, few taxids having most genes
+    (as in NCBI gene_info where a few model organisms dominate)
+    """
+    rng = np.random.RandomState(seed)
+    with_genes = rng.choice(taxids, max(1, int(len(taxids) * ratio)), replace=False)
+    weights = 1. / np.arange(1, len(with_genes) + 1)
+    num_genes = len(taxids) * genes_per_node
+    gene_taxids = with_genes[np.minimum(np.searchsorted(np.cumsum(weights / weights.sum()), rng.random_sample(num_genes)),
+                                        len(with_genes) - 1)]
+    with gzip.open(path, "wt", compresslevel=1) as fout:
+        fout.write("#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\tchromosome\tmap_location\tdescription\n")
+        for (gene_id, taxid) in enumerate(np.sort(gene_taxids).tolist()):
+            fout.write("%d\t%d\tG%d\t-\t-\t-\t1\t-\thypothetical protein\n" % (taxid, gene_id + 1, gene_id))
+    with open(uniq_path, "w") as fout:
+        fout.write("\n".join(str(t) for t in np.unique(gene_taxids).tolist()) + "\n")
+
+
+def generate(folder, num_nodes, mean_depth=25, genes_per_node=5, seed=42):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    t0 = time.time()
+    taxids, parents, ranks = make_tree(num_nodes, mean_depth, seed)
+    print("Tree: %d nodes [%.1fs]" % (num_nodes, time.time() - t0))
+    write_nodes(os.path.join(folder, "nodes.dmp"), taxids, parents, ranks)
+    write_names(os.path.join(folder, "names.dmp"), taxids, seed)
+    with tarfile.open(os.path.join(folder, "taxdump.tar.gz"), "w:gz", compresslevel=1) as tar:
+        for name in ["names.dmp", "nodes.dmp"]:
+            tar.add(os.path.join(folder, name), arcname=name)
+    print("names.dmp/nodes.dmp/taxdump.tar.gz [%.1fs]" % (time.time() - t0))
+    write_speclist(os.path.join(folder, "speclist.txt"), taxids, ranks, seed=seed)
+    write_gene_info(os.path.join(folder, "gene_info.gz"), os.path.join(folder, "gene_info_uniq"),
+                    taxids, genes_per_node, seed=seed)
+    print("speclist.txt/gene_info.gz [%.1fs]" % (time.time() - t0))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic taxonomy flat files")
+    parser.add_argument("folder")
+    parser.add_argument("--nodes", type=int, default=100000, help="number of taxonomy nodes (100K to 10M)")
+    parser.add_argument("--depth", type=int, default=25, help="mean depth of the tree")
+    parser.add_argument("--genes-per-node", type=int, default=5, help="number of gene_info lines per node")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(args)
+    generate(args.folder, args.nodes, args.depth, args.genes_per_node, args.seed)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -29,8 +29,9 @@ import biothings.hub.databuild.differ as differ
 import biothings.hub.databuild.syncer as syncer
 import biothings.hub.dataindex.indexer as indexer
 from hub.databuild.mapper import HasGeneMapper
-from hub.databuild.builder import TaxonomyDataBuilder
+from hub.databuild.builder import TaxonomyDataBuilder, upgrade_artifact
 from hub.dataindex.indexer import TaxonomyIndexer 
+from hub.profiler import profile
 
 differ_manager = differ.DifferManager(job_manager=jmanager,
         poll_schedule="* * * * * */10")
@@ -74,6 +75,7 @@ COMMANDS["upload_all"] = umanager.upload_all
 # building/merging
 COMMANDS["lsmerge"] = bmanager.list_merge 
 COMMANDS["merge"] = partial(bmanager.merge,"taxonomy")
+COMMANDS["upgrade_artifact"] = upgrade_artifact
 COMMANDS["mongo_sync"] = partial(syncer_manager.sync,"mongo")
 COMMANDS["es_sync"] = partial(syncer_manager.sync,"es")
 # diff
@@ -85,6 +87,8 @@ COMMANDS["release_note"] = differ_manager.release_note
 COMMANDS["index"] = partial(index_manager.index,"default")
 COMMANDS["snapshot"] = index_manager.snapshot
 COMMANDS["publish_snapshot"] = partial(index_manager.publish_snapshot,config.S3_APP_FOLDER)
+# profiling commands
+COMMANDS["profile"] = profile
 
 EXTRA_NS = {
         "dm" : dmanager,
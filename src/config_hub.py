@@ -41,6 +41,32 @@ MONITOR_SNAPSHOT_DELAY = 10
 # compressed cache files
 CACHE_FORMAT = "xz"
 
+# Incremental builds: when all sources changed since last build come with a delta
+# (computed at upload time), previous build is copied and only changed documents
+# are merged again, and lineage only recomputed for affected subtrees.
+INCREMENTAL_BUILD = True
+# Fall back to a full build if more than this ratio of documents changed
+INCREMENTAL_BUILD_MAX_RATIO = 0.2
+
+# Number of shards names.dmp, nodes.dmp and speclist.txt are split into at upload
+# time, each one parsed and stored by a separate process. taxdump.tar.gz members are
+# split into shard files while decompressed (removed after upload), or streamed from
+# the tarball, nothing being written to disk, with 1 shard
+UPLOAD_NUM_SHARDS = max(1,HUB_MAX_WORKERS)
+
+# Tree artifacts (<DATA_ARCHIVE_ROOT>/taxonomy_tree) and taxid alias tables
+# (<DATA_ARCHIVE_ROOT>/taxid_aliases) are deleted once their build's target
+# collection is, except the ones of the BUILD_ARTIFACTS_KEEP most recent builds
+BUILD_ARTIFACTS_KEEP = 3
+
+# Uploads, post-merge, metadata and indexing steps are profiled (wall/CPU time,
+# peak memory), profiles being stored in build documents (see "profile" command).
+# Optionally also record PROFILE_TOP memory allocations (tracemalloc) and
+# functions by cumulative time (cProfile), both slowing down profiled steps
+PROFILE_TRACEMALLOC = False
+PROFILE_CPROFILE = False
+PROFILE_TOP = 20
+
 # Hub environment (like, prod, dev, ...)
 # Used to generate remote metadata file, like "latest.json", "versions.json"
 # If non-empty, this constant will be used to generate those url, as a prefix
@@ -4,7 +4,8 @@ from biothings.web.settings.default import *
 from web.api.query_builder import ESQueryBuilder
 from web.api.query import ESQuery
 from web.api.transform import ESResultTransformer
-from web.api.handlers import TaxonHandler, QueryHandler, MetadataHandler, StatusHandler
+from web.api.handlers import TaxonHandler, QueryHandler, MetadataHandler, StatusHandler, LCAHandler, SuggestHandler, \
+    ResolveHandler, MetricsHandler
 
 # *****************************************************************************
 # Elasticsearch variables
@@ -25,11 +26,15 @@ API_VERSION = 'v1'
 # *****************************************************************************
 APP_LIST = [
     (r"/status", StatusHandler),
+    (r"/metrics", MetricsHandler),
     (r"/metadata/?", MetadataHandler),
     (r"/metadata/fields/?", MetadataHandler),
     (r"/{}/taxon/(.+)/?".format(API_VERSION), TaxonHandler),
     (r"/{}/taxon/?$".format(API_VERSION), TaxonHandler),
     (r"/{}/query/?".format(API_VERSION), QueryHandler),
+    (r"/{}/lca/?".format(API_VERSION), LCAHandler),
+    (r"/{}/suggest/?".format(API_VERSION), SuggestHandler),
+    (r"/{}/resolve/?".format(API_VERSION), ResolveHandler),
     (r"/{}/metadata/?".format(API_VERSION), MetadataHandler),
     (r"/{}/metadata/fields/?".format(API_VERSION), MetadataHandler),
 ]
@@ -61,6 +66,39 @@ GA_TRACKER_URL = 't.biothings.io'
 
 HIPCHAT_MESSAGE_COLOR = 'purple'
 
+# Load parent/rank/has_gene of all taxa in memory at startup, so include_children
+# and expand_species are answered without querying ES (falls back to ES if loading fails).
+# /lca also needs it, along with its index, as do /suggest and /resolve (names index): about 220MB for the NCBI taxonomy, shared by all
+# web processes when mapped from a tree artifact (see TAXONOMY_TREE_FOLDER), or else built
+# by each process when loading the tree
+TAXONOMY_TREE_PRELOAD = True
+# Folder containing tree artifacts written by the hub builds (<DATA_ARCHIVE_ROOT>/taxonomy_tree
+# on the hub), one "<index name>.tree" file per build. The tree is then memory-mapped (instant,
+# one page-cache copy shared by all web processes) instead of built, with its names index
+# (/suggest, /resolve), from an index scan
+TAXONOMY_TREE_FOLDER = None
+# Max memory (in bytes, estimated) used by the process-wide LRU cache of children lists
+CHILDREN_CACHE_MAX_SIZE = 128 * 1024 * 1024
+# How often (in seconds) to check whether a new build was published, in which case the
+# taxonomy tree is reloaded and the children cache invalidated
+BUILD_VERSION_CHECK_INTERVAL = 60
+# Folder containing merged/deleted taxid alias tables written by the hub builds
+# (<DATA_ARCHIVE_ROOT>/taxid_aliases on the hub), one "<index name>.npz" file per build.
+# Old taxids are then resolved by /taxon, None disables it
+TAXID_ALIASES_FOLDER = None
+# Number of threads running children ES queries (when the taxonomy tree isn't
+# loaded), so ES calls of concurrent requests don't block the IOLoop
+ES_EXECUTOR_MAX_WORKERS = 16
+# Buckets (upper bounds, in seconds) of /metrics request stage latency histograms,
+# None for default ones (1ms to 10s)
+METRICS_LATENCY_BUCKETS = None
+# Number of /suggest hits by default and at most (size parameter)
+SUGGEST_DEFAULT_SIZE = 10
+SUGGEST_MAX_SIZE = 100
+# Max number of names POSTed to /resolve, and number of results per streamed chunk
+RESOLVE_MAX_NAMES = 100000
+RESOLVE_CHUNK_SIZE = 1000
+
 STATUS_CHECK = {
     'id': '9606',
     'index': 'taxonomy',
@@ -69,6 +107,9 @@ STATUS_CHECK = {
 
 # KWARGS for taxon API
 DEFAULT_FALSE_BOOL_TYPEDEF = {'default': False, 'type': bool}
+# children lists are paginated: children_size per page (at most max_taxid_count),
+# next pages are requested with the children_cursor returned as "children_next"
+CHILDREN_PAGING_TYPEDEFS = {'children_size': {'type': int}, 'children_cursor': {'type': str}}
 ANNOTATION_GET_TRANSFORM_KWARGS.update({'include_children': DEFAULT_FALSE_BOOL_TYPEDEF, 
                                         'has_gene': DEFAULT_FALSE_BOOL_TYPEDEF})
 ANNOTATION_POST_TRANSFORM_KWARGS.update({'include_children': DEFAULT_FALSE_BOOL_TYPEDEF,
@@ -78,4 +119,7 @@ QUERY_GET_TRANSFORM_KWARGS.update({'include_children': DEFAULT_FALSE_BOOL_TYPEDE
                                     'has_gene': DEFAULT_FALSE_BOOL_TYPEDEF})
 QUERY_POST_TRANSFORM_KWARGS.update({'include_children': DEFAULT_FALSE_BOOL_TYPEDEF,
                                     'has_gene': DEFAULT_FALSE_BOOL_TYPEDEF})
+for _kwargs in [ANNOTATION_GET_TRANSFORM_KWARGS, ANNOTATION_POST_TRANSFORM_KWARGS,
+                QUERY_GET_TRANSFORM_KWARGS, QUERY_POST_TRANSFORM_KWARGS]:
+    _kwargs.update(CHILDREN_PAGING_TYPEDEFS)
 
@@ -1,28 +1,431 @@
-from biothings.utils.mongo import doc_feeder, get_target_db
+import os, glob, math, time, shutil, json
+import asyncio, concurrent.futures
+from functools import partial
+from pymongo import UpdateOne
+
+from biothings.utils.mongo import doc_feeder, get_target_db, get_src_dump
+from biothings.utils.common import timesofar, iter_n
 from biothings.hub.databuild.builder import DataBuilder
 from biothings.hub.dataload.storage import UpsertStorage
 
-from .mapper import LineageMapper
+from .mapper import LineageMapper, HasGeneMapper
+from .stats import BuildStats
+from ..profiler import StageProfiler, profiled, save_build_profile
+from ..dataload.sources.geneinfo.uploader import GeneInfoUploader
+from ..dataload.sources.taxonomy.uploader import load_dump_file
+from ..dataload.sources.taxonomy.parser import parse_refseq_merged, parse_refseq_delnodes
+from utils.tree import TaxonomyTree, NAME_FIELDS
+from utils.aliases import TaxidAliases
 import config
 import logging
 
+
+def post_merge_worker(col_name, query, artifact, batch_size, replace=False):
+    """
+    Pickable post-merge job, processing the documents matching query
+    with a LineageMapper memory-mapping its tree from artifact file.
+    Returns number of documents and their BuildStats. If replace is True,
+    documents were already post-merged (by previous build) and stats are
+    the difference between their new and previous version.
+    """
+    mapper = LineageMapper(name="lineage",artifact=artifact)
+    mapper.load()
+    db = get_target_db()
+    storage = UpsertStorage(db,col_name,logging)
+    stats = BuildStats()
+    cnt = 0
+    for docs in doc_feeder(db[col_name], step=batch_size, inbatch=True, query=query):
+        if replace:
+            for doc in docs:
+                stats.add(doc,-1)
+        docs = list(mapper.process(docs))
+        for doc in docs:
+            stats.add(doc)
+        storage.process(docs,batch_size)
+        cnt += len(docs)
+    return cnt, stats
+
+
+def nested_set_worker(col_name, taxids, artifact, batch_size):
+    """
+    Pickable post-merge job, only updating left/right/depth fields and
+    subtree counts of given taxids (their lineage didn't change)
+    """
+    tree = TaxonomyTree.load_artifact(artifact)
+    col = get_target_db()[col_name]
+    cnt = 0
+    for batch in iter_n(taxids,batch_size):
+        indices = tree.indices(batch).tolist()
+        ops = [UpdateOne({"_id" : str(taxid)},{"$set" : tree.subtree_fields(idx)}) \
+                for taxid,idx in zip(batch,indices)]
+        col.bulk_write(ops,ordered=False)
+        cnt += len(ops)
+    # depth changes are accounted for from the trees, see get_incremental_jobs()
+    return cnt, None
+
+
+def upgrade_artifact(path):
+    """
+    Add indices missing from a tree artifact written by an older build (names
+    indices for /suggest and /resolve, LCA index), so web processes can map
+    it as is. The file is replaced, processes mapping it keep the former one.
+    """
+    tree = TaxonomyTree.load_artifact(path)
+    upgraded = []
+    if tree.name_offsets is not None and tree.name_hash is None:
+        tree.compute_name_index()
+        upgraded.append("names")
+    if tree.sparse_table is None:
+        tree.compute_lca_index()
+        upgraded.append("lca")
+    if upgraded:
+        tree.save_artifact("%s.tmp" % path,tree.version)
+        os.rename("%s.tmp" % path,path)
+    return upgraded
+
+
 class TaxonomyDataBuilder(DataBuilder):
 
+    # tree arrays kept from last build, to find nodes changed by next one
+    STATE_TREE_ARRAYS = ["taxid","parent","depth","size","left","gene_descendants","species_descendants"]
+
+    def get_state_folder(self):
+        return os.path.join(config.DATA_ARCHIVE_ROOT,"post_merge","%s_last_build" % self.build_name)
+
+    def get_data_folder(self, src_name):
+        """
+        Return data folder used by the last upload of src_name
+        """
+        src_doc = get_src_dump().find_one({"upload.jobs.%s" % src_name : {"$exists" : True}}) or {}
+        job = src_doc.get("upload",{}).get("jobs",{}).get(src_name,{})
+        return job.get("data_folder") or src_doc.get("data_folder")
+
+    def get_delta(self, src_name):
+        """
+        Return delta computed by the last upload of src_name (see hub.dataload.delta),
+        None if there's none
+        """
+        data_folder = self.get_data_folder(src_name)
+        delta_file = data_folder and os.path.join(data_folder,"%s_delta.json" % src_name)
+        if delta_file and os.path.exists(delta_file):
+            return json.load(open(delta_file))
+        return None
+
+    def get_upload_ids(self):
+        """
+        Return, for each source involved in the build (has_gene mapper's
+        geneinfo included), an identifier of its last upload
+        """
+        uploads = {}
+        for src_name in set(self.resolve_sources(self.build_config["sources"]) + [GeneInfoUploader.name]):
+            delta = self.get_delta(src_name)
+            if delta:
+                uploads[src_name] = delta["id"]
+            else:
+                src_doc = get_src_dump().find_one({"upload.jobs.%s" % src_name : {"$exists" : True}}) or {}
+                job = src_doc.get("upload",{}).get("jobs",{}).get(src_name,{})
+                uploads[src_name] = "%s" % job.get("started_at")
+        return uploads
+
+    def get_incremental_plan(self, uploads):
+        """
+        Return {"target": previous target collection, "ids": _ids to merge again,
+        "stats": previous build's stats} if the build can be done incrementally from last build, that is when
+        each source uploaded since then comes with a delta against the upload
+        used in last build. None otherwise.
+        """
+        state_file = os.path.join(self.get_state_folder(),"state.json")
+        if not os.path.exists(state_file):
+            self.logger.info("No previous build state, running full build")
+            return None
+        state = json.load(open(state_file))
+        db = get_target_db()
+        if not "stats" in state or not state["target"] in db.collection_names():
+            self.logger.info("Previous build '%s' not found, running full build" % state["target"])
+            return None
+        ids = set()
+        for src_name,upload_id in uploads.items():
+            previous_id = state["uploads"].get(src_name)
+            if upload_id == previous_id:
+                continue
+            delta = self.get_delta(src_name)
+            if not delta or delta["id"] != upload_id or delta["base"] is None or delta["base"] != previous_id:
+                self.logger.info("No delta for '%s' against previous build, running full build" % src_name)
+                return None
+            # removed _ids are merged again too: they can still be part of other sources
+            ids.update(delta["changed"])
+            ids.update(delta["removed"])
+        total = db[state["target"]].count()
+        if len(ids) > total * config.INCREMENTAL_BUILD_MAX_RATIO:
+            self.logger.info("%d/%d documents changed, running full build" % (len(ids),total))
+            return None
+        self.logger.info("Incremental build from '%s', %d documents to merge again" % (state["target"],len(ids)))
+        return {"target" : state["target"], "ids" : sorted([str(_id) for _id in ids]),
+                "stats" : BuildStats.from_dict(state["stats"])}
+
+    def copy_target(self, previous, target, exclude_ids):
+        """
+        Copy previous target collection without exclude_ids documents,
+        return their (removed) stats
+        """
+        db = get_target_db()
+        self.logger.info("Copying '%s' to '%s'" % (previous,target))
+        db[previous].aggregate([{"$out" : target}],allowDiskUse=True)
+        removed = BuildStats()
+        for ids in iter_n(exclude_ids,10000):
+            for doc in db[target].find({"_id" : {"$in" : ids}},BuildStats.FIELDS):
+                removed.add(doc)
+            db[target].delete_many({"_id" : {"$in" : ids}})
+        return removed
+
+    def merge(self, sources=None, target_name=None, force=False, ids=None, steps=["merge","post","metadata"],
+              job_manager=None, *args, **kwargs):
+        if type(steps) == str:
+            steps = [steps]
+        self.uploads = self.get_upload_ids()
+        self.incremental = None
+        if config.INCREMENTAL_BUILD and sources is None and target_name is None and ids is None \
+                and "merge" in steps and "post" in steps:
+            self.incremental = self.get_incremental_plan(self.uploads)
+        if not self.incremental:
+            return super(TaxonomyDataBuilder,self).merge(sources=sources,target_name=target_name,force=force,
+                    ids=ids,steps=steps,job_manager=job_manager,*args,**kwargs)
+
+        # copy previous build without changed documents, then merge only those
+        self.check_ready(force)
+        target_name = self.target_backend.target_name
+        remerge_ids = self.incremental["ids"]
+        if not remerge_ids:
+            steps = [step for step in steps if step != "merge"]
+
+        async def do():
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "copy"
+            job = await job_manager.defer_to_thread(pinfo,
+                    partial(self.copy_target,self.incremental["target"],target_name,remerge_ids))
+            removed = await job
+            self.incremental["stats"].update(removed,-1)
+            job = super(TaxonomyDataBuilder,self).merge(sources=self.build_config["sources"],target_name=target_name,
+                    force=force,ids=remerge_ids,steps=steps,job_manager=job_manager,*args,**kwargs)
+            return await job
+
+        return asyncio.ensure_future(do())
+
+    def save_state(self, tree):
+        """
+        Keep tree and uploads used in this build, for next incremental build
+        """
+        folder = self.get_state_folder()
+        tmp_folder = "%s.tmp" % folder
+        shutil.rmtree(tmp_folder,ignore_errors=True)
+        tree.save(os.path.join(tmp_folder,"tree"),arrays=self.STATE_TREE_ARRAYS)
+        json.dump({"target" : self.target_backend.target_collection.name, "uploads" : self.uploads,
+                   "stats" : self.build_stats.to_dict()},
+                  open(os.path.join(tmp_folder,"state.json"),"w"))
+        shutil.rmtree(folder,ignore_errors=True)
+        os.rename(tmp_folder,folder)
+
+    def save_taxid_aliases(self, tree):
+        """
+        Store merged/deleted taxids (merged.dmp/delnodes.dmp) as an alias table
+        named after the target, loaded by the web app to resolve old taxids
+        """
+        data_folder = self.get_data_folder("nodes")
+        if not data_folder:
+            self.logger.warning("No taxonomy data folder found, can't store taxid aliases")
+            return
+        try:
+            merged = load_dump_file(data_folder,"merged.dmp",parse_refseq_merged)
+            deleted = load_dump_file(data_folder,"delnodes.dmp",parse_refseq_delnodes)
+            aliases = TaxidAliases.from_dump(merged,deleted)
+        except (KeyError,FileNotFoundError) as e:
+            self.logger.warning("Can't read merged/deleted taxids: %s" % e)
+            return
+        # taxids still part of the taxonomy can't be aliases
+        keep = tree.indices(aliases.old_taxid) < 0
+        aliases = TaxidAliases(aliases.old_taxid[keep],aliases.new_taxid[keep])
+        path = os.path.join(config.DATA_ARCHIVE_ROOT,"taxid_aliases","%s.npz" % self.target_backend.target_name)
+        aliases.save(path)
+        self.logger.info("%d taxid aliases saved to '%s'" % (len(aliases),path))
+
+    def get_incremental_jobs(self, tree, num_parts):
+        """
+        Return post-merge jobs for documents affected by an incremental build:
+        merged again, under a moved/new node (lineage changed), or with
+        shifted left/right/depth only. Build stats are updated with depth
+        changes of the latter.
+        """
+        previous = TaxonomyTree.load(os.path.join(self.get_state_folder(),"tree"))
+        lineage_changed,interval_changed = tree.diff(previous)
+        remerged = set(self.incremental["ids"])
+        remerged_ids = sorted(remerged)
+        lineage_ids = sorted(set([str(taxid) for taxid in lineage_changed.tolist()]) - remerged)
+        interval_taxids = [taxid for taxid in interval_changed.tolist() if not str(taxid) in remerged]
+        self.logger.info("Post-merge: %d documents merged again, %d to process, %d to renumber" % \
+                (len(remerged_ids),len(lineage_ids),len(interval_taxids)))
+        stats = self.incremental["stats"]
+        stats.depths.subtract(previous.depth[previous.indices(interval_taxids)].tolist())
+        stats.depths.update(tree.depth[tree.indices(interval_taxids)].tolist())
+        jobs = []
+        for ids in iter_n(remerged_ids,math.ceil(len(remerged_ids) / num_parts) or 1):
+            jobs.append((post_merge_worker,{"_id" : {"$in" : ids}}))
+        # already post-merged by previous build
+        replace_worker = partial(post_merge_worker,replace=True)
+        for ids in iter_n(lineage_ids,math.ceil(len(lineage_ids) / num_parts) or 1):
+            jobs.append((replace_worker,{"_id" : {"$in" : ids}}))
+        for taxids in iter_n(interval_taxids,math.ceil(len(interval_taxids) / num_parts) or 1):
+            jobs.append((nested_set_worker,taxids))
+        return jobs
+
+    def get_partitions(self, taxids, num_parts):
+        """
+        Split _ids (strings, thus in lexicographic order) into num_parts
+        ranges of similar size, returned as mongo queries. First and last
+        ranges are open so docs not part of nodes are processed too.
+        """
+        ids = sorted([str(taxid) for taxid in taxids])
+        step = math.ceil(len(ids) / num_parts) or 1
+        queries = []
+        lower = None
+        for upper in ids[step::step] + [None]:
+            query = {}
+            if lower is not None:
+                query["$gte"] = lower
+            if upper is not None:
+                query["$lt"] = upper
+            queries.append(query and {"_id" : query} or {})
+            lower = upper
+        return queries
+
+    def save_profile(self, stage, result):
+        try:
+            save_build_profile(self.target_backend.target_name,stage,result)
+        except Exception as e:
+            self.logger.warning("Can't save '%s' profile: %s" % (stage,e))
+
+    def save_upload_profiles(self):
+        """
+        Copy profiles of the uploads this build uses into build document,
+        under "profile.upload", so the whole pipeline can be compared over builds
+        """
+        profiles = {}
+        for src in get_src_dump().find({"_id" : {"$in" : self.build_config.get("sources",[])}},{"upload" : 1}):
+            for name,job in src.get("upload",{}).get("jobs",{}).items():
+                if job.get("profile"):
+                    profiles[name] = job["profile"]
+        self.save_profile("upload",profiles)
+
+    def get_artifact_file(self):
+        return os.path.join(config.DATA_ARCHIVE_ROOT,"taxonomy_tree","%s.tree" % self.target_backend.target_name)
+
+    def prune_artifacts(self):
+        """
+        Delete tree artifacts and taxid alias tables of builds whose target
+        collection was deleted, except the ones of the BUILD_ARTIFACTS_KEEP
+        most recent builds (their index may still be published)
+        """
+        existing = set(get_target_db().collection_names())
+        for folder,ext in [("taxonomy_tree","tree"),("taxid_aliases","npz")]:
+            paths = glob.glob(os.path.join(config.DATA_ARCHIVE_ROOT,folder,"*.%s" % ext))
+            paths.sort(key=os.path.getmtime,reverse=True)
+            for path in paths[config.BUILD_ARTIFACTS_KEEP:]:
+                if os.path.basename(path)[:-len(ext) - 1] in existing:
+                    continue
+                # web processes still mapping it keep their copy
+                os.unlink(path)
+                self.logger.info("Deleted '%s' (target collection doesn't exist anymore)" % path)
+
+    def iter_names(self):
+        """
+        Yield (taxid, field, name) of all names found in target collection
+        """
+        col = self.target_backend.target_collection
+        for doc in doc_feeder(col, step=10000, fields=NAME_FIELDS, logger=self.logger):
+            if not doc["_id"].isdigit():
+                continue
+            taxid = int(doc["_id"])
+            for field in NAME_FIELDS:
+                value = doc.get(field)
+                if type(value) is list:
+                    for name in value:
+                        yield (taxid,field,name)
+                elif value:
+                    yield (taxid,field,value)
+
+    @profiled("post_merge")
     def post_merge(self, source_names, batch_size, job_manager):
-        # get the lineage mapper
+        self.save_upload_profiles()
+        # get the lineage mapper (also computes nested-set left/right/depth)
         mapper = LineageMapper(name="lineage")
         # load cache (it's being loaded automatically
         # as it's not part of an upload process
-        mapper.load()
+        with StageProfiler("lineage_mapper_load") as profiler:
+            mapper.load()
+        self.save_profile(profiler.stage,profiler.result)
+        # complete the tree with has_gene flags and names, and store it as the
+        # build's tree artifact: workers memory-map this same read-only copy,
+        # as does the web app once published
+        has_gene = HasGeneMapper(name="has_gene")
+        with StageProfiler("has_gene_mapper_load") as profiler:
+            has_gene.load()
+        self.save_profile(profiler.stage,profiler.result)
+        taxids = mapper.tree.taxid
+        mapper.tree.has_gene = taxids < len(has_gene.cache)
+        mapper.tree.has_gene[mapper.tree.has_gene] = has_gene.cache[taxids[mapper.tree.has_gene]]
+        del has_gene
+        # per-node descendant counts, stored on docs by workers
+        mapper.tree.compute_aggregates()
+        mapper.tree.set_names(self.iter_names())
+        # /lca index, shared by web processes through the artifact
+        mapper.tree.compute_lca_index()
+        artifact = self.get_artifact_file()
+        mapper.save(artifact,self.target_backend.target_name)
+        self.logger.info("Tree artifact saved to '%s'" % artifact)
 
-        # create a storage to save docs back to merged collection
-        db = get_target_db()
         col_name = self.target_backend.target_collection.name
-        storage = UpsertStorage(db,col_name)
+        num_parts = max(1,config.HUB_MAX_WORKERS) * 4
+        if getattr(self,"incremental",None):
+            partitions = self.get_incremental_jobs(mapper.tree,num_parts)
+            build_stats = self.incremental["stats"]
+        else:
+            build_stats = BuildStats()
+            partitions = [(post_merge_worker,query) for query in \
+                    self.get_partitions(mapper.tree.taxid.tolist(),num_parts)]
+        tree = mapper.tree
+        del mapper
+
+        async def defer(pinfo, func):
+            job = await job_manager.defer_to_process(pinfo,func)
+            return await job
 
-        for docs in doc_feeder(self.target_backend.target_collection, step=batch_size, inbatch=True):
-            docs = mapper.process(docs)
-            storage.process(docs,batch_size)
+        # we're running in a thread, jobs are submitted to the hub's loop
+        t0 = time.time()
+        futures = {}
+        for num,(worker,query) in enumerate(partitions):
+            pinfo = self.get_pinfo()
+            pinfo["step"] = "post-merge"
+            pinfo["description"] = "#%d/%d" % (num + 1,len(partitions))
+            func = partial(worker,col_name,query,artifact,batch_size)
+            fut = asyncio.run_coroutine_threadsafe(defer(pinfo,func),job_manager.loop)
+            futures[fut] = num + 1
+        total = 0
+        got_error = None
+        for i,fut in enumerate(concurrent.futures.as_completed(futures)):
+            try:
+                cnt,stats = fut.result()
+            except Exception as e:
+                self.logger.exception("Post-merge partition #%d/%d failed: %s" % (futures[fut],len(partitions),e))
+                got_error = e
+                continue
+            total += cnt
+            if stats:
+                build_stats.update(stats)
+            self.logger.info("Post-merge partition #%d/%d done: %d documents (%d/%d partitions, %d documents so far) [%s]" % \
+                    (futures[fut],len(partitions),cnt,i + 1,len(partitions),total,timesofar(t0)))
+        if got_error:
+            raise got_error
+        # stats are collected while streaming docs, used by get_metadata()
+        self.build_stats = build_stats
 
         # add indices used to create metadata stats
         keys = ["rank","taxid"]
@@ -30,24 +433,28 @@ class TaxonomyDataBuilder(DataBuilder):
         for k in keys:
             self.target_backend.target_collection.ensure_index(k)
 
+        self.save_taxid_aliases(tree)
+        if hasattr(self,"uploads"):
+            self.save_state(tree)
+        try:
+            self.prune_artifacts()
+        except Exception as e:
+            self.logger.warning("Can't prune previous builds' artifacts: %s" % e)
+
+        return total
+
+    @profiled("get_metadata")
     def get_metadata(self, sources, job_manager):
         self.logger.info("Computing metadata...")
         # we want to compute it from scratch
         meta = {"__REPLACE__":True}
-        col = self.target_backend.target_collection
-        # disctint count of taxid
-        cur = col.aggregate([{"$group": {"_id": "distinct_taxid", "count": {"$addToSet": "$taxid"}}},
-            {"$project":{"count":{"$size":"$count"}}}])
-        res = list(cur)
-        assert len(res) == 1
-        distinct_taxid = res[0]["count"]
-        meta["unique taxonomy ids"] = distinct_taxid
-        # count per rank
-        cur = col.aggregate(pipeline=[{"$group": {"_id": "$rank", "count": { "$sum": 1 }}}])
-        res = list(cur)
-        meta["distribution of taxonomy ids by rank"] = {}
-        for rank_info in res:
-            meta["distribution of taxonomy ids by rank"].update({rank_info["_id"] : rank_info["count"]})
+        build_stats = getattr(self,"build_stats",None)
+        if build_stats is None:
+            # post-merge didn't run in this build, stream the stats fields only
+            build_stats = BuildStats()
+            col = self.target_backend.target_collection
+            for doc in doc_feeder(col, step=10000, fields=BuildStats.FIELDS, logger=self.logger):
+                build_stats.add(doc)
+        meta.update(build_stats.get_metadata())
         self.logger.info("Metadata: %s" % meta)
         return meta
-
@@ -1,3 +1,6 @@
+import os
+import numpy as np
+
 import biothings, config
 biothings.config_for_app(config)
 from biothings.utils.common import loadobj
@@ -6,6 +9,7 @@ import biothings.hub.databuild.mapper as mapper
 # just to get the collection name
 from ..dataload.sources.geneinfo.uploader import GeneInfoUploader
 from ..dataload.sources.taxonomy.uploader import TaxonomyNodesUploader
+from utils.tree import TaxonomyTree, RANK_CODES, NO_RANK
 
 
 class HasGeneMapper(mapper.BaseMapper):
@@ -14,48 +18,120 @@ class HasGeneMapper(mapper.BaseMapper):
         super(HasGeneMapper,self).__init__(*args,**kwargs)
         self.cache = None
 
+    def get_cache_filename(self):
+        """
+        Return path to the has_gene bitmap file of current geneinfo upload,
+        stored in its data folder and named after its release/upload time
+        (so a new upload implies a new bitmap). None if no upload info.
+        """
+        src_doc = mongo.get_src_dump().find_one({"_id":GeneInfoUploader.name}) or {}
+        job = src_doc.get("upload",{}).get("jobs",{}).get(GeneInfoUploader.name,{})
+        release = job.get("release") or src_doc.get("release")
+        data_folder = job.get("data_folder") or src_doc.get("data_folder")
+        if not release or not data_folder:
+            return None
+        version = "%s" % release
+        started_at = job.get("started_at")
+        if hasattr(started_at,"strftime"):
+            version += "_%s" % started_at.strftime("%Y%m%d%H%M%S")
+        return os.path.join(data_folder,"has_gene_%s.npy" % version)
+
+    def build_cache(self,taxids):
+        """
+        Return has_gene bitmap indexed by taxid, built in one pass
+        over taxids (iterable of int) having at least one gene
+        """
+        taxids = np.fromiter(taxids,dtype=np.int64)
+        cache = np.zeros(taxids.max() + 1 if len(taxids) else 0,dtype=bool)
+        cache[taxids] = True
+        return cache
+
     def load(self):
         if self.cache is None:
-            # this is a whole dict containing all taxonomu _ids
+            cache_file = self.get_cache_filename()
+            if cache_file and os.path.exists(cache_file):
+                self.cache = np.load(cache_file,mmap_mode="r")
+                return
             col = mongo.get_src_db()[GeneInfoUploader.name]
-            self.cache = [d["_id"] for d in col.find({},{"_id":1})]
+            cache = self.build_cache(int(d["_id"]) for d in col.find({},{"_id":1}))
+            if cache_file:
+                # several merger processes may build it at the same time,
+                # write then rename so readers never see a partial file
+                tmp_file = "%s.%d.tmp" % (cache_file,os.getpid())
+                with open(tmp_file,"wb") as fout:
+                    np.save(fout,cache)
+                os.rename(tmp_file,cache_file)
+                cache = np.load(cache_file,mmap_mode="r")
+            self.cache = cache
 
     def process(self,docs):
         for doc in docs:
-            if doc["_id"] in self.cache:
-                doc["has_gene"] = True
-            else:
-                doc["has_gene"] = False
+            taxid = int(doc["_id"])
+            doc["has_gene"] = bool(taxid < len(self.cache) and self.cache[taxid])
             yield doc
 
 
 class LineageMapper(mapper.BaseMapper):
 
-    def __init__(self, *args, **kwargs):
-        super(LineageMapper,self).__init__(*args,**kwargs)
-        self.cache = None
+    def __init__(self, name=None, artifact=None, *args, **kwargs):
+        """
+        If artifact is given, tree and lineages are memory-mapped from
+        this file (see save()) instead of being computed from nodes collection
+        """
+        super(LineageMapper,self).__init__(name,*args,**kwargs)
+        self.artifact = artifact
+        self.tree = None
+
+    def save(self,path,version=None):
+        self.tree.save_artifact(path,version)
 
     def load(self):
-        if self.cache is None:
+        if self.tree is None and self.artifact:
+            self.tree = TaxonomyTree.load_artifact(self.artifact)
+        if self.tree is None:
             col = mongo.get_src_db()[TaxonomyNodesUploader.name]
-            self.cache = {}
-            [self.cache.setdefault(d["taxid"],d["parent_taxid"]) for d in col.find({},{"parent_taxid":1,"taxid":1})]
+            taxids = []
+            parents = []
+            ranks = []
+            for d in col.find({},{"parent_taxid":1,"taxid":1,"rank":1}):
+                taxids.append(d["taxid"])
+                parents.append(d["parent_taxid"])
+                ranks.append(RANK_CODES.get(d.get("rank"),NO_RANK))
+            self.build_tree(taxids,parents,ranks)
+
+    def build_tree(self,taxids,parents,ranks=None):
+        self.tree = TaxonomyTree(taxids,parents,ranks)
+        # all lineages are computed at once, process() only slices them
+        self.tree.compute_lineages()
 
     def get_lineage(self,doc):
-        if doc['taxid'] == doc['parent_taxid']: #take care of node #1
-            # we reached the top of the taxonomy tree
-            doc['lineage'] = [doc['taxid']]
+        idx = self.tree.index(doc['taxid'])
+        if idx >= 0:
+            doc['lineage'] = self.tree.lineage(idx)
             return doc
-        # initiate lineage with information we have in the current doc
-        lineage = [doc['taxid'], doc['parent_taxid']]
-        while lineage[-1] != 1:
-            parent = self.cache[lineage[-1]]
-            lineage.append(parent)
+        # not part of nodes, attach it to its parent's lineage if we know it
+        lineage = [doc['taxid']]
+        pidx = self.tree.index(doc.get('parent_taxid',doc['taxid']))
+        if pidx >= 0:
+            lineage.extend(self.tree.lineage(pidx))
         doc['lineage'] = lineage
         return doc
 
+    def get_nested_set(self,doc,idx):
+        # pre-order interval (left/right), depth and, if computed
+        # (see TaxonomyTree.compute_aggregates()), subtree counts
+        doc.update(self.tree.subtree_fields(idx))
+        return doc
+
     def process(self,docs):
-        for doc in docs:
-            doc = self.get_lineage(doc)
+        docs = list(docs)
+        indices = self.tree.indices([doc['taxid'] for doc in docs])
+        for doc,idx in zip(docs,indices.tolist()):
+            if idx >= 0:
+                # slicing the lineage table is ~3x faster than walking parents,
+                # gathering a whole batch at once brings nothing more (see benchmarks.lineage)
+                doc['lineage'] = self.tree.lineage(idx)
+                doc = self.get_nested_set(doc,idx)
+            else:
+                doc = self.get_lineage(doc)
             yield doc
-
@@ -0,0 +1,60 @@
+from collections import Counter
+
+
+class BuildStats(object):
+    """
+    Build metadata statistics, accumulated document per document while
+    post-merge streams them, and summed over post-merge jobs. Counts can be
+    removed too (count=-1), so an incremental build can update previous
+    build's statistics with only the documents it processed again.
+    """
+
+    FIELDS = ["taxid","rank","has_gene","depth"]
+
+    def __init__(self):
+        self.taxids = 0
+        self.has_gene = 0
+        self.ranks = Counter()
+        # depth histogram rather than max depth, so counts can be removed
+        self.depths = Counter()
+
+    def add(self,doc,count=1):
+        # one document per taxid, counting docs with a taxid counts distinct taxids
+        if "taxid" in doc:
+            self.taxids += count
+        if doc.get("has_gene"):
+            self.has_gene += count
+        # docs without rank are counted under None, like the former $group on rank
+        self.ranks[doc.get("rank")] += count
+        if "depth" in doc:
+            self.depths[doc["depth"]] += count
+
+    def update(self,other,count=1):
+        self.taxids += count * other.taxids
+        self.has_gene += count * other.has_gene
+        for rank,cnt in other.ranks.items():
+            self.ranks[rank] += count * cnt
+        for depth,cnt in other.depths.items():
+            self.depths[depth] += count * cnt
+
+    def to_dict(self):
+        return {"taxids" : self.taxids, "has_gene" : self.has_gene,
+                # stored as JSON/BSON, keys must be strings
+                "ranks" : dict(("null" if rank is None else rank,cnt) for rank,cnt in self.ranks.items()),
+                "depths" : dict((str(depth),cnt) for depth,cnt in self.depths.items())}
+
+    @classmethod
+    def from_dict(klass,data):
+        stats = klass()
+        stats.taxids = data["taxids"]
+        stats.has_gene = data["has_gene"]
+        stats.ranks.update(dict((None if rank == "null" else rank,cnt) for rank,cnt in data["ranks"].items()))
+        stats.depths.update(dict((int(depth),cnt) for depth,cnt in data["depths"].items()))
+        return stats
+
+    def get_metadata(self):
+        depths = [depth for depth,cnt in self.depths.items() if cnt > 0]
+        return {"unique taxonomy ids" : self.taxids,
+                "distribution of taxonomy ids by rank" : dict((rank,cnt) for rank,cnt in self.ranks.items() if cnt > 0),
+                "taxonomy ids with gene" : self.has_gene,
+                "max depth" : max(depths) if depths else 0}
@@ -1,4 +1,7 @@
+import asyncio
+
 import biothings.hub.dataindex.indexer as indexer
+from hub.profiler import StageProfiler, save_build_profile
 
 
 class TaxonomyIndexer(indexer.Indexer):
@@ -9,5 +12,26 @@ class TaxonomyIndexer(indexer.Indexer):
                 "include_in_all": False,
                 "type": "long"
                 }
+        # nested-set interval, descendants of X: left in [X.left,X.right]
+        # subtree counts: descendants, with gene, of species rank
+        for field in ["left","right","depth","num_descendants","num_gene_descendants","num_species_descendants"]:
+            mapping["properties"][field] = {
+                    "include_in_all": False,
+                    "type": "long"
+                    }
 
         return mapping
+
+    @asyncio.coroutine
+    def index(self, target_name, index_name, job_manager, **kwargs):
+        # CPU/memory figures include whatever else the hub does meanwhile
+        profiler = StageProfiler("index")
+        try:
+            with profiler:
+                res = yield from super(TaxonomyIndexer,self).index(target_name,index_name,job_manager,**kwargs)
+            return res
+        finally:
+            try:
+                save_build_profile(target_name,"index",profiler.result)
+            except Exception as e:
+                self.logger.warning("Can't save index profile: %s" % e)
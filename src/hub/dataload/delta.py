@@ -0,0 +1,126 @@
+import os
+import glob
+import json
+import time
+import hashlib
+
+import numpy as np
+
+
+def doc_digest(doc):
+    """
+    Return a 64-bit digest of doc content
+    """
+    data = json.dumps(doc,sort_keys=True).encode()
+    return int.from_bytes(hashlib.blake2b(data,digest_size=8).digest(),"little",signed=True)
+
+
+def compute_delta(old_ids,old_digests,new_ids,new_digests):
+    """
+    Compare two uploads given as (sorted _ids, digests) arrays and
+    return (changed, removed) _ids: changed are new or modified in new
+    upload, removed are only in old upload.
+    """
+    pos = np.searchsorted(old_ids,new_ids)
+    found = pos < len(old_ids)
+    found[found] = old_ids[pos[found]] == new_ids[found]
+    same = np.zeros(len(new_ids),dtype=bool)
+    same[found] = old_digests[pos[found]] == new_digests[found]
+    changed = new_ids[~same]
+    removed = old_ids[~np.isin(old_ids,new_ids,assume_unique=True)]
+    return changed, removed
+
+
+class DeltaUploader(object):
+    """
+    Uploader mixin computing, for each upload, which (numeric) _ids changed
+    compared to previous upload, so builds can be incremental.
+
+    While data is loaded (in one or more worker processes, see
+    hub.dataload.shard), a digest of each document is computed (digest_docs())
+    and stored in data folder. After upload, digests are compared to the previous
+    upload's ones, kept in the source's root folder, and the delta is stored as
+    "<name>_delta.json" in data folder:
+
+        {"id": upload id, "base": previous upload id (None if no previous),
+         "changed": [_ids], "removed": [_ids], ...extra}
+    """
+
+    def get_digest_file(self,data_folder,part=None):
+        if part is None:
+            return os.path.join(data_folder,"%s_digest.npz" % self.name)
+        return os.path.join(data_folder,"%s_digest.%d.npz" % (self.name,part))
+
+    def get_digest_files(self,data_folder):
+        return glob.glob(self.get_digest_file(data_folder)) + \
+               glob.glob(os.path.join(data_folder,"%s_digest.*.npz" % self.name))
+
+    def clear_digests(self,data_folder):
+        for digest_file in self.get_digest_files(data_folder):
+            os.unlink(digest_file)
+
+    def get_last_digest_file(self,data_folder):
+        # digest of last upload, whatever data folder it was from
+        return os.path.join(os.path.dirname(os.path.abspath(data_folder)),"%s_last_digest.npz" % self.name)
+
+    def get_delta_file(self,data_folder):
+        return os.path.join(data_folder,"%s_delta.json" % self.name)
+
+    def digest_docs(self,docs,data_folder,part=None):
+        """
+        Yield docs, storing their digests once all are consumed. part
+        is the shard number when data is loaded by several processes.
+        """
+        ids = []
+        digests = []
+        for doc in docs:
+            ids.append(int(doc["_id"]))
+            digests.append(doc_digest(doc))
+            yield doc
+        np.savez(self.get_digest_file(data_folder,part),ids=np.array(ids,dtype=np.int64),
+                 digests=np.array(digests,dtype=np.int64))
+
+    def get_delta_extra(self,data_folder,delta):
+        """
+        Return dict of extra information stored in delta file
+        """
+        return {}
+
+    def compute_delta(self,data_folder):
+        digest_files = self.get_digest_files(data_folder)
+        if not digest_files:
+            self.logger.warning("No digest found in '%s', can't compute delta" % data_folder)
+            return None
+        parts = [np.load(digest_file) for digest_file in digest_files]
+        ids = np.concatenate([part["ids"] for part in parts])
+        digests = np.concatenate([part["digests"] for part in parts])
+        order = np.argsort(ids,kind="mergesort")
+        new = {"ids" : ids[order], "digests" : digests[order],
+               "upload_id" : "%s_%d" % (os.path.basename(os.path.abspath(data_folder)),time.time())}
+        last_digest_file = self.get_last_digest_file(data_folder)
+        delta = {"id": new["upload_id"], "base": None}
+        if os.path.exists(last_digest_file):
+            old = np.load(last_digest_file)
+            changed,removed = compute_delta(old["ids"],old["digests"],new["ids"],new["digests"])
+            delta.update({"base": str(old["upload_id"]),
+                          "changed": changed.tolist(), "removed": removed.tolist()})
+            self.logger.info("Delta against upload '%s': %d changed, %d removed" % \
+                    (delta["base"],len(changed),len(removed)))
+        delta.update(self.get_delta_extra(data_folder,delta))
+        with open(self.get_delta_file(data_folder),"w") as fout:
+            json.dump(delta,fout)
+        # this upload is now the reference for next one
+        tmp_file = "%s.tmp.npz" % last_digest_file[:-4]
+        np.savez(tmp_file,ids=new["ids"],digests=new["digests"],upload_id=np.array(new["upload_id"]))
+        os.rename(tmp_file,last_digest_file)
+        self.clear_digests(data_folder)
+        return delta
+
+    async def update_data(self, *args, **kwargs):
+        # digests left by a previous (failed, or differently sharded) upload
+        self.clear_digests(self.data_folder)
+        return await super(DeltaUploader,self).update_data(*args,**kwargs)
+
+    def post_update_data(self, steps, force, batch_size, job_manager, **kwargs):
+        super(DeltaUploader,self).post_update_data(steps,force,batch_size,job_manager,**kwargs)
+        self.compute_delta(self.data_folder)
@@ -0,0 +1,115 @@
+"""
+Byte ranges of flat files, so they can be parsed by several processes
+(see hub.dataload.shard). Kept free of hub dependencies, so they can be tested alone.
+"""
+
+import os
+
+
+def find_shards(path,num_shards,key=None,start=0):
+    """
+    Split file path, from offset start, into at most num_shards (start,end)
+    byte ranges of similar size, each made of complete lines. If key is given,
+    consecutive lines with the same key(line) are kept in the same range.
+    """
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path,"rb") as fin:
+        for i in range(1,num_shards):
+            pos = max(start + (size - start) * i // num_shards,bounds[-1])
+            if pos >= size:
+                break
+            # move to the beginning of next line
+            if pos > 0:
+                fin.seek(pos - 1)
+                fin.readline()
+                pos = fin.tell()
+            else:
+                fin.seek(pos)
+            if key is not None:
+                # and past the lines sharing the key of that one
+                group = key(fin.readline())
+                while True:
+                    pos = fin.tell()
+                    line = fin.readline()
+                    if not line or key(line) != group:
+                        break
+            bounds.append(min(pos,size))
+    bounds.append(size)
+    return [(s,e) for s,e in zip(bounds,bounds[1:]) if e > s]
+
+
+class FileRange(object):
+    """
+    Binary file-like object reading [start,end) bytes of file path
+    """
+
+    def __init__(self,path,start,end):
+        self.fileh = open(path,"rb")
+        self.fileh.seek(start)
+        self.remaining = end - start
+
+    def read(self,size=-1):
+        if not self.remaining:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileh.read(size)
+        self.remaining -= len(data)
+        if not self.remaining:
+            self.fileh.close()
+        return data
+
+
+def split_file(fileobj,size,paths,key=None,chunk_size=8*1024*1024):
+    """
+    Write the size bytes of binary file-like fileobj into files paths, of similar
+    size and made of complete lines, reading fileobj only once (e.g. a tarball
+    member, decompressed while read). If key is given, consecutive lines with the
+    same key(line) are written to the same file. Return paths actually written
+    (empty ones are left out).
+    """
+    done = 0
+    # line read past the end of previous file
+    pending = b""
+    written = []
+    for i,path in enumerate(paths):
+        if not pending and done >= size:
+            break
+        last = i == len(paths) - 1
+        end = size if last else max(size * (i + 1) // len(paths),done)
+        start = done - len(pending)
+        with open(path,"wb") as fout:
+            fout.write(pending)
+            # beginning of last line written, if not complete
+            tail = b"" if pending.endswith(b"\n") else pending
+            pending = b""
+            while done < end:
+                data = fileobj.read(min(chunk_size,end - done))
+                if not data:
+                    break
+                done += len(data)
+                fout.write(data)
+                eol = data.rfind(b"\n")
+                tail = data[eol + 1:] if eol >= 0 else tail + data
+            if not last:
+                # move to the end of last line
+                if tail:
+                    line = fileobj.readline()
+                    done += len(line)
+                    fout.write(line)
+                if key is not None:
+                    # and past the lines sharing the key of next one
+                    line = fileobj.readline()
+                    done += len(line)
+                    group = key(line) if line else None
+                    while line and key(line) == group:
+                        fout.write(line)
+                        line = fileobj.readline()
+                        done += len(line)
+                    pending = line
+        if done - len(pending) > start:
+            written.append(path)
+        else:
+            os.unlink(path)
+    return written
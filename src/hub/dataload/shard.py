@@ -0,0 +1,32 @@
+import os
+
+import biothings.hub.dataload.uploader as uploader
+import config
+from hub.dataload.filerange import find_shards
+
+
+class ShardedUploader(uploader.ParallelizedSourceUploader):
+    """
+    Uploader parsing one flat file by shards (byte ranges), each one parsed
+    and stored by a separate process. Subclasses implement the uploader's
+    load_data as load_data(data_folder,start,end,part), parsing [start,end)
+    bytes of the file (part being the shard number), or the whole file if
+    start is None.
+    """
+
+    # flat file name, in data folder
+    shard_file = None
+    # if set, function returning a key for a line (bytes), lines with the
+    # same key being parsed into the same document(s)
+    shard_key = None
+
+    def get_shard_file(self,data_folder):
+        return os.path.join(data_folder,self.shard_file)
+
+    def get_shards(self,path):
+        return find_shards(path,max(1,config.UPLOAD_NUM_SHARDS),key=self.shard_key)
+
+    def jobs(self):
+        shards = self.get_shards(self.get_shard_file(self.data_folder))
+        self.logger.info("Uploading '%s' in %d shard(s)" % (self.shard_file,len(shards)))
+        return [(self.data_folder,start,end,part) for part,(start,end) in enumerate(shards)]
@@ -1,10 +1,29 @@
+import gzip
+import re
 
-def parse_geneinfo_taxid(fileh):
-
-    for line in fileh:
-        if line.startswith("#"):
-            # skip header
-            continue
-        taxid = line.split("\t")[0]
-        yield {"_id" : taxid}
+# taxid is the first column, header line starts with "#" so it never matches
+TAXID_PAT = re.compile(rb"^(\d+)\t", re.M)
 
+def parse_geneinfo_taxid(gene_file, chunk_size=16*1024*1024):
+    """
+    Stream (compressed) gene_info file and yield one {"_id": taxid} per
+    unique taxid. Data is read by chunks, taxids found per chunk with a
+    regex and deduplicated in memory (only a few tens of thousands of
+    taxids, out of tens of millions of gene lines).
+    """
+    taxids = set()
+    opener = gzip.open if gene_file.endswith(".gz") else open
+    with opener(gene_file,"rb") as fileh:
+        tail = b""
+        while True:
+            chunk = fileh.read(chunk_size)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            # keep last incomplete line for next chunk
+            last = chunk.rfind(b"\n") + 1
+            tail = chunk[last:]
+            taxids.update(TAXID_PAT.findall(chunk,0,last))
+        taxids.update(TAXID_PAT.findall(tail))
+    for taxid in sorted(taxids,key=int):
+        yield {"_id" : taxid.decode()}
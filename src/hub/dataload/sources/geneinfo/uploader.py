@@ -3,20 +3,25 @@ import os
 import biothings.hub.dataload.uploader as uploader
 from biothings.hub.databuild.builder import set_pending_to_build
 import biothings.hub.dataload.storage as storage
+from hub.dataload.delta import DeltaUploader
+from hub.profiler import ProfiledUploader
 from .parser import parse_geneinfo_taxid
 
-class GeneInfoUploader(uploader.BaseSourceUploader):
+class GeneInfoUploader(ProfiledUploader,DeltaUploader,uploader.BaseSourceUploader):
 
-    storage_class = storage.IgnoreDuplicatedStorage
+    # taxids are deduplicated while parsing
+    storage_class = storage.BasicStorage
 
     name = "geneinfo"
 
     def load_data(self,data_folder):
-        gene_file = os.path.join(data_folder,"gene_info")
+        gene_file = os.path.join(data_folder,"gene_info.gz")
         self.logger.info("Load data from file '%s'" % gene_file)
-        return parse_geneinfo_taxid(open(gene_file))
+        return self.digest_docs(parse_geneinfo_taxid(gene_file),data_folder)
 
     def post_update_data(self, steps, force, batch_size, job_manager):
+        # delta is used by incremental builds (has_gene changed for these taxids)
+        super(GeneInfoUploader,self).post_update_data(steps,force,batch_size,job_manager)
         # trigger a merge/build
         set_pending_to_build()
 
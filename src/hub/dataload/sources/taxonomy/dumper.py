@@ -5,7 +5,6 @@ biothings.config_for_app(config)
 
 from config import DATA_ARCHIVE_ROOT
 from biothings.hub.dataload.dumper import FTPDumper
-from biothings.utils.common import untargzall
 
 
 class TaxonomyDumper(FTPDumper):
@@ -29,6 +28,3 @@ class TaxonomyDumper(FTPDumper):
         if force or not os.path.exists(current_localfile) or self.remote_is_better(file_to_dump, current_localfile):
             # register new release (will be stored in backend)
             self.to_dump.append({"remote": file_to_dump, "local":new_localfile})
-
-    def post_dump(self, *args, **kwargs):
-        untargzall(self.new_data_folder)
@@ -1,59 +1,142 @@
-from itertools import groupby
-from collections import defaultdict
+"""
+Parsers for NCBI taxdump files. Both work on binary files (open(...,"rb") or
+tarfile members), read by large chunks split on the "\t|\t" and "\t|\n"
+delimiters, and only decode to str the fields actually emitted.
+
+Throughput target: names.dmp (3.5M+ lines, re-uploaded daily) must parse at
+750K lines/s or more on one core, that is under 5s for the whole file (about
+twice as fast as the previous line by line text parser). nodes.dmp parsing is
+bound by building the output documents, around 700K lines/s. Check with:
+
+    python -m benchmarks.suite <folder> --stages parse_names parse_nodes
+"""
+
+DELIM = b"\t|\t"
+EOL = b"\t|\n"
+# names.dmp: tax_id, name_txt, unique name, name class
+NAMES_NUM_FIELDS = 4
+
+# name classes codes
+SCIENTIFIC_NAME, COMMON_NAME, GENBANK_COMMON_NAME, OTHER_NAME = range(4)
+#Collapse all the following fields into "synonyms"
+OTHER_NAMES = ["acronym","anamorph","blast name","equivalent name","genbank acronym","genbank anamorph",
+"genbank synonym","includes","misnomer","misspelling","synonym","teleomorph"]
+NAME_CLASS_CODES = {b"scientific name": SCIENTIFIC_NAME,
+                    b"common name": COMMON_NAME,
+                    b"genbank common name": GENBANK_COMMON_NAME}
+NAME_CLASS_CODES.update({name.encode(): OTHER_NAME for name in OTHER_NAMES})
+# keep separate: "common name", "genbank common name"
+NAME_CLASS_KEYS = {COMMON_NAME: "common_name", GENBANK_COMMON_NAME: "genbank_common_name"}
+
+
+def iter_chunks(fileh, chunk_size=8*1024*1024):
+    """
+    Read binary fileh by chunks of about chunk_size bytes,
+    each chunk ending with a complete line.
+    """
+    tail = b""
+    while True:
+        data = fileh.read(chunk_size)
+        if not data:
+            break
+        data = tail + data
+        last = data.rfind(EOL)
+        # no complete line yet if the line is longer than chunk_size
+        last = last + len(EOL) if last >= 0 else 0
+        tail = data[last:]
+        if last:
+            yield data[:last]
+    if tail.strip():
+        # last line without newline
+        yield tail.rstrip(b"\n") + b"\n"
+
+
+def line_taxid(line):
+    """
+    Return taxid (bytes) of a names.dmp/nodes.dmp line, names.dmp lines
+    of a same taxid being parsed into one document
+    """
+    return line.split(DELIM, 1)[0]
 
 
 def parse_refseq_names(names_file):
     '''
-    names_file is a file-like object yielding 'names.dmp' from taxdump.tar.gz
-    '''
-    #Collapse all the following fields into "synonyms"
-    other_names = ["acronym","anamorph","blast name","equivalent name","genbank acronym","genbank anamorph",
-    "genbank synonym","includes","misnomer","misspelling","synonym","teleomorph"]
-    # keep separate: "common name", "genbank common name"
-    names_gb = groupby(names_file, lambda x: x[:x.index('\t')])
-    for taxid, entry in names_gb:
-        d = defaultdict(list)
-        d['taxid'] = int(taxid)
-        d['_id'] = taxid
-        for line in entry:
-            split_line = line.split('\t')
-            field = split_line[6]
-            value = split_line[2].lower()
-            if field == 'scientific name':
-                d['scientific_name'] = value #only one per entry. Store as str (not in a list)
-            elif field in other_names:
-                d['other_names'].append(value) #always a list
-            elif field == "common name":
-                if d['common_name'] == []: #empty
-                    d['common_name'] = value # set as string
-                elif type(d['common_name']) == str: # has a single entry
-                    d['common_name'] = [d['common_name']] #make it a list
-                    d['common_name'].append(value)
-                else:
-                    d['common_name'].append(value)
-            elif field == "genbank common name":
-                if d['genbank_common_name'] == []: #empty
-                    d['genbank_common_name'] = value # set as string
-                elif type(d['genbank_common_name']) == str: # has a single entry
-                    d['genbank_common_name'] = [d['genbank_common_name']] #make it a list
-                    d['genbank_common_name'].append(value)
+    names_file is a binary file-like object yielding 'names.dmp' from taxdump.tar.gz
+    '''
+    codes = NAME_CLASS_CODES
+    keys = NAME_CLASS_KEYS
+    current = None
+    for chunk in iter_chunks(names_file):
+        # names.dmp has a fixed number of fields, so the whole chunk can be
+        # split at once and fields taken by stride
+        fields = chunk.replace(EOL, DELIM).split(DELIM)
+        n = NAMES_NUM_FIELDS
+        for taxid, name, name_class in zip(fields[0::n], fields[1::n], fields[3::n]):
+            if taxid != current:
+                if current is not None:
+                    yield doc
+                current = taxid
+                doc = {"taxid": int(taxid), "_id": taxid.decode()}
+            code = codes.get(name_class)
+            if code is SCIENTIFIC_NAME:
+                doc["scientific_name"] = name.decode().lower() #only one per entry. Store as str (not in a list)
+            elif code is OTHER_NAME:
+                other_names = doc.get("other_names")
+                if other_names is None:
+                    doc["other_names"] = [name.decode().lower()] #always a list
                 else:
-                    d['genbank_common_name'].append(value)
+                    other_names.append(name.decode().lower())
+            elif code is None:
+                # any other class is stored as a list under its own name
+                doc.setdefault(name_class.decode(), []).append(name.decode().lower())
             else:
-                d[field].append(value)
-        yield dict(d)
+                # single value stored as str, as list otherwise
+                key = keys[code]
+                value = name.decode().lower()
+                previous = doc.get(key)
+                if previous is None:
+                    doc[key] = value
+                elif type(previous) is str:
+                    doc[key] = [previous, value]
+                else:
+                    previous.append(value)
+    if current is not None:
+        yield doc
 
 
 def parse_refseq_nodes(nodes_file):
     '''
-    nodes_file is a file-like object yielding 'nodes.dmp' from taxdump.tar.gz
-    '''
-    for line in nodes_file:
-        d = dict()
-        split_line = line.split('\t')
-        taxid = split_line[0]
-        d["_id"] = taxid
-        d['taxid'] = int(taxid)
-        d['parent_taxid'] = int(split_line[2])
-        d['rank'] = split_line[4]
-        yield d
+    nodes_file is a binary file-like object yielding 'nodes.dmp' from taxdump.tar.gz
+    '''
+    ranks = {}
+    for chunk in iter_chunks(nodes_file):
+        for line in chunk.split(EOL)[:-1]:
+            taxid, parent_taxid, rank, _ = line.split(DELIM, 3)
+            rank_str = ranks.get(rank)
+            if rank_str is None:
+                rank_str = ranks[rank] = rank.decode()
+            yield {"_id": taxid.decode(),
+                   "taxid": int(taxid),
+                   "parent_taxid": int(parent_taxid),
+                   "rank": rank_str}
+
+
+def parse_refseq_merged(merged_file):
+    '''
+    merged_file is a binary file-like object yielding 'merged.dmp' from taxdump.tar.gz,
+    yields (old_taxid, new_taxid) tuples
+    '''
+    for chunk in iter_chunks(merged_file):
+        for line in chunk.split(EOL)[:-1]:
+            old_taxid, new_taxid = line.split(DELIM)
+            yield (int(old_taxid), int(new_taxid))
+
+
+def parse_refseq_delnodes(delnodes_file):
+    '''
+    delnodes_file is a binary file-like object yielding 'delnodes.dmp' from taxdump.tar.gz,
+    yields deleted taxids
+    '''
+    for chunk in iter_chunks(delnodes_file):
+        for line in chunk.split(EOL)[:-1]:
+            yield int(line)
@@ -1,18 +1,108 @@
 import os
+import tarfile
 
-import biothings.hub.dataload.uploader as uploader
-from .parser import parse_refseq_names, parse_refseq_nodes
+import config
+from hub.dataload.delta import DeltaUploader
+from hub.dataload.shard import ShardedUploader
+from hub.dataload.filerange import FileRange, split_file
+from hub.profiler import ProfiledUploader
+from .parser import parse_refseq_names, parse_refseq_nodes, \
+                    parse_refseq_merged, parse_refseq_delnodes, line_taxid
 
 
-class TaxonomyNodesUploader(uploader.BaseSourceUploader):
+def parse_file(path,parser):
+    with open(path,"rb") as fin:
+        yield from parser(fin)
+
+
+def load_dump_file(data_folder,filename,parser):
+    """
+    Parse filename with parser, streamed from taxdump.tar.gz member (nothing
+    is extracted to disk) or from data_folder if it was extracted there
+    (releases dumped before streaming mode)
+    """
+    tar_file = os.path.join(data_folder,"taxdump.tar.gz")
+    if os.path.exists(tar_file):
+        with tarfile.open(tar_file,mode="r:gz") as tar:
+            yield from parser(tar.extractfile(filename))
+    else:
+        yield from parse_file(os.path.join(data_folder,filename),parser)
+
+
+class TaxdumpUploader(ProfiledUploader,DeltaUploader,ShardedUploader):
+    """
+    Uploader for a taxdump.tar.gz member. With one shard, the member is parsed
+    while streamed from the tarball. With more, it's split into shard files
+    ("<member>.<part>", whole lines) while decompressed, once, and those are
+    parsed in parallel then removed after upload. Members extracted in data
+    folder (releases dumped before streaming mode) are parsed by byte ranges.
+    """
 
     main_source = "taxonomy"
+    shard_key = staticmethod(line_taxid)
+    parser = None
+    # shard files split from the tarball by this upload
+    part_files = None
+
+    def get_part_file(self,data_folder,part):
+        return os.path.join(data_folder,"%s.%d" % (self.shard_file,part))
+
+    def jobs(self):
+        tar_file = os.path.join(self.data_folder,"taxdump.tar.gz")
+        num_shards = max(1,config.UPLOAD_NUM_SHARDS)
+        if not os.path.exists(tar_file):
+            return super(TaxdumpUploader,self).jobs()
+        if num_shards == 1:
+            self.logger.info("Uploading '%s' streamed from '%s'" % (self.shard_file,tar_file))
+            return [(self.data_folder,None,None,None)]
+        with tarfile.open(tar_file,mode="r:gz") as tar:
+            member = tar.getmember(self.shard_file)
+            self.part_files = split_file(tar.extractfile(member),member.size,
+                    [self.get_part_file(self.data_folder,part) for part in range(num_shards)],
+                    key=self.shard_key)
+        self.logger.info("Uploading '%s' in %d shard(s)" % (self.shard_file,len(self.part_files)))
+        return [(self.data_folder,None,None,part) for part in range(len(self.part_files))]
+
+    def load_data(self,data_folder,start=None,end=None,part=None):
+        if start is not None:
+            self.logger.info("Load data from '%s' in '%s' [%d-%d]" % (self.shard_file,data_folder,start,end))
+            docs = self.parser(FileRange(os.path.join(data_folder,self.shard_file),start,end))
+        elif part is not None:
+            path = self.get_part_file(data_folder,part)
+            self.logger.info("Load data from '%s'" % path)
+            docs = parse_file(path,self.parser)
+        else:
+            self.logger.info("Load data from '%s' in '%s'" % (self.shard_file,data_folder))
+            docs = load_dump_file(data_folder,self.shard_file,self.parser)
+        return self.digest_docs(docs,data_folder,part)
+
+    def post_update_data(self, *args, **kwargs):
+        super(TaxdumpUploader,self).post_update_data(*args,**kwargs)
+        for path in self.part_files or []:
+            if os.path.exists(path):
+                os.unlink(path)
+        self.part_files = None
+
+
+class TaxonomyNodesUploader(TaxdumpUploader):
+
     name = "nodes"
+    shard_file = "nodes.dmp"
+    parser = staticmethod(parse_refseq_nodes)
 
-    def load_data(self,data_folder):
-        nodes_file = os.path.join(data_folder,"nodes.dmp")
-        self.logger.info("Load data from file '%s'" % nodes_file)
-        return parse_refseq_nodes(open(nodes_file))
+    def get_delta_extra(self,data_folder,delta):
+        # among removed taxids, tell which ones were merged into another one
+        # (merged.dmp) or deleted (delnodes.dmp). Both files are cumulative.
+        removed = set(delta.get("removed",[]))
+        extra = {"merged": {}, "deleted": []}
+        try:
+            extra["merged"] = dict((str(old),new) for old,new in \
+                    load_dump_file(data_folder,"merged.dmp",parse_refseq_merged) if old in removed)
+            extra["deleted"] = [taxid for taxid in \
+                    load_dump_file(data_folder,"delnodes.dmp",parse_refseq_delnodes) if taxid in removed]
+        except (KeyError,FileNotFoundError) as e:
+            self.logger.warning("Can't read merged/deleted taxids: %s" % e)
+        return extra
 
     @classmethod
     def get_mapping(klass):
@@ -32,16 +122,12 @@ class TaxonomyNodesUploader(uploader.BaseSourceUploader):
                 }
 
 
-class TaxonomyNamesUploader(uploader.BaseSourceUploader):
+class TaxonomyNamesUploader(TaxdumpUploader):
 
-    main_source = "taxonomy"
     name = "names"
     __metadata__ = {"mapper" : 'has_gene'}
-
-    def load_data(self,data_folder):
-        names_file = os.path.join(data_folder,"names.dmp")
-        self.logger.info("Load data from file '%s'" % names_file)
-        return parse_refseq_names(open(names_file))
+    shard_file = "names.dmp"
+    parser = staticmethod(parse_refseq_names)
 
     @classmethod
     def get_mapping(klass):
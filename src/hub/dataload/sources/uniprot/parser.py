@@ -1,8 +1,9 @@
-def parse_uniprot_speclist(uniprot_speclist):
+def parse_uniprot_speclist(uniprot_speclist, skip_header=True):
     '''
-    uniprot_speclist is a file-like object yielding 'speclist.txt'
+    uniprot_speclist is a file-like object yielding 'speclist.txt' (or part of its
+    entries, without header, if skip_header is False)
     '''
-    while True:
+    while skip_header:
         line = next(uniprot_speclist)
         if line.startswith('_____'):
             break
@@ -16,3 +17,14 @@ def parse_uniprot_speclist(uniprot_speclist):
                    "taxid": int(taxonomy_id)}
             yield doc
 
+
+
+def get_speclist_header_size(speclist_file):
+    '''
+    Return size (in bytes) of 'speclist.txt' header, entries start after it
+    '''
+    with open(speclist_file, "rb") as fin:
+        for line in fin:
+            if line.startswith(b'_____'):
+                return fin.tell()
+    raise ValueError("No header found in '%s'" % speclist_file)
@@ -1,16 +1,32 @@
+import io
 import os
 
-import biothings.hub.dataload.uploader as uploader
-from .parser import parse_uniprot_speclist
+from hub.dataload.delta import DeltaUploader
+from hub.dataload.shard import ShardedUploader
+from hub.dataload.filerange import find_shards, FileRange
+from hub.profiler import ProfiledUploader
+import config
+from .parser import parse_uniprot_speclist, get_speclist_header_size
 
-class UniprotSpeciesUploader(uploader.BaseSourceUploader):
+class UniprotSpeciesUploader(ProfiledUploader,DeltaUploader,ShardedUploader):
 
     name = "uniprot_species"
+    shard_file = "speclist.txt"
 
     __metadata__ = {"mapper" : 'has_gene'}
 
-    def load_data(self,data_folder):
+    def get_shards(self,path):
+        # shards are made of entries only, header is skipped
+        return find_shards(path,max(1,config.UPLOAD_NUM_SHARDS),start=get_speclist_header_size(path))
+
+    def load_data(self,data_folder,start=None,end=None,part=None):
         nodes_file = os.path.join(data_folder,"speclist.txt")
-        self.logger.info("Load data from file '%s'" % nodes_file)
-        return parse_uniprot_speclist(open(nodes_file))
+        if start is None:
+            self.logger.info("Load data from file '%s'" % nodes_file)
+            docs = parse_uniprot_speclist(open(nodes_file))
+        else:
+            self.logger.info("Load data from file '%s' [%d-%d]" % (nodes_file,start,end))
+            entries = io.StringIO(FileRange(nodes_file,start,end).read().decode())
+            docs = parse_uniprot_speclist(entries,skip_header=False)
+        return self.digest_docs(docs,data_folder,part)
 
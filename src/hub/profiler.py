@@ -0,0 +1,252 @@
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import datetime
+import resource
+import threading
+import tracemalloc
+from functools import wraps
+
+from biothings.utils.mongo import get_src_build, get_src_dump
+import config
+
+
+def get_rss_mb():
+    """
+    Return current resident set size (MB), None if unknown
+    """
+    try:
+        with open("/proc/self/statm") as fin:
+            return int(fin.read().split()[1]) * resource.getpagesize() / 1024. / 1024.
+    except (OSError,IndexError,ValueError):
+        return None
+
+
+def reset_peak_rss():
+    """
+    Reset process' peak RSS (Linux >= 4.0), return False if not supported,
+    in which case peak RSS is the process' lifetime one
+    """
+    try:
+        with open("/proc/self/clear_refs","w") as fout:
+            fout.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_mb():
+    try:
+        with open("/proc/self/status") as fin:
+            for line in fin:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.
+    except (OSError,IndexError,ValueError):
+        pass
+    # ru_maxrss is in KB on Linux (bytes on OSX)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024. / (1024. if sys.platform == "darwin" else 1.)
+
+
+def get_cpu_time():
+    # this process and its terminated (waited for) children
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF,resource.RUSAGE_CHILDREN)]
+    return sum([u.ru_utime + u.ru_stime for u in usage])
+
+
+class StageProfiler(object):
+    """
+    Context manager measuring a hub pipeline stage: wall time, CPU time, peak
+    RSS and RSS increase of the hub process, plus optionally the top memory
+    allocations (tracemalloc) and top functions by cumulative time (cProfile).
+    Work done by job manager worker processes isn't included in CPU and memory
+    figures, only in wall time. Result is available as self.result once done.
+    Peak RSS, tracemalloc and cProfile are process-wide: when stages overlap
+    (profilers active at the same time), peak RSS isn't reset by the later ones
+    (their "peak_rss_scope" is then "process"), tracemalloc runs until the last
+    tracing one exits and only the first one is cProfiled.
+    """
+
+    # profilers entered and not exited yet, across threads and coroutines
+    active = []
+    lock = threading.Lock()
+    # tracemalloc started by profilers (not already tracing before), and by how many
+    tracemalloc_users = 0
+
+    def __init__(self,stage,trace_malloc=None,cprofile=None,top=None):
+        self.stage = stage
+        self.trace_malloc = config.PROFILE_TRACEMALLOC if trace_malloc is None else trace_malloc
+        self.cprofile = config.PROFILE_CPROFILE if cprofile is None else cprofile
+        self.top = top or config.PROFILE_TOP
+        self.result = None
+
+    def __enter__(self):
+        self.started_at = datetime.datetime.now()
+        with StageProfiler.lock:
+            overlapping = bool(StageProfiler.active)
+            StageProfiler.active.append(self)
+            # resetting would clobber peak RSS of stages still running
+            self.peak_reset = not overlapping and reset_peak_rss()
+            self.tracing = self.trace_malloc and (StageProfiler.tracemalloc_users > 0 or not tracemalloc.is_tracing())
+            if self.tracing:
+                if StageProfiler.tracemalloc_users == 0:
+                    tracemalloc.start()
+                StageProfiler.tracemalloc_users += 1
+        self.rss = get_rss_mb()
+        # other stages' code would be recorded too (one profiler at a time anyway)
+        self.profiler = cProfile.Profile() if self.cprofile and not overlapping else None
+        if self.profiler:
+            self.profiler.enable()
+        self.cpu = get_cpu_time()
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self,exc_type,exc_value,tb):
+        wall = time.time() - self.t0
+        cpu = get_cpu_time() - self.cpu
+        rss = get_rss_mb()
+        self.result = {"started_at" : self.started_at, "success" : exc_type is None,
+                       "wall_s" : round(wall,3), "cpu_s" : round(cpu,3),
+                       "peak_rss_mb" : round(get_peak_rss_mb(),1),
+                       "peak_rss_scope" : "stage" if self.peak_reset else "process",
+                       "rss_delta_mb" : round(rss - self.rss,1) if rss is not None and self.rss is not None else None}
+        if self.profiler:
+            self.profiler.disable()
+            self.result["cprofile"] = self.get_cprofile_top()
+        if self.tracing:
+            self.result["tracemalloc"] = self.get_tracemalloc_top()
+        with StageProfiler.lock:
+            StageProfiler.active.remove(self)
+            if self.tracing:
+                StageProfiler.tracemalloc_users -= 1
+                if StageProfiler.tracemalloc_users == 0:
+                    tracemalloc.stop()
+        return False
+
+    def get_cprofile_top(self):
+        stats = pstats.Stats(self.profiler,stream=io.StringIO())
+        top = []
+        for (filename,line,func),(cc,nc,tt,ct,_) in sorted(stats.stats.items(),key=lambda e: e[1][3],reverse=True)[:self.top]:
+            top.append({"function" : "%s:%d(%s)" % (os.path.basename(filename),line,func),
+                        "ncalls" : nc, "tottime_s" : round(tt,3), "cumtime_s" : round(ct,3)})
+        return top
+
+    def get_tracemalloc_top(self):
+        snapshot = tracemalloc.take_snapshot()
+        return [{"where" : "%s:%d" % (os.path.basename(stat.traceback[0].filename),stat.traceback[0].lineno),
+                 "size_mb" : round(stat.size / 1024. / 1024.,2), "count" : stat.count}
+                for stat in snapshot.statistics("lineno")[:self.top]]
+
+
+def save_build_profile(target_name,stage,result):
+    """
+    Store a stage profile in build document (src_build), under "profile.<stage>"
+    """
+    get_src_build().update_one({"_id" : target_name},{"$set" : {"profile.%s" % stage : result}})
+
+
+def save_upload_profile(main_source,name,stage,result):
+    """
+    Store an upload stage profile in source's dump document (src_dump), under
+    "upload.jobs.<name>.profile.<stage>", copied to build documents when merged
+    """
+    get_src_dump().update_one({"_id" : main_source},{"$set" : {"upload.jobs.%s.profile.%s" % (name,stage) : result}})
+
+
+def profiled(stage):
+    """
+    Decorator running method within a StageProfiler, the result being passed
+    to instance's save_profile(stage,result)
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self,*args,**kwargs):
+            profiler = StageProfiler(stage)
+            try:
+                with profiler:
+                    return func(self,*args,**kwargs)
+            finally:
+                self.save_profile(stage,profiler.result)
+        return wrapper
+    return decorator
+
+
+class ProfiledUploader(object):
+    """
+    Uploader mixin profiling data loading (update_data(), jobs included)
+    and post-upload (post_update_data()) steps
+    """
+
+    def save_profile(self,stage,result):
+        try:
+            save_upload_profile(self.main_source,self.name,stage,result)
+        except Exception as e:
+            self.logger.warning("Can't save '%s' profile: %s" % (stage,e))
+
+    async def update_data(self, *args, **kwargs):
+        # cProfile would record any coroutine running meanwhile on the event loop
+        profiler = StageProfiler("update_data",cprofile=False)
+        try:
+            with profiler:
+                return await super(ProfiledUploader,self).update_data(*args,**kwargs)
+        finally:
+            self.save_profile("update_data",profiler.result)
+
+    @profiled("post_update_data")
+    def post_update_data(self, *args, **kwargs):
+        return super(ProfiledUploader,self).post_update_data(*args,**kwargs)
+
+
+def format_profiles(builds,stages=None):
+    """
+    Return a text table comparing stage profiles of builds, a list of
+    (build name, {stage: profile}) (see build_profiles())
+    """
+    if stages is None:
+        stages = []
+        for (_,profile) in builds:
+            stages.extend([stage for stage in sorted(profile) if not stage in stages])
+    lines = ["%-32s" % "stage" + "".join(["%36s" % name[-35:] for (name,_) in builds])]
+    lines.append("%-32s" % "" + "%36s" % "wall(s)    cpu(s)  peak(MB)" * len(builds))
+    for stage in stages:
+        row = "%-32s" % stage[:31]
+        for (_,profile) in builds:
+            res = profile.get(stage)
+            row += "%36s" % ("%9.1f %9.1f %9.1f" % (res["wall_s"],res["cpu_s"],res["peak_rss_mb"]) if res else "-")
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def build_profiles(build_name=None,last=3):
+    """
+    Return stage profiles of the last builds (of build configuration build_name
+    if given), as a list of (build name, {stage: profile}), most recent first
+    """
+    query = {"profile" : {"$exists" : True}}
+    if build_name:
+        query["build_config._id"] = build_name
+    docs = get_src_build().find(query,{"profile" : 1,"started_at" : 1}).sort("started_at",-1).limit(last)
+    builds = []
+    for doc in docs:
+        profile = dict(doc["profile"])
+        # upload profiles are copied under "upload" as {source: {stage: profile}}
+        for (name,stages) in profile.pop("upload",{}).items():
+            for (stage,res) in stages.items():
+                profile["%s.%s" % (name,stage)] = res
+        builds.append((doc["_id"],profile))
+    return builds
+
+
+def profile(build_name=None,last=3):
+    """
+    Print a table comparing stage profiles (wall/CPU time, peak RSS) of the
+    last builds, of build configuration build_name if given
+    """
+    builds = build_profiles(build_name,last)
+    if not builds:
+        print("No build profile found")
+        return
+    print(format_profiles(builds))
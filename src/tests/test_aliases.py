@@ -0,0 +1,60 @@
+'''
+TaxidAliases tests, checked against a plain dict of aliases. Only needs numpy:
+
+    python -m unittest tests.test_aliases
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils.aliases import TaxidAliases
+
+
+class TaxidAliasesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        old = (rng.permutation(5000)[:1500] + 1).tolist()
+        self.merged = [(taxid, int(rng.randint(10000, 20000))) for taxid in old[:1000]]
+        # some deleted ones were merged too
+        self.deleted = old[1000:] + old[:10]
+        self.aliases = TaxidAliases.from_dump(self.merged, self.deleted)
+        self.expected = dict(self.merged)
+        for taxid in old[1000:]:
+            self.expected[taxid] = TaxidAliases.DELETED
+
+    def test_resolve(self):
+        taxids = list(range(0, 5100))
+        self.assertEqual(len(self.aliases), len(self.expected))
+        self.assertEqual(self.aliases.resolve(taxids), [self.expected.get(taxid, taxid) for taxid in taxids])
+        self.assertEqual(self.aliases.resolve([]), [])
+        self.assertEqual(TaxidAliases([], []).resolve([1, 2]), [1, 2])
+
+    def test_resolve_ids(self):
+        ids = [str(taxid) for taxid in range(1, 3000)] + ["abc", "", "9606.5"]
+        expected = {}
+        for _id in ids:
+            if _id.isdigit() and int(_id) in self.expected:
+                new = self.expected[int(_id)]
+                expected[_id] = None if new == TaxidAliases.DELETED else str(new)
+        self.assertEqual(self.aliases.resolve_ids(ids), expected)
+        # leading zeros, ids past int64
+        merged, deleted = self.merged[0], [t for t in self.deleted if t not in dict(self.merged)][0]
+        unaliased = [t for t in range(1, 5000) if t not in self.expected][0]
+        ids = ["0%d" % merged[0], "00%d" % deleted, "0%d" % unaliased, "9" * 19, "9" * 30, "\u00b2"]
+        self.assertEqual(self.aliases.resolve_ids(ids), {ids[0]: str(merged[1]), ids[1]: None})
+
+    def test_save_load(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, "aliases", "test.npz")
+            self.aliases.save(path)
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["test.npz"])
+            loaded = TaxidAliases.load(path)
+            taxids = list(range(0, 5100))
+            self.assertEqual(loaded.resolve(taxids), self.aliases.resolve(taxids))
+        finally:
+            shutil.rmtree(folder)
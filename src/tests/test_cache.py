@@ -0,0 +1,116 @@
+'''
+Children cache (LRU bounded by size, build versions), single-flight lookups and
+children cursors tests. Only needs the standard library:
+
+    python -m unittest tests.test_cache
+'''
+import unittest
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from web.api.cache import ChildrenCache, SingleFlight
+from web.api.cursor import encode_cursor, decode_cursor
+
+
+class ChildrenCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        value_size = ChildrenCache._sizeof(list(range(10)))
+        cache = ChildrenCache(max_size=value_size * 5, version="v1")
+        # brute force LRU: keys by recency, 5 of them at most
+        expected = OrderedDict()
+        for (i, key) in enumerate([1, 2, 3, 1, 4, 5, 6, 2, 7, 1, 8, 3, 3, 9, 4]):
+            value = cache.get(key)
+            self.assertEqual(value, expected.get(key), (i, key))
+            if key in expected:
+                expected.move_to_end(key)
+            else:
+                cache.set(key, list(range(10)))
+                expected[key] = list(range(10))
+                if len(expected) > 5:
+                    expected.popitem(last=False)
+            self.assertTrue(cache.size <= cache.max_size)
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 5)
+        self.assertEqual(stats["hits"] + stats["misses"], 15)
+        self.assertEqual(stats["evictions"], stats["misses"] - 5)
+
+    def test_oversized(self):
+        cache = ChildrenCache(max_size=ChildrenCache._sizeof([1]), version="v1")
+        cache.set("big", list(range(100)))
+        self.assertIsNone(cache.get("big"))
+        self.assertEqual(cache.size, 0)
+
+    def test_replace(self):
+        cache = ChildrenCache(max_size=10 ** 6, version="v1")
+        cache.set("a", [1, 2, 3])
+        cache.set("a", [1])
+        self.assertEqual(cache.get("a"), [1])
+        self.assertEqual(cache.size, ChildrenCache._sizeof([1]))
+
+    def test_reset(self):
+        cache = ChildrenCache(max_size=10 ** 6, version="v1")
+        cache.set("a", [1])
+        cache.reset("v2")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual((cache.size, cache.version, cache.stats()["invalidations"]), (0, "v2", 1))
+
+    def test_threads(self):
+        cache = ChildrenCache(max_size=ChildrenCache._sizeof(list(range(10))) * 20, version="v1")
+        def worker(start):
+            for i in range(start, start + 2000):
+                cache.set(i % 50, list(range(10)))
+                cache.get((i * 7) % 50)
+        threads = [threading.Thread(target=worker, args=(i * 100,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.size, sum([ChildrenCache._sizeof(value[0]) for value in cache._data.values()]))
+        self.assertTrue(cache.size <= cache.max_size)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_inflight(self):
+        inflight = SingleFlight()
+        future = Future()
+        inflight.add(["a", "b"], future)
+        self.assertIs(inflight.get("a"), future)
+        self.assertIsNone(inflight.get("c"))
+        inflight.joined(1)
+        # a newer lookup of b isn't dropped when the first one is done
+        other = Future()
+        inflight.add(["b"], other)
+        future.set_result({})
+        self.assertIsNone(inflight.get("a"))
+        self.assertIs(inflight.get("b"), other)
+        other.set_result({})
+        self.assertIsNone(inflight.get("b"))
+        self.assertEqual(inflight.stats(), {'inflight': 0, 'calls': 2, 'keys': 3,
+                                            'coalesced_requests': 1, 'coalesced_keys': 1})
+
+    def test_executor(self):
+        inflight = SingleFlight()
+        event = threading.Event()
+        with ThreadPoolExecutor(2) as executor:
+            future = executor.submit(event.wait, 5)
+            inflight.add(["a"], future)
+            self.assertIs(inflight.get("a"), future)
+            event.set()
+            future.result()
+        self.assertIsNone(inflight.get("a"))
+
+
+class CursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for (taxid, after) in [(9606, 9607), ("9606", 0), (None, 123456789)]:
+            cursor = encode_cursor(taxid, after)
+            self.assertNotIn("=", cursor)
+            self.assertEqual(decode_cursor(cursor), {'id': None if taxid is None else str(taxid), 'after': after})
+
+    def test_invalid(self):
+        for cursor in ["", "abc", encode_cursor(9606, 1)[:-2], "eyJpZCI6MX0"]:
+            self.assertRaises(ValueError, decode_cursor, cursor)
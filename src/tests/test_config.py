@@ -34,7 +34,9 @@ ANNOTATION_OBJECT_EXPECTED_ATTRIBUTE_LIST = ['_id', '_version', 'common_name', '
 ANNOTATION_GET_IDS = ['9606', 
                       '9606?fields=lineage&callback=mycallback', 
                       '9606?fields=common_name,taxid', 
-                      '9606?jsonld=true'
+                      '9606?jsonld=true',
+                      '9604?include_children=true&has_gene=true',
+                      '9604?include_children=true&children_size=5'
                      ] 
 ANNOTATION_GET_MSGPACK = ['9606?msgpack=true',
                           '9606?fields=common_name&msgpack=true']
@@ -51,7 +53,8 @@ ANNOTATION_GET_FILTER = ['9606?filter=lineage',
 ANNOTATION_POST_DATA = [{'ids': '9606'},
                         {'ids': '9606,10090'},
                         {'ids': '9606,10090', 'fields': 'common_name'},
-                        {'ids': '9606,10090', 'jsonld': 'true'}
+                        {'ids': '9606,10090', 'jsonld': 'true'},
+                        {'ids': '9604,10088', 'include_children': 'true', 'children_size': '5'}
                         ]
 
 # -----------------------------------------------------------------------------------
@@ -90,3 +93,42 @@ TEST_FIELDS_GET_FIELDS_ENDPOINT = ['common_name', 'genbank_common_name','has_gen
 
 # Any additional fields added for check_fields subset test
 CHECK_FIELDS_SUBSET_ADDITIONAL_FIELDS = []
+
+# -----------------------------------------------------------------------------------
+
+# Children lists (include_children, has_gene, expand_species), paginated with children_size:
+# this taxid must have more than CHILDREN_PAGE_SIZE children (Hominidae)
+CHILDREN_ID = '9604'
+CHILDREN_PAGE_SIZE = 5
+
+# -----------------------------------------------------------------------------------
+
+# This is a list of (ids, expected lowest common ancestor) to test the lca endpoint
+LCA_ENDPOINT = "lca"
+LCA_IDS = [('9606,10090', 314146),
+           ('9606,9598', 207598),
+           ('9606', 9606)]
+
+# -----------------------------------------------------------------------------------
+
+# This is a list of (prefix, taxid expected in hits) to test the suggest endpoint
+SUGGEST_ENDPOINT = "suggest"
+SUGGEST_QUERIES = [('homo sap', 9606),
+                   ('Mus muscul', 10090),
+                   ('house mou', 10090)]
+
+# -----------------------------------------------------------------------------------
+
+# This is a list of (name, taxid expected in matches) to test the resolve endpoint
+RESOLVE_ENDPOINT = "resolve"
+RESOLVE_NAMES = [('Homo sapiens', 9606),
+                 ('HUMAN', 9606),
+                 ('Mus musculus', 10090)]
+# Names expected not to match anything
+RESOLVE_NOTFOUND_NAMES = ['not a species name']
+
+# -----------------------------------------------------------------------------------
+
+# Metrics endpoint (not under API_VERSION) and metrics it must expose
+METRICS_ENDPOINT = "metrics"
+METRICS_EXPECTED_NAMES = ['species_request_stage_seconds', 'species_request_es_calls']
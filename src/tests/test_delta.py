@@ -0,0 +1,49 @@
+'''
+Upload delta tests (hub.dataload.delta): digests and changed/removed _ids,
+checked against a plain comparison of documents. Only needs numpy:
+
+    python -m unittest tests.test_delta
+'''
+import copy
+import unittest
+
+import numpy as np
+
+from hub.dataload.delta import doc_digest, compute_delta
+
+
+def digests(docs):
+    ids = np.array(sorted(docs), dtype=np.int64)
+    return ids, np.array([doc_digest(docs[_id]) for _id in ids.tolist()], dtype=np.int64)
+
+
+class DeltaTest(unittest.TestCase):
+
+    def test_doc_digest(self):
+        doc = {"_id": "9606", "taxid": 9606, "lineage": [9606, 9605, 1], "names": {"a": "x", "b": ["y", "z"]}}
+        same = {"names": {"b": ["y", "z"], "a": "x"}, "lineage": [9606, 9605, 1], "taxid": 9606, "_id": "9606"}
+        self.assertEqual(doc_digest(doc), doc_digest(same))
+        for change in [{"taxid": 9605}, {"lineage": [9606, 1, 9605]}, {"names": {"a": "x", "b": ["y"]}}, {"extra": None}]:
+            other = copy.deepcopy(doc)
+            other.update(change)
+            self.assertNotEqual(doc_digest(doc), doc_digest(other), change)
+
+    def test_compute_delta(self):
+        rng = np.random.RandomState(0)
+        old = dict((taxid, {"taxid": taxid, "rank": "species"}) for taxid in (rng.permutation(3000)[:2000] + 1).tolist())
+        new = copy.deepcopy(old)
+        taxids = sorted(old)
+        for taxid in taxids[:300]:
+            del new[taxid]
+        for taxid in taxids[300:500]:
+            new[taxid]["rank"] = "genus"
+        for taxid in range(5000, 5100):
+            new[taxid] = {"taxid": taxid}
+        changed, removed = compute_delta(*(digests(old) + digests(new)))
+        self.assertEqual(changed.tolist(), sorted([taxid for taxid in new if old.get(taxid) != new[taxid]]))
+        self.assertEqual(removed.tolist(), sorted([taxid for taxid in old if taxid not in new]))
+        # nothing changed, or nothing before
+        self.assertEqual([len(ids) for ids in compute_delta(*(digests(old) + digests(old)))], [0, 0])
+        empty = (np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        changed, removed = compute_delta(*(empty + digests(new)))
+        self.assertEqual((changed.tolist(), removed.tolist()), (sorted(new), []))
@@ -0,0 +1,95 @@
+'''
+Binary taxdump parsers tests: documents must be the ones the former line by
+line text parser (hub.dataload.taxonomy_parser) returns. Only needs numpy:
+
+    python -m unittest tests.test_parser
+'''
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+import numpy as np
+
+from hub.dataload import taxonomy_parser
+
+# taxonomy source package registers its dumper (needs a configured hub),
+# the parser module itself has no dependency
+_spec = importlib.util.spec_from_file_location("taxonomy_dump_parser", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hub", "dataload", "sources", "taxonomy", "parser.py"))
+parser = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(parser)
+iter_chunks = parser.iter_chunks
+parse_refseq_names, parse_refseq_nodes = parser.parse_refseq_names, parser.parse_refseq_nodes
+parse_refseq_merged, parse_refseq_delnodes = parser.parse_refseq_merged, parser.parse_refseq_delnodes
+
+NAME_CLASSES = ["scientific name", "common name", "genbank common name", "synonym", "authority",
+                "includes", "type material", "misspelling"]
+
+
+def write_dump(folder, num_nodes, seed=0):
+    ''' Write names.dmp and nodes.dmp of num_nodes random taxa, return their paths '''
+    rng = np.random.RandomState(seed)
+    taxids = np.sort(rng.permutation(num_nodes * 3)[:num_nodes] + 1).tolist()
+    names_path = os.path.join(folder, "names.dmp")
+    nodes_path = os.path.join(folder, "nodes.dmp")
+    with open(names_path, "w") as fout:
+        for taxid in taxids:
+            classes = ["scientific name"] + rng.choice(NAME_CLASSES[1:], rng.randint(0, 6)).tolist()
+            for name_class in classes:
+                fout.write("%d\t|\tName %d %s\t|\t\t|\t%s\t|\n" % (taxid, rng.randint(1000), "X" * rng.randint(3), name_class))
+    with open(nodes_path, "w") as fout:
+        for (i, taxid) in enumerate(taxids):
+            parent = taxids[rng.randint(i)] if i else taxid
+            rank = ["species", "genus", "no rank"][rng.randint(3)]
+            fout.write("%d\t|\t%d\t|\t%s\t|\tXX\t|\t0\t|\t1\t|\t1\t|\t1\t|\t0\t|\t1\t|\t0\t|\t0\t|\t\t|\n" % (taxid, parent, rank))
+    return names_path, nodes_path
+
+
+def without_id(docs):
+    return [dict((k, v) for (k, v) in doc.items() if k != "_id") for doc in docs]
+
+
+class ParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.names_path, self.nodes_path = write_dump(self.folder, 2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_iter_chunks(self):
+        with open(self.names_path, "rb") as fin:
+            data = fin.read()
+        for chunk_size in [1, 10, 100, 4096]:
+            chunks = list(iter_chunks(io.BytesIO(data), chunk_size))
+            self.assertEqual(b"".join(chunks), data)
+            for chunk in chunks:
+                self.assertTrue(chunk.endswith(b"\t|\n"))
+        # last line without newline
+        self.assertEqual(list(iter_chunks(io.BytesIO(data[:-1]), 100))[-1][-3:], b"\t|\n")
+
+    def test_parse_names(self):
+        with open(self.names_path, "rb") as fin:
+            docs = list(parse_refseq_names(fin))
+        with open(self.names_path, "rb") as fin:
+            expected = taxonomy_parser.parse_refseq_names(fin)
+        self.assertEqual(without_id(docs), expected)
+        for doc in docs:
+            self.assertEqual(doc["_id"], str(doc["taxid"]))
+
+    def test_parse_nodes(self):
+        with open(self.nodes_path, "rb") as fin:
+            docs = list(parse_refseq_nodes(fin))
+        with open(self.nodes_path, "rb") as fin:
+            expected = taxonomy_parser.parse_refseq_nodes(fin)
+        self.assertEqual(without_id(docs), expected)
+
+    def test_parse_merged_delnodes(self):
+        merged = io.BytesIO(b"12\t|\t74109\t|\n30\t|\t29\t|\n")
+        self.assertEqual(list(parse_refseq_merged(merged)), [(12, 74109), (30, 29)])
+        delnodes = io.BytesIO(b"3413733\t|\n3413731\t|\n")
+        self.assertEqual(list(parse_refseq_delnodes(delnodes)), [3413733, 3413731])
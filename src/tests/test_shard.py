@@ -0,0 +1,111 @@
+'''
+Byte-range shards tests: documents parsed by shards must be the ones parsed
+from the whole file. Only needs numpy:
+
+    python -m unittest tests.test_shard
+'''
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from hub.dataload.filerange import find_shards, FileRange, split_file
+from tests.test_parser import parser, write_dump
+
+line_taxid = parser.line_taxid
+parse_refseq_names, parse_refseq_nodes = parser.parse_refseq_names, parser.parse_refseq_nodes
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.names_path, self.nodes_path = write_dump(self.folder, 2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_find_shards(self):
+        with open(self.names_path, "rb") as fin:
+            data = fin.read()
+        for num_shards in [1, 2, 3, 7, 50]:
+            for key in [None, line_taxid]:
+                shards = find_shards(self.names_path, num_shards, key=key)
+                self.assertTrue(0 < len(shards) <= num_shards)
+                # contiguous, non empty, covering the whole file
+                self.assertEqual(shards[0][0], 0)
+                self.assertEqual(shards[-1][1], len(data))
+                for ((_, end), (start, _)) in zip(shards, shards[1:]):
+                    self.assertEqual(end, start)
+                for (start, end) in shards:
+                    self.assertTrue(end > start)
+                    # made of complete lines
+                    self.assertTrue(start == 0 or data[start - 1:start] == b"\n")
+                    self.assertEqual(data[end - 1:end], b"\n")
+                    if key is not None and end < len(data):
+                        # lines of a taxid aren't split
+                        last = data[:end].splitlines()[-1]
+                        following = data[end:].split(b"\n", 1)[0]
+                        self.assertNotEqual(line_taxid(last), line_taxid(following))
+
+    def test_find_shards_start(self):
+        with open(self.nodes_path, "rb") as fin:
+            first_line = len(fin.readline())
+        shards = find_shards(self.nodes_path, 4, start=first_line)
+        self.assertEqual(shards[0][0], first_line)
+        self.assertEqual(shards[-1][1], os.path.getsize(self.nodes_path))
+        self.assertEqual(find_shards(self.nodes_path, 4, start=os.path.getsize(self.nodes_path)), [])
+
+    def test_file_range(self):
+        with open(self.nodes_path, "rb") as fin:
+            data = fin.read()
+        for (start, end) in [(0, len(data)), (10, 500), (100, 100), (len(data) - 3, len(data))]:
+            for size in [-1, 1, 7, 1000000]:
+                fileh = FileRange(self.nodes_path, start, end)
+                chunks = []
+                while True:
+                    chunk = fileh.read(size)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                self.assertEqual(b"".join(chunks), data[start:end])
+
+    def test_split_file(self):
+        with open(self.names_path, "rb") as fin:
+            data = fin.read()
+        for num_shards in [1, 2, 3, 7, 50]:
+            for key in [None, line_taxid]:
+                paths = [os.path.join(self.folder, "names.dmp.%d" % part) for part in range(num_shards)]
+                written = split_file(io.BufferedReader(io.BytesIO(data)), len(data), paths, key=key, chunk_size=1000)
+                self.assertTrue(0 < len(written) <= num_shards)
+                self.assertEqual(written, paths[:len(written)])
+                parts = []
+                for path in written:
+                    with open(path, "rb") as fin:
+                        parts.append(fin.read())
+                    os.unlink(path)
+                self.assertEqual(b"".join(parts), data)
+                for (part, following) in zip(parts, parts[1:]):
+                    self.assertTrue(part and part.endswith(b"\n"))
+                    if key is not None:
+                        self.assertNotEqual(line_taxid(part.splitlines()[-1]), line_taxid(following.splitlines()[0]))
+
+    def test_parse_names(self):
+        with open(self.names_path, "rb") as fin:
+            docs = list(parse_refseq_names(fin))
+        # same documents parsed by shards, whatever the number of shards
+        for num_shards in [2, 5, 13]:
+            sharded = []
+            for (start, end) in find_shards(self.names_path, num_shards, key=line_taxid):
+                sharded.extend(parse_refseq_names(FileRange(self.names_path, start, end)))
+            self.assertEqual(sharded, docs)
+
+    def test_parse_nodes(self):
+        with open(self.nodes_path, "rb") as fin:
+            docs = list(parse_refseq_nodes(fin))
+        for num_shards in [2, 5, 13]:
+            sharded = []
+            for (start, end) in find_shards(self.nodes_path, num_shards):
+                sharded.extend(parse_refseq_nodes(FileRange(self.nodes_path, start, end)))
+            self.assertEqual(sharded, docs)
@@ -0,0 +1,257 @@
+'''
+TaxonomyTree tests, on small random trees checked against brute force
+computations (parent walks). Only needs numpy:
+
+    python -m unittest tests.test_tree
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils.tree import TaxonomyTree, RANKS, SPECIES, NAME_FIELDS, SUGGEST_RANK_ORDER, normalize_name
+
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "la"]
+
+
+def random_tree(num_nodes, seed=0, roots=1):
+    ''' Return (taxids, parents, ranks, has_gene) lists of a random tree, nodes not in
+    taxid order, first roots nodes being roots (their own parent) '''
+    rng = np.random.RandomState(seed)
+    taxids = (rng.permutation(num_nodes * 3)[:num_nodes] + 1).tolist()
+    parents = []
+    for i in range(num_nodes):
+        if i < roots:
+            parents.append(taxids[i])
+        else:
+            # mix of bushy and deep parts
+            lo = max(0, i - 3) if rng.randint(2) else 0
+            parents.append(taxids[rng.randint(lo, i)])
+    ranks = rng.randint(0, len(RANKS), num_nodes).tolist()
+    has_gene = (rng.random_sample(num_nodes) < 0.3).tolist()
+    order = rng.permutation(num_nodes).tolist()
+    return ([taxids[i] for i in order], [parents[i] for i in order],
+            [ranks[i] for i in order], [has_gene[i] for i in order])
+
+
+def random_names(taxids, seed=0):
+    ''' Return list of (taxid, field, name), names sharing prefixes and some of them
+    shared by several taxids, in varying case '''
+    rng = np.random.RandomState(seed)
+    names = []
+    for taxid in taxids:
+        for field in rng.choice(NAME_FIELDS, rng.randint(1, 4)).tolist():
+            name = "".join(rng.choice(SYLLABLES, rng.randint(1, 4)))
+            if rng.randint(3) == 0:
+                name += " " + "".join(rng.choice(SYLLABLES, 2))
+            names.append((taxid, field, name.upper() if rng.randint(5) == 0 else name))
+    return names
+
+
+def walk_lineage(parent_of, taxid):
+    lineage = [taxid]
+    while parent_of[lineage[-1]] != lineage[-1]:
+        lineage.append(parent_of[lineage[-1]])
+    return lineage
+
+
+def preorder(parent_of):
+    ''' Pre-order list of taxids, roots and children by ascending taxid '''
+    children = dict((taxid, []) for taxid in parent_of)
+    for (taxid, parent) in parent_of.items():
+        if parent != taxid:
+            children[parent].append(taxid)
+    order = []
+    stack = sorted([taxid for (taxid, parent) in parent_of.items() if parent == taxid], reverse=True)
+    while stack:
+        taxid = stack.pop()
+        order.append(taxid)
+        stack.extend(sorted(children[taxid], reverse=True))
+    return order
+
+
+class TaxonomyTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.taxids, self.parents, self.ranks, self.has_gene = random_tree(300, seed=1, roots=2)
+        self.parent_of = dict(zip(self.taxids, self.parents))
+        self.tree = TaxonomyTree(self.taxids, self.parents, self.ranks, self.has_gene)
+        self.lineages = dict((taxid, walk_lineage(self.parent_of, taxid)) for taxid in self.taxids)
+
+    def test_index(self):
+        tree = self.tree
+        self.assertEqual(tree.taxid.tolist(), sorted(self.taxids))
+        for taxid in self.taxids:
+            self.assertEqual(tree.taxid[tree.index(taxid)], taxid)
+        self.assertEqual(tree.index(0), -1)
+        self.assertEqual(tree.indices([0, self.taxids[5], 10 ** 9]).tolist(), [-1, tree.index(self.taxids[5]), -1])
+        self.assertNotIn(10 ** 9, tree)
+
+    def test_unknown_parent(self):
+        # nodes with unknown parent become roots
+        tree = TaxonomyTree([1, 2, 3], [1, 1, 42])
+        self.assertEqual(tree.depth.tolist(), [0, 1, 0])
+        self.assertEqual(tree.taxid[tree.order].tolist(), [1, 2, 3])
+
+    def test_preorder(self):
+        tree = self.tree
+        expected = preorder(self.parent_of)
+        self.assertEqual(tree.taxid[tree.order].tolist(), expected)
+        pos = dict((taxid, i) for (i, taxid) in enumerate(expected))
+        for taxid in self.taxids:
+            idx = tree.index(taxid)
+            below = [t for (t, lineage) in self.lineages.items() if taxid in lineage]
+            self.assertEqual(tree.left[idx], pos[taxid])
+            self.assertEqual(tree.size[idx], len(below))
+            self.assertEqual(tree.depth[idx], len(self.lineages[taxid]) - 1)
+            fields = tree.subtree_fields(idx)
+            self.assertEqual(fields["right"] - fields["left"] + 1, len(below))
+
+    def test_lineages(self):
+        tree = self.tree
+        tree.compute_lineages()
+        for taxid in self.taxids:
+            self.assertEqual(tree.lineage(tree.index(taxid)), self.lineages[taxid])
+
+    def test_descendants(self):
+        tree = self.tree
+        has_gene = dict(zip(self.taxids, self.has_gene))
+        for taxid in self.taxids:
+            below = sorted([t for (t, lineage) in self.lineages.items() if taxid in lineage[1:]])
+            self.assertEqual(tree.descendants(taxid), below)
+            self.assertEqual(tree.descendants(taxid, has_gene=True), [t for t in below if has_gene[t]])
+            self.assertEqual(tree.descendants(taxid, include_self=True), sorted(below + [taxid]))
+            pages = []
+            after = None
+            while True:
+                page = tree.descendants_page(taxid, after=after, size=7)
+                pages += page
+                if len(page) < 7:
+                    break
+                after = page[-1]
+            self.assertEqual(pages, below)
+        self.assertIsNone(tree.descendants(0))
+        self.assertIsNone(tree.descendants_page(0))
+
+    def test_aggregates(self):
+        tree = self.tree
+        tree.compute_aggregates()
+        has_gene = dict(zip(self.taxids, self.has_gene))
+        ranks = dict(zip(self.taxids, self.ranks))
+        for taxid in self.taxids:
+            below = [t for (t, lineage) in self.lineages.items() if taxid in lineage[1:]]
+            fields = tree.subtree_fields(tree.index(taxid))
+            self.assertEqual(fields["num_descendants"], len(below))
+            self.assertEqual(fields["num_gene_descendants"], len([t for t in below if has_gene[t]]))
+            self.assertEqual(fields["num_species_descendants"], len([t for t in below if ranks[t] == SPECIES]))
+
+    def test_lca(self):
+        tree = self.tree
+        rng = np.random.RandomState(2)
+        for _ in range(300):
+            taxids = rng.choice(self.taxids, rng.randint(1, 5)).tolist()
+            common = set(self.lineages[taxids[0]])
+            for taxid in taxids[1:]:
+                common &= set(self.lineages[taxid])
+            expected = [t for t in self.lineages[taxids[0]] if t in common]
+            self.assertEqual(tree.lca(taxids + [0]), expected[0] if expected else None, taxids)
+        self.assertIsNone(tree.lca([0]))
+
+    def test_diff(self):
+        taxids, parents = list(self.taxids), list(self.parents)
+        # move a subtree, remove a leaf and add a node
+        moved = self.tree.taxid[(self.tree.size > 5) & (self.tree.depth > 1)][-1]
+        root = self.lineages[moved][-1]
+        parents[taxids.index(moved)] = root
+        leaf = [t for t in taxids if t not in self.parents][0]
+        del parents[taxids.index(leaf)]
+        taxids.remove(leaf)
+        taxids.append(10 ** 6)
+        parents.append(moved)
+        tree = TaxonomyTree(taxids, parents)
+        parent_of = dict(zip(taxids, parents))
+        lineage_changed, interval_changed = tree.diff(self.tree)
+        expected_lineage = [t for t in sorted(taxids)
+                            if t not in self.lineages or walk_lineage(parent_of, t) != self.lineages[t]]
+        self.assertEqual(lineage_changed.tolist(), expected_lineage)
+        previous = self.tree
+        expected_interval = []
+        for t in sorted(taxids):
+            if t in expected_lineage:
+                continue
+            (i, j) = (tree.index(t), previous.index(t))
+            if (tree.left[i], tree.size[i], tree.depth[i]) != (previous.left[j], previous.size[j], previous.depth[j]):
+                expected_interval.append(t)
+        self.assertEqual(interval_changed.tolist(), expected_interval)
+        self.assertTrue(len(expected_lineage) > 1 and len(expected_interval) > 0)
+        unchanged = TaxonomyTree(self.taxids, self.parents)
+        self.assertEqual([len(changed) for changed in unchanged.diff(self.tree)], [0, 0])
+
+    def test_names(self):
+        tree = self.tree
+        names = random_names(self.taxids + [0], seed=3)
+        tree.set_names(names)
+        for taxid in self.taxids:
+            self.assertEqual(tree.names(tree.index(taxid)), [(field, name) for (t, field, name) in names if t == taxid])
+        self.assertEqual(sum([len(tree.names(i)) for i in range(len(tree))]), len([n for n in names if n[0] != 0]))
+
+    def test_resolve_names(self):
+        tree = self.tree
+        names = random_names(self.taxids, seed=4)
+        tree.set_names(names)
+        queries = list(set([name for (_, _, name) in names]))[:50] + ["  " + names[0][2].upper() + " ", "nothing"]
+        for (query, found) in zip(queries, tree.resolve_names(queries)):
+            expected = sorted([taxid for (taxid, _, name) in names if normalize_name(name) == normalize_name(query)])
+            self.assertEqual(sorted([int(tree.taxid[idx]) for (idx, _) in found]), expected, query)
+            for (idx, entry) in found:
+                self.assertEqual(normalize_name(tree.name_text_at(entry)), normalize_name(query))
+
+    def test_suggest(self):
+        tree = self.tree
+        names = random_names(self.taxids, seed=5)
+        tree.set_names(names)
+        has_gene = dict(zip(self.taxids, self.has_gene))
+        ranks = dict(zip(self.taxids, self.ranks))
+        for prefix in ["b", "Ba", "ce d", "dif", "lala", "zz"]:
+            # best score of each taxid having a name starting with prefix
+            best = {}
+            for (taxid, _, name) in names:
+                if normalize_name(name).startswith(normalize_name(prefix)):
+                    score = ((not has_gene[taxid]) << 24) | (int(SUGGEST_RANK_ORDER[ranks[taxid]]) << 16) | \
+                            len(name.encode())
+                    best[taxid] = min(score, best.get(taxid, score))
+            for size in [1, 3, 10, 1000]:
+                hits = tree.suggest(prefix, size)
+                taxids = [int(tree.taxid[idx]) for (idx, _) in hits]
+                self.assertEqual(len(taxids), min(size, len(best)), prefix)
+                self.assertEqual(len(set(taxids)), len(taxids))
+                self.assertEqual([best[taxid] for taxid in taxids], sorted(best.values())[:size], prefix)
+                for (idx, entry) in hits:
+                    self.assertTrue(normalize_name(tree.name_text_at(entry)).startswith(normalize_name(prefix)))
+        self.assertEqual(tree.suggest(" "), [])
+
+    def test_artifact(self):
+        tree = self.tree
+        tree.compute_lineages()
+        tree.compute_aggregates()
+        tree.compute_lca_index()
+        tree.set_names(random_names(self.taxids, seed=6))
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, "test.tree")
+            tree.save_artifact(path, "v1")
+            loaded = TaxonomyTree.load_artifact(path)
+            self.assertEqual(loaded.version, "v1")
+            for name in TaxonomyTree.ARRAYS + TaxonomyTree.NAME_ARRAYS:
+                self.assertTrue(np.array_equal(getattr(loaded, name), getattr(tree, name)), name)
+            self.assertEqual(len(loaded.sparse_table), len(tree.sparse_table))
+            for (level, expected) in zip(loaded.sparse_table, tree.sparse_table):
+                self.assertTrue(np.array_equal(level, expected))
+            taxids = self.taxids[:3]
+            self.assertEqual(loaded.lca(taxids), tree.lca(taxids))
+            self.assertEqual(loaded.descendants(self.taxids[0]), tree.descendants(self.taxids[0]))
+            self.assertEqual(loaded.suggest("ba", 5), tree.suggest("ba", 5))
+        finally:
+            shutil.rmtree(folder)
@@ -6,7 +6,7 @@ from tornado.web import Application
 # Add this directory to python path (contains nosetest_config)
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 
-from biothings.tests.tests import BiothingTests
+from biothings.tests.tests import BiothingTests, _q
 from biothings.tests.settings import BiothingTestSettings
 
 bts = BiothingTestSettings(config_module='test_config')
@@ -14,4 +14,100 @@ bts = BiothingTestSettings(config_module='test_config')
 class MySpeciesTest(BiothingTests):
     __test__ = True # explicitly set this to be a test class
     # Add extra nosetests here
-    pass
+
+    def _taxon_url(self, taxid, params=''):
+        return self.api + '/' + bts.ANNOTATION_ENDPOINT + '/' + taxid + ('?' + params if params else '')
+
+    def test_status(self):
+        ''' Test that /status body is "OK", stats being returned with stats=1. '''
+        self.assertEqual(self.get_ok(self.host + '/status').decode('utf-8'), 'OK')
+        res = self.json_ok(self.get_ok(self.host + '/status?stats=1'))
+        for key in ['build_version', 'children_cache', 'children_inflight']:
+            self.assertIn(key, res)
+
+    def test_metrics(self):
+        ''' Test that /metrics exposes request stage metrics in Prometheus text format. '''
+        self.get_ok(self._taxon_url(bts.CHILDREN_ID, 'include_children=true'))
+        res = self.get_ok(self.host + '/' + bts.METRICS_ENDPOINT).decode('utf-8')
+        for name in bts.METRICS_EXPECTED_NAMES:
+            self.assertIn('# TYPE {} histogram'.format(name), res)
+
+    def test_include_children(self):
+        ''' Test that children are the taxa having the taxid in their lineage, has_gene ones being a subset. '''
+        res = self.json_ok(self.get_ok(self._taxon_url(bts.CHILDREN_ID, 'include_children=true')))
+        self.assertTrue(len(res['children']) > bts.CHILDREN_PAGE_SIZE)
+        self.assertEqual(res['children'], sorted(res['children']))
+        self.assertNotIn(int(bts.CHILDREN_ID), res['children'])
+        child = self.json_ok(self.get_ok(self._taxon_url(str(res['children'][0]), 'fields=lineage')))
+        self.assertIn(int(bts.CHILDREN_ID), child['lineage'])
+        with_gene = self.json_ok(self.get_ok(self._taxon_url(bts.CHILDREN_ID, 'include_children=true&has_gene=true')))
+        self.assertTrue(set(with_gene['children']) <= set(res['children']))
+
+    def test_children_pages(self):
+        ''' Test that children pages (children_size, children_cursor) add up to the whole children list. '''
+        full = self.json_ok(self.get_ok(self._taxon_url(bts.CHILDREN_ID, 'include_children=true')))['children']
+        params = 'include_children=true&children_size={}'.format(bts.CHILDREN_PAGE_SIZE)
+        res = self.json_ok(self.get_ok(self._taxon_url(bts.CHILDREN_ID, params)))
+        children = res['children']
+        self.assertEqual(len(children), bts.CHILDREN_PAGE_SIZE)
+        while 'children_next' in res:
+            res = self.json_ok(self.get_ok(self._taxon_url(bts.CHILDREN_ID, params + '&children_cursor=' + _q(res['children_next']))))
+            self.assertTrue(0 < len(res['children']) <= bts.CHILDREN_PAGE_SIZE)
+            children += res['children']
+        self.assertEqual(children, full)
+        res, con = self.h.request(self._taxon_url(bts.CHILDREN_ID, 'include_children=true&children_cursor=invalid'))
+        self.assertEqual(res.status, 400)
+
+    def test_expand_species(self):
+        ''' Test that expand_species returns the POSTed taxids and their children, paginated with children_size. '''
+        url = self.api + '/' + bts.ANNOTATION_ENDPOINT
+        full = self.json_ok(self.post_ok(url, {'ids': bts.CHILDREN_ID, 'expand_species': 'true'}))
+        children = self.json_ok(self.get_ok(self._taxon_url(bts.CHILDREN_ID, 'include_children=true')))['children']
+        self.assertEqual(full, sorted(children + [int(bts.CHILDREN_ID)]))
+        params = {'ids': bts.CHILDREN_ID, 'expand_species': 'true', 'children_size': str(bts.CHILDREN_PAGE_SIZE)}
+        res = self.json_ok(self.post_ok(url, params))
+        taxids = res['taxids']
+        while res['next']:
+            res = self.json_ok(self.post_ok(url, dict(params, children_cursor=res['next'])))
+            taxids += res['taxids']
+        self.assertEqual(taxids, full)
+
+    def test_lca(self):
+        ''' Test the lowest common ancestor of taxids, with GET and POST. '''
+        url = self.api + '/' + bts.LCA_ENDPOINT
+        for (ids, lca) in bts.LCA_IDS:
+            self.assertEqual(self.json_ok(self.get_ok(url + '?ids=' + ids))['lca'], lca)
+            self.assertEqual(self.json_ok(self.post_ok(url, {'ids': ids}))['lca'], lca)
+        res = self.json_ok(self.get_ok(url + '?ids=' + bts.LCA_IDS[0][0] + ',abc'))
+        self.assertEqual(res['notfound'], ['abc'])
+        res, con = self.h.request(url)
+        self.assertEqual(res.status, 400)
+
+    def test_suggest(self):
+        ''' Test that taxa are suggested from a name prefix, at most size of them. '''
+        url = self.api + '/' + bts.SUGGEST_ENDPOINT
+        for (prefix, taxid) in bts.SUGGEST_QUERIES:
+            res = self.json_ok(self.get_ok(url + '?q=' + _q(prefix)))
+            self.assertIn(taxid, [hit['taxid'] for hit in res['hits']])
+            for hit in res['hits']:
+                self.assertTrue(hit['name'].lower().startswith(prefix.lower()))
+        res = self.json_ok(self.get_ok(url + '?q=' + _q(bts.SUGGEST_QUERIES[0][0]) + '&size=2'))
+        self.assertTrue(len(res['hits']) <= 2)
+        self.assertEqual(len(set([hit['taxid'] for hit in res['hits']])), len(res['hits']))
+        res, con = self.h.request(url)
+        self.assertEqual(res.status, 400)
+
+    def test_resolve(self):
+        ''' Test that POSTed names are resolved to taxids, in input order. '''
+        url = self.api + '/' + bts.RESOLVE_ENDPOINT
+        names = [name for (name, _) in bts.RESOLVE_NAMES] + bts.RESOLVE_NOTFOUND_NAMES
+        res = self.json_ok(self.post_ok(url, {'names': '\n'.join(names)}))
+        queries = []
+        for match in res:
+            if match['query'] not in queries:
+                queries.append(match['query'])
+        self.assertEqual(queries, names)
+        for (name, taxid) in bts.RESOLVE_NAMES:
+            self.assertIn(taxid, [match.get('taxid') for match in res if match['query'] == name])
+        for name in bts.RESOLVE_NOTFOUND_NAMES:
+            self.assertEqual([match for match in res if match['query'] == name], [{'query': name, 'notfound': True}])
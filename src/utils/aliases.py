@@ -0,0 +1,79 @@
+import os
+import numpy as np
+
+
+class TaxidAliases(object):
+    '''
+    Sorted-array alias table of taxids which are no longer part of the
+    taxonomy: merged into another taxid (merged.dmp) or deleted
+    (delnodes.dmp). self.old_taxid is sorted, self.new_taxid[i] is the
+    taxid old_taxid[i] was merged into, or DELETED.
+    '''
+    DELETED = 0
+    # larger ids can't be taxids (nor be looked up in int64 arrays)
+    MAX_TAXID = np.iinfo(np.int64).max
+
+    def __init__(self, old_taxids, new_taxids):
+        old_taxids = np.asarray(old_taxids, dtype=np.int64)
+        new_taxids = np.asarray(new_taxids, dtype=np.int64)
+        srt = np.argsort(old_taxids, kind="mergesort")
+        self.old_taxid = old_taxids[srt]
+        self.new_taxid = new_taxids[srt]
+
+    @classmethod
+    def from_dump(klass, merged, deleted):
+        '''
+        Build table from (old_taxid, new_taxid) merged pairs and deleted taxids,
+        a taxid both merged and deleted is considered merged
+        '''
+        merged = dict(merged)
+        deleted = [taxid for taxid in deleted if taxid not in merged]
+        return klass(list(merged.keys()) + deleted,
+                     list(merged.values()) + [klass.DELETED] * len(deleted))
+
+    def save(self, path):
+        '''
+        Save table as a .npz file, written next to path first so
+        processes loading it never see a partial file
+        '''
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = "%s.tmp.npz" % path[:-4]
+        np.savez(tmp_path, old_taxid=self.old_taxid, new_taxid=self.new_taxid)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(klass, path):
+        aliases = klass.__new__(klass)
+        with np.load(path) as data:
+            aliases.old_taxid = data["old_taxid"]
+            aliases.new_taxid = data["new_taxid"]
+        return aliases
+
+    def __len__(self):
+        return len(self.old_taxid)
+
+    def resolve(self, taxids):
+        '''
+        Return list of resolved taxids: the taxid it was merged into, DELETED,
+        or the taxid itself if it has no alias
+        '''
+        taxids = np.asarray(taxids, dtype=np.int64)
+        if not len(self.old_taxid):
+            return taxids.tolist()
+        idx = np.searchsorted(self.old_taxid, taxids)
+        idx[idx == len(self.old_taxid)] = 0
+        return np.where(self.old_taxid[idx] == taxids, self.new_taxid[idx], taxids).tolist()
+
+    def resolve_ids(self, ids):
+        '''
+        Same as resolve(), for string ids as received by the API: returns
+        {id: resolved id (str, None if deleted)} for ids having an alias.
+        Leading zeros are ignored ("09606" is 9606), ids too large to be taxids
+        have no alias.
+        '''
+        numeric = [(_id, int(_id)) for _id in ids if _id.isdecimal() and int(_id) <= self.MAX_TAXID]
+        return dict((_id, None if new == self.DELETED else str(new))
+                    for ((_id, taxid), new) in zip(numeric, self.resolve([taxid for (_, taxid) in numeric]))
+                    if new != taxid)
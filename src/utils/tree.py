@@ -0,0 +1,594 @@
+import os
+import json
+import bisect
+import hashlib
+import numpy as np
+
+# ranks as found in nodes.dmp, anything unknown is stored as "no rank"
+RANKS = ['superkingdom', 'kingdom', 'subkingdom', 'superphylum', 'phylum', 'subphylum', 'superclass', 'class',
+         'subclass', 'infraclass', 'cohort', 'subcohort', 'superorder', 'order', 'suborder', 'infraorder', 'parvorder',
+         'superfamily', 'family', 'subfamily', 'tribe', 'subtribe', 'genus', 'subgenus', 'section', 'subsection',
+         'series', 'species group', 'species subgroup', 'species', 'subspecies', 'varietas', 'subvariety', 'forma',
+         'forma specialis', 'strain', 'serogroup', 'serotype', 'biotype', 'genotype', 'morph', 'pathogroup',
+         'isolate', 'clade', 'no rank']
+RANK_CODES = dict([(r, i) for (i, r) in enumerate(RANKS)])
+NO_RANK = RANK_CODES["no rank"]
+SPECIES = RANK_CODES["species"]
+
+# name fields stored in tree artifacts, index in this list being the name class code
+NAME_FIELDS = ["scientific_name", "common_name", "genbank_common_name", "uniprot_name", "other_names"]
+# name suggestions ranking: taxa with genes first, then by rank (species, below
+# species, above species, unranked), then shorter names
+SUGGEST_RANK_ORDER = np.where(np.arange(len(RANKS)) == SPECIES, 0,
+                              np.where(np.arange(len(RANKS)) > SPECIES, 1, 2)).astype(np.uint32)
+SUGGEST_RANK_ORDER[RANK_CODES["clade"]] = 2
+SUGGEST_RANK_ORDER[NO_RANK] = 3
+
+# tree artifact: MAGIC, header size (uint64), JSON header then arrays, each one
+# starting at an ALIGN bytes boundary. Bump ARTIFACT_FORMAT on layout changes.
+ARTIFACT_MAGIC = b"TAXTREE\0"
+ARTIFACT_FORMAT = 1
+ARTIFACT_ALIGN = 64
+
+
+def normalize_name(name):
+    ''' Return name as indexed and looked up: lowercase, single-spaced '''
+    return " ".join(name.lower().split())
+
+
+def name_hash(name):
+    ''' Return 64-bit hash of normalized name '''
+    data = normalize_name(name).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little", signed=True)
+
+
+def write_artifact(path, arrays, meta=None):
+    '''
+    Write dict of numpy arrays (and meta dict) as a single binary file, which
+    read_artifact() memory-maps. File is written next to path, then renamed.
+    '''
+    arrays = [(name, np.ascontiguousarray(arr)) for (name, arr) in sorted(arrays.items())]
+    table = {}
+    offset = 0
+    for (name, arr) in arrays:
+        table[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // ARTIFACT_ALIGN) * ARTIFACT_ALIGN
+    header = json.dumps({"format": ARTIFACT_FORMAT, "meta": meta or {}, "arrays": table}).encode()
+    start = -(-(len(ARTIFACT_MAGIC) + 8 + len(header)) // ARTIFACT_ALIGN) * ARTIFACT_ALIGN
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb") as fout:
+        fout.write(ARTIFACT_MAGIC)
+        fout.write(np.uint64(len(header)).tobytes())
+        fout.write(header)
+        for (name, arr) in arrays:
+            fout.seek(start + table[name]["offset"])
+            fout.write(arr.tobytes())
+        fout.truncate(start + offset)
+    os.rename(tmp_path, path)
+
+
+def read_artifact(path):
+    '''
+    Return (meta, arrays) from a file written by write_artifact(), arrays being
+    read-only views of one memory map (shared by all processes reading path)
+    '''
+    with open(path, "rb") as fin:
+        if fin.read(len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+            raise ValueError("'%s' isn't a taxonomy tree artifact" % path)
+        header_size = int(np.frombuffer(fin.read(8), dtype=np.uint64)[0])
+        header = json.loads(fin.read(header_size).decode())
+    if header["format"] != ARTIFACT_FORMAT:
+        raise ValueError("Unsupported artifact format %s in '%s' (expecting %s)" % \
+                         (header["format"], path, ARTIFACT_FORMAT))
+    start = -(-(len(ARTIFACT_MAGIC) + 8 + header_size) // ARTIFACT_ALIGN) * ARTIFACT_ALIGN
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for (name, info) in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"]))
+        offset = start + info["offset"]
+        arrays[name] = data[offset:offset + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+    return header["meta"], arrays
+
+
+class TaxonomyTree(object):
+    '''
+    Compact, array-backed view of the taxonomy tree. Nodes are numbered
+    by ascending taxid (node index i <=> self.taxid[i]) and laid out in
+    pre-order, so the subtree of node i is the contiguous slice
+    self.order[self.left[i]:self.left[i] + self.size[i]], children being
+    visited by ascending taxid.
+    '''
+
+    def __init__(self, taxids, parent_taxids, ranks=None, has_gene=None):
+        taxids = np.asarray(taxids, dtype=np.int64)
+        parent_taxids = np.asarray(parent_taxids, dtype=np.int64)
+        srt = np.argsort(taxids, kind="mergesort")
+        self.taxid = taxids[srt]
+        n = len(self.taxid)
+        if ranks is None:
+            self.rank = np.full(n, NO_RANK, dtype=np.uint8)
+        else:
+            self.rank = np.asarray(ranks, dtype=np.uint8)[srt]
+        if has_gene is None:
+            self.has_gene = np.zeros(n, dtype=bool)
+        else:
+            self.has_gene = np.asarray(has_gene, dtype=bool)[srt]
+        # parent as node index, nodes with unknown parent become roots
+        parent_taxids = parent_taxids[srt]
+        parent = np.searchsorted(self.taxid, parent_taxids)
+        parent[parent == n] = 0
+        idx = np.arange(n, dtype=parent.dtype)
+        self.parent = np.where(self.taxid[parent] == parent_taxids, parent, idx) if n else parent
+        self.depth = self._compute_depth()
+        self.size, self.left = self._compute_preorder()
+        self.order = np.empty(n, dtype=np.int64)
+        self.order[self.left] = np.arange(n)
+        # CSR-like lineage table, see compute_lineages()
+        self.lineage_offsets = None
+        self.lineage_taxids = None
+        # RMQ sparse table, see compute_lca_index()
+        self.sparse_table = None
+        # subtree counts, see compute_aggregates()
+        self.gene_descendants = None
+        self.species_descendants = None
+        # names, see set_names()
+        self.clear_names()
+
+    # arrays stored by save(), lineage, aggregates and names ones only if computed
+    ARRAYS = ["taxid", "parent", "rank", "has_gene", "depth", "size", "left", "order",
+              "lineage_offsets", "lineage_taxids", "gene_descendants", "species_descendants"]
+    NAME_ARRAYS = ["name_offsets", "name_class", "name_text_offsets", "name_text",
+                   "name_sorted", "name_score", "name_hash", "name_hash_entry"]
+
+    def save(self, folder, arrays=None):
+        '''
+        Save arrays (default: all of ARRAYS) as .npy files in folder, so they
+        can be memory-mapped with load()
+        '''
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in arrays or self.ARRAYS:
+            arr = getattr(self, name)
+            if arr is not None:
+                np.save(os.path.join(folder, "%s.npy" % name), arr)
+
+    @classmethod
+    def load(klass, folder, mmap_mode="r"):
+        '''
+        Restore a tree saved in folder. With default mmap_mode, arrays are
+        read-only memory maps shared (through page cache) by all processes
+        loading the same folder
+        '''
+        tree = klass.__new__(klass)
+        for name in klass.ARRAYS:
+            path = os.path.join(folder, "%s.npy" % name)
+            setattr(tree, name, np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None)
+        tree.sparse_table = None
+        tree.clear_names()
+        return tree
+
+    def save_artifact(self, path, version=None):
+        '''
+        Save tree (arrays, names included) as one versioned binary file, see
+        write_artifact(). version identifies the build it comes from.
+        '''
+        arrays = dict((name, getattr(self, name)) for name in self.ARRAYS + self.NAME_ARRAYS
+                      if getattr(self, name) is not None)
+        if self.sparse_table is not None:
+            # levels of the LCA sparse table, one after the other
+            arrays["lca_table"] = np.concatenate(self.sparse_table)
+            arrays["lca_offsets"] = np.cumsum([0] + [len(level) for level in self.sparse_table]).astype(np.int64)
+        write_artifact(path, arrays, {"version": version, "nodes": len(self)})
+
+    @classmethod
+    def load_artifact(klass, path):
+        '''
+        Memory-map a tree saved with save_artifact(), tree.version being the one
+        given then. Nothing is copied, loading is immediate.
+        '''
+        meta, arrays = read_artifact(path)
+        tree = klass.__new__(klass)
+        for name in klass.ARRAYS + klass.NAME_ARRAYS:
+            setattr(tree, name, arrays.get(name))
+        tree.sparse_table = None
+        if "lca_table" in arrays:
+            offsets = arrays["lca_offsets"].tolist()
+            tree.sparse_table = [arrays["lca_table"][start:end] for (start, end) in zip(offsets, offsets[1:])]
+        tree.version = meta.get("version")
+        return tree
+
+    @classmethod
+    def from_nodes(klass, nodes):
+        '''
+        Build a tree from an iterable of (taxid, parent_taxid, rank, has_gene) tuples
+        '''
+        taxids = []
+        parents = []
+        ranks = []
+        has_gene = []
+        for (taxid, parent_taxid, rank, gene) in nodes:
+            taxids.append(taxid)
+            parents.append(parent_taxid)
+            ranks.append(RANK_CODES.get(rank, NO_RANK))
+            has_gene.append(bool(gene))
+        return klass(taxids, parents, ranks, has_gene)
+
+    def clear_names(self):
+        for name in self.NAME_ARRAYS:
+            setattr(self, name, None)
+
+    def set_names(self, names):
+        '''
+        Store names from an iterable of (taxid, field, name) tuples, field being
+        one of NAME_FIELDS. Names of node i are entries name_offsets[i] to
+        name_offsets[i+1] of name_class (NAME_FIELDS index) and of name_text
+        (utf-8, entry j being bytes name_text_offsets[j] to name_text_offsets[j+1]).
+        Names of taxids not in the tree are ignored.
+        '''
+        codes = dict((field, code) for (code, field) in enumerate(NAME_FIELDS))
+        taxids = []
+        classes = []
+        texts = []
+        for (taxid, field, name) in names:
+            taxids.append(taxid)
+            classes.append(codes[field])
+            texts.append(name.encode())
+        indices = self.indices(taxids)
+        keep = np.flatnonzero(indices >= 0)
+        srt = keep[np.argsort(indices[keep], kind="mergesort")]
+        self.name_offsets = np.searchsorted(indices[srt], np.arange(len(self) + 1)).astype(np.int64)
+        self.name_class = np.asarray(classes, dtype=np.uint8)[srt]
+        texts = [texts[j] for j in srt.tolist()]
+        self.name_text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=self.name_text_offsets[1:])
+        self.name_text = np.frombuffer(b"".join(texts), dtype=np.uint8)
+        self.compute_name_index()
+
+    def name_text_at(self, j):
+        ''' Return text of name entry j '''
+        return self.name_text[self.name_text_offsets[j]:self.name_text_offsets[j + 1]].tobytes().decode()
+
+    def name_nodes(self, entries):
+        ''' Return node indices of name entries (array) '''
+        return np.searchsorted(self.name_offsets, entries, side="right") - 1
+
+    def compute_name_index(self):
+        '''
+        Sort name entries by normalized text (name_sorted, a permutation of
+        entries) so names starting with a prefix are a contiguous range of it,
+        found by binary search (see suggest()), and score them (name_score,
+        lower is better, see SUGGEST_RANK_ORDER). Also builds the exact match
+        hash index: sorted hashes of normalized names (name_hash) and their
+        entries (name_hash_entry), see resolve_names(). Called by set_names(),
+        has_gene and ranks must be set first.
+        '''
+        num = len(self.name_class)
+        texts = [normalize_name(self.name_text_at(j)) for j in range(num)]
+        self.name_sorted = np.array(sorted(range(num), key=texts.__getitem__), dtype=np.int64)
+        hashes = np.array([name_hash(text) for text in texts], dtype=np.int64)
+        self.name_hash_entry = np.argsort(hashes, kind="mergesort")
+        self.name_hash = hashes[self.name_hash_entry]
+        nodes = self.name_nodes(np.arange(num))
+        lengths = np.minimum(np.diff(self.name_text_offsets), 0xffff).astype(np.uint32)
+        self.name_score = ((~self.has_gene[nodes]).astype(np.uint32) << 24) | \
+                          (SUGGEST_RANK_ORDER[self.rank[nodes]] << 16) | lengths
+        self.name_score = self.name_score[self.name_sorted]
+
+    def suggest(self, prefix, size=10):
+        '''
+        Return list of (node index, name entry) of the (at most size) best ranked
+        distinct nodes having a name starting with prefix (case insensitive)
+        '''
+        prefix = normalize_name(prefix)
+        if not prefix or self.name_sorted is None:
+            return []
+        keys = _SortedNames(self)
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\U0010ffff", lo=start)
+        scores = self.name_score[start:end]
+        # several names of a node may match: take best candidates, more of them
+        # until there are size distinct nodes or all matching names were taken
+        num = size * 4
+        while True:
+            num = min(len(scores), num)
+            best = np.argpartition(scores, num - 1)[:num] if num < len(scores) else np.arange(len(scores))
+            best = best[np.lexsort((best, scores[best]))]
+            entries = self.name_sorted[start + best]
+            results = []
+            seen = set()
+            for (idx, entry) in zip(self.name_nodes(entries).tolist(), entries.tolist()):
+                if idx not in seen:
+                    seen.add(idx)
+                    results.append((idx, entry))
+                    if len(results) == size:
+                        return results
+            if num == len(scores):
+                return results
+            num *= 4
+
+    def resolve_names(self, names):
+        '''
+        Return, for each name of names (exact match, case insensitive), the
+        list of (node index, name entry) having that name, all names being
+        looked up at once in the hash index
+        '''
+        hashes = np.array([name_hash(name) for name in names], dtype=np.int64)
+        starts = np.searchsorted(self.name_hash, hashes, side="left").tolist()
+        ends = np.searchsorted(self.name_hash, hashes, side="right").tolist()
+        results = []
+        for (name, start, end) in zip(names, starts, ends):
+            entries = self.name_hash_entry[start:end]
+            if len(entries):
+                # rule out hash collisions
+                name = normalize_name(name)
+                entries = [j for j in entries.tolist() if normalize_name(self.name_text_at(j)) == name]
+                results.append(list(zip(self.name_nodes(np.array(entries, dtype=np.int64)).tolist(), entries)))
+            else:
+                results.append([])
+        return results
+
+    def names(self, idx):
+        '''
+        Return list of (field, name) of node index idx (names must have been set)
+        '''
+        start, end = self.name_offsets[idx], self.name_offsets[idx + 1]
+        offsets = self.name_text_offsets[start:end + 1].tolist()
+        text = self.name_text[offsets[0]:offsets[-1]].tobytes() if end > start else b""
+        return [(NAME_FIELDS[code], text[b - offsets[0]:e - offsets[0]].decode())
+                for (code, b, e) in zip(self.name_class[start:end].tolist(), offsets[:-1], offsets[1:])]
+
+    def _compute_depth(self):
+        # pointer jumping: depth[i] is the distance between i and anc[i],
+        # doubled at each step until all ancestors are roots
+        n = len(self.taxid)
+        anc = self.parent.copy()
+        depth = (anc != np.arange(n)).astype(np.int64)
+        while n:
+            jump = anc[anc]
+            if (jump == anc).all():
+                break
+            depth = depth + depth[anc]
+            anc = jump
+        return depth
+
+    def _compute_preorder(self):
+        n = len(self.taxid)
+        size = np.ones(n, dtype=np.int64)
+        left = np.zeros(n, dtype=np.int64)
+        if not n:
+            return size, left
+        # stable sort keeps nodes sorted by taxid within a level
+        by_depth = np.argsort(self.depth, kind="mergesort")
+        bounds = np.searchsorted(self.depth[by_depth], np.arange(self.depth.max() + 2))
+        levels = [by_depth[bounds[d]:bounds[d+1]] for d in range(len(bounds) - 1)]
+        # subtree sizes, bottom-up
+        for nodes in reversed(levels[1:]):
+            size += np.bincount(self.parent[nodes], weights=size[nodes], minlength=n).astype(np.int64)
+        # pre-order positions, top-down: a node starts right after its
+        # parent plus the size of its preceding siblings
+        roots = levels[0]
+        left[roots] = np.cumsum(size[roots]) - size[roots]
+        for nodes in levels[1:]:
+            nodes = nodes[np.argsort(self.parent[nodes], kind="mergesort")]
+            parents = self.parent[nodes]
+            excl = np.cumsum(size[nodes]) - size[nodes]
+            first = np.concatenate(([True], parents[1:] != parents[:-1]))
+            offset = excl - excl[first][np.cumsum(first) - 1]
+            left[nodes] = left[parents] + 1 + offset
+        return size, left
+
+    def compute_aggregates(self):
+        '''
+        Count, for all nodes at once, descendants with has_gene flag and
+        descendants of species rank (total descendants being size - 1):
+        subtrees are contiguous in pre-order, so these are differences of
+        prefix sums over the pre-order layout. has_gene must be set first.
+        '''
+        for (name, flags) in [("gene_descendants", self.has_gene), ("species_descendants", self.rank == SPECIES)]:
+            csum = np.zeros(len(self) + 1, dtype=np.int64)
+            np.cumsum(flags[self.order], out=csum[1:])
+            # node itself is at position left, excluded
+            setattr(self, name, csum[self.left + self.size] - csum[self.left + 1])
+
+    def subtree_fields(self, idx):
+        '''
+        Return dict of document fields describing node index idx position
+        in the tree: pre-order interval (descendants of a node, including
+        itself, are the docs with left in [left,right]), depth and subtree
+        counts if computed
+        '''
+        fields = {"left": int(self.left[idx]),
+                  "right": int(self.left[idx] + self.size[idx] - 1),
+                  "depth": int(self.depth[idx])}
+        if self.gene_descendants is not None:
+            fields["num_descendants"] = int(self.size[idx] - 1)
+            fields["num_gene_descendants"] = int(self.gene_descendants[idx])
+            fields["num_species_descendants"] = int(self.species_descendants[idx])
+        return fields
+
+    def compute_lineages(self):
+        '''
+        Compute lineages (taxid, parent, ..., root) of all nodes at once: lineage
+        of node i is self.lineage_taxids[self.lineage_offsets[i]:self.lineage_offsets[i+1]].
+        All nodes climb one level per iteration, so it takes max(depth) + 1 vectorized steps.
+        '''
+        n = len(self.taxid)
+        self.lineage_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.depth + 1, out=self.lineage_offsets[1:])
+        dtype = np.int32 if not n or self.taxid[-1] < 2**31 else np.int64
+        self.lineage_taxids = np.empty(self.lineage_offsets[-1], dtype=dtype)
+        cur = np.arange(n)
+        pos = self.lineage_offsets[:-1].copy()
+        remaining = self.depth.copy()
+        while len(cur):
+            self.lineage_taxids[pos] = self.taxid[cur]
+            climbing = remaining > 0
+            cur = self.parent[cur[climbing]]
+            pos = pos[climbing] + 1
+            remaining = remaining[climbing] - 1
+
+    def lineage(self, idx):
+        '''
+        Return lineage list of node index idx (compute_lineages() must have been called)
+        '''
+        return self.lineage_taxids[self.lineage_offsets[idx]:self.lineage_offsets[idx+1]].tolist()
+
+    def compute_lca_index(self):
+        '''
+        Build the RMQ sparse table used by lca(). Instead of the 2n-1 long Euler
+        tour, it's built over the pre-order layout (n entries): for two nodes u, v
+        with left[u] < left[v], the shallowest node at pre-order positions
+        (left[u], left[v]] is a child of their LCA. Level j holds, for each
+        position i, the shallowest node in positions [i, i + 2**j). That's
+        floor(log2(n)) + 1 int32 levels, about 220MB for the NCBI taxonomy: it's
+        stored in tree artifacts (see save_artifact()), so processes memory-mapping
+        the same artifact share one copy.
+        '''
+        level = self.order.astype(np.int32)
+        table = [level]
+        width = 1
+        while 2 * width <= len(self.order):
+            a = level[:-width]
+            b = level[width:]
+            level = np.where(self.depth[a] <= self.depth[b], a, b)
+            table.append(level)
+            width *= 2
+        self.sparse_table = table
+
+    def _pair_lca(self, u, v):
+        l, r = sorted((int(self.left[u]), int(self.left[v])))
+        if l == r:
+            return u
+        # shallowest node in positions l+1..r
+        k = (r - l).bit_length() - 1
+        a = self.sparse_table[k][l + 1]
+        b = self.sparse_table[k][r - (1 << k) + 1]
+        anc = self.parent[a] if self.depth[a] <= self.depth[b] else self.parent[b]
+        # nodes from different roots have no common ancestor
+        if self.left[anc] <= l and r < self.left[anc] + self.size[anc]:
+            return anc
+        return None
+
+    def lca(self, taxids):
+        '''
+        Return the lowest common ancestor taxid of given taxids (unknown ones
+        are ignored), None if no common ancestor. The LCA of a set is the LCA of
+        its first and last nodes in pre-order, so it takes O(k) plus one O(1) query.
+        '''
+        if self.sparse_table is None:
+            self.compute_lca_index()
+        indices = self.indices(taxids)
+        indices = indices[indices >= 0]
+        if not len(indices):
+            return None
+        pos = self.left[indices]
+        anc = self._pair_lca(indices[np.argmin(pos)], indices[np.argmax(pos)])
+        return None if anc is None else int(self.taxid[anc])
+
+    def diff(self, previous):
+        '''
+        Compare with previous tree, return (lineage_changed, interval_changed)
+        taxids: nodes whose lineage changed (new nodes included), and other
+        nodes whose pre-order interval, depth or subtree counts only changed
+        (counts are compared only if computed for this tree, all nodes being
+        considered changed if previous tree doesn't have them)
+        '''
+        prev = previous.indices(self.taxid)
+        found = prev >= 0
+        moved = ~found
+        moved[found] = previous.taxid[previous.parent[prev[found]]] != self.taxid[self.parent[found]]
+        # lineage changes for all nodes under a moved (or new) node, their
+        # subtrees being contiguous in pre-order
+        delta = np.zeros(len(self) + 1, dtype=np.int64)
+        np.add.at(delta, self.left[moved], 1)
+        np.add.at(delta, self.left[moved] + self.size[moved], -1)
+        lineage_changed = (np.cumsum(delta[:-1]) > 0)[self.left]
+        interval_changed = np.zeros(len(self), dtype=bool)
+        interval_changed[found] = (previous.left[prev[found]] != self.left[found]) | \
+                                  (previous.size[prev[found]] != self.size[found]) | \
+                                  (previous.depth[prev[found]] != self.depth[found])
+        if self.gene_descendants is not None:
+            if previous.gene_descendants is None:
+                interval_changed[found] = True
+            else:
+                interval_changed[found] |= \
+                        (previous.gene_descendants[prev[found]] != self.gene_descendants[found]) | \
+                        (previous.species_descendants[prev[found]] != self.species_descendants[found])
+        interval_changed &= ~lineage_changed
+        return self.taxid[lineage_changed], self.taxid[interval_changed]
+
+    def __len__(self):
+        return len(self.taxid)
+
+    def __contains__(self, taxid):
+        return self.index(taxid) >= 0
+
+    def index(self, taxid):
+        '''
+        Return node index for given taxid, -1 if not part of the tree
+        '''
+        i = int(np.searchsorted(self.taxid, taxid))
+        if i < len(self.taxid) and self.taxid[i] == taxid:
+            return i
+        return -1
+
+    def indices(self, taxids):
+        '''
+        Vectorized index(), returns an array
+        '''
+        taxids = np.asarray(taxids, dtype=np.int64)
+        idx = np.searchsorted(self.taxid, taxids)
+        idx[idx == len(self.taxid)] = 0
+        return np.where(self.taxid[idx] == taxids, idx, -1) if len(self.taxid) else np.full(len(taxids), -1)
+
+    def descendants(self, taxid, has_gene=False, include_self=False):
+        '''
+        Return sorted list of taxids found under given taxid (optionally
+        only those with has_gene flag), or None if taxid isn't in the tree.
+        As with former lineage queries, include_self adds taxid whatever
+        its has_gene flag is.
+        '''
+        i = self.index(taxid)
+        if i < 0:
+            return None
+        nodes = self.order[self.left[i] + 1:self.left[i] + self.size[i]]
+        if has_gene:
+            nodes = nodes[self.has_gene[nodes]]
+        if include_self:
+            nodes = np.append(nodes, i)
+        return self.taxid[np.sort(nodes)].tolist()
+
+    def descendants_page(self, taxid, after=None, size=None, has_gene=False):
+        '''
+        Return sorted list of the (at most size) smallest taxids greater than after
+        found under given taxid, or None if taxid isn't in the tree. Node indices
+        follow taxids order, so only the page itself is sorted.
+        '''
+        i = self.index(taxid)
+        if i < 0:
+            return None
+        nodes = self.order[self.left[i] + 1:self.left[i] + self.size[i]]
+        if has_gene:
+            nodes = nodes[self.has_gene[nodes]]
+        if after is not None:
+            nodes = nodes[self.taxid[nodes] > after]
+        if size is not None and len(nodes) > size:
+            nodes = np.partition(nodes, size - 1)[:size]
+        return self.taxid[np.sort(nodes)].tolist()
+
+
+class _SortedNames(object):
+    ''' Sequence of normalized names in name_sorted order, for bisect '''
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def __len__(self):
+        return len(self.tree.name_sorted)
+
+    def __getitem__(self, k):
+        return normalize_name(self.tree.name_text_at(self.tree.name_sorted[k]))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+from collections import OrderedDict
+
+class ChildrenCache(object):
+    ''' Process-wide LRU cache for children lists, bounded by an estimation of
+    the memory used by cached lists. Entries belong to a build version, resetting
+    the cache with a new version (new build published) drops all of them. '''
+    def __init__(self, max_size, version=None):
+        self.max_size = max_size
+        self.version = version
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _sizeof(value):
+        # list itself plus int objects (ids > 256 aren't shared)
+        return sys.getsizeof(value) + 28 * len(value)
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get((self.version, key))
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end((self.version, key))
+            self.hits += 1
+            return value[0]
+
+    def set(self, key, value):
+        size = self._sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._data.pop((self.version, key), None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[(self.version, key)] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def reset(self, version):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+            self.version = version
+            self.invalidations += 1
+
+    def stats(self):
+        return {'build_version': self.version, 'entries': len(self._data), 'size': self.size,
+                'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
+class SingleFlight(object):
+    ''' In-flight lookups (futures) by key, so concurrent requests looking up the
+    same key share one backend call and its result instead of each issuing its own.
+    Futures are registered when started and dropped once done (which may happen in
+    another thread, e.g. an executor's). '''
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.keys = 0
+        self.coalesced_requests = 0
+        self.coalesced_keys = 0
+
+    def get(self, key):
+        with self._lock:
+            return self._inflight.get(key)
+
+    def add(self, keys, future):
+        ''' Register future as the in-flight lookup of keys '''
+        with self._lock:
+            self.calls += 1
+            self.keys += len(keys)
+            for key in keys:
+                self._inflight[key] = future
+        def done(fut):
+            with self._lock:
+                for key in keys:
+                    if self._inflight.get(key) is fut:
+                        del self._inflight[key]
+        future.add_done_callback(done)
+
+    def joined(self, num_keys):
+        ''' Count a request which joined in-flight lookups of num_keys keys '''
+        with self._lock:
+            self.coalesced_requests += 1
+            self.coalesced_keys += num_keys
+
+    def stats(self):
+        return {'inflight': len(self._inflight), 'calls': self.calls, 'keys': self.keys,
+                'coalesced_requests': self.coalesced_requests, 'coalesced_keys': self.coalesced_keys}
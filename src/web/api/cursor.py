@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+
+def encode_cursor(taxid, after):
+    ''' Return opaque cursor to the next page of children of taxid (None for
+    expand_species pages), that is children with a taxid greater than after. '''
+    data = json.dumps({'id': None if taxid is None else str(taxid), 'after': int(after)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    ''' Return {'id': taxid, 'after': taxid} from a cursor, raises ValueError if invalid. '''
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+        return {'id': data['id'] if data['id'] is None else str(data['id']), 'after': int(data['after'])}
+    except Exception:
+        raise ValueError("Invalid cursor '{}'".format(cursor))
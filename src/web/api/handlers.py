@@ -1,36 +1,463 @@
 # -*- coding: utf-8 -*-
+import json
+from tornado import gen
 from biothings.web.api.es.handlers import BiothingHandler
 from biothings.web.api.es.handlers import MetadataHandler
 from biothings.web.api.es.handlers import QueryHandler
 from biothings.web.api.es.handlers import StatusHandler
-#import logging
+from biothings.web.api.helper import BaseHandler
+from biothings.web.api.helper import BiothingParameterTypeError
+from biothings.utils.common import split_ids
+from utils.tree import RANKS, NAME_FIELDS
+from web.api.cursor import decode_cursor
+from web.api.metrics import RequestTimer, OPTIONS
+from web.api.query import PrefetchedQuery
+import logging
 
 def pre_query_builder_hook(inst, options):
+    inst.web_settings.check_build_version()
+    if getattr(inst, '_timer', None) is None:
+        inst._timer = RequestTimer()
+    inst._metrics_options = [(opt, 'true' if options.transform_kwargs.get(opt) else 'false') for opt in OPTIONS]
     options['transform_kwargs']['index'] = inst._get_es_index(options)
     options['transform_kwargs']['doc_type'] = inst._get_es_doc_type(options)
     options['transform_kwargs']['es_client'] = inst.web_settings.es_client
+    options['transform_kwargs']['taxonomy_tree'] = inst.web_settings.taxonomy_tree
+    options['transform_kwargs']['children_cache'] = inst.web_settings.children_cache
+    options['transform_kwargs']['children_prefetch'] = getattr(inst, '_children_prefetch', None)
+    options['transform_kwargs']['children_pages'] = getattr(inst, '_children_pages', None)
+    options['transform_kwargs']['request_timer'] = inst._timer
     return options
 
-class TaxonHandler(BiothingHandler):
-    ''' This class is for the /taxon endpoint. '''
+def pre_query_hook(inst, options, query):
+    inst._timer.start('es')
+    return query
+
+def pre_transform_hook(inst, options, res):
+    inst._timer.stop('es')
+    inst._timer.es_calls += 1
+    inst._timer.start('transform')
+    return res
+
+def pre_finish_hook(inst, options, res):
+    inst._timer.stop('transform')
+    return res
+
+def record_metrics_hook(inst):
+    ''' Record request stages timings, for requests which went through the query pipeline '''
+    timer = getattr(inst, '_timer', None)
+    if timer is None:
+        return
+    timer.stop('es')
+    timer.stop('transform')
+    timer.add('total', inst.request.request_time())
+    inst.web_settings.metrics.record(timer, [('endpoint', inst.metrics_endpoint),
+                                             ('method', inst.request.method)] + inst._metrics_options)
+
+@gen.coroutine
+def prefetch_children_hook(inst, ids, options):
+    ''' Look up children of ids in a thread of the web settings' ES executor, so the
+    IOLoop keeps serving other requests meanwhile. Results are then used by the
+    transformer instead of querying ES synchronously (see "children_prefetch"). Only
+    needed when children are queried from ES (no in-memory taxonomy tree). '''
+    inst._children_prefetch = None
+    inst._children_pages = None
+    if inst.web_settings.taxonomy_tree is not None or not ids or \
+       not (options.transform_kwargs.include_children or options.transform_kwargs.expand_species):
+        return
+    options = pre_query_builder_hook(inst, options)
+    # timed here as a whole, not by the transformer running in another thread
+    options['transform_kwargs']['request_timer'] = None
+    kwargs = options.transform_kwargs
+    if kwargs.expand_species and (kwargs.children_size or kwargs.children_cursor):
+        # paginated expand_species only needs one page of all ids' children
+        yield prefetch_children_pages_hook(inst, options, [(ids, kwargs.children_cursor['after'] if kwargs.children_cursor else None)])
+        return
+    has_gene = bool(options.transform_kwargs.has_gene)
+    # single-flight: ids already being looked up by concurrent requests
+    # (same build, same has_gene) share that lookup
+    inflight = inst.web_settings.children_inflight
+    version = inst.web_settings.build_version
+    futures = {}
+    missing = []
+    for _id in ids:
+        future = inflight.get((version, str(_id), has_gene))
+        if future is None:
+            missing.append(_id)
+        else:
+            futures.setdefault(future, []).append(str(_id))
+    if futures:
+        inflight.joined(len(ids) - len(missing))
+    if missing:
+        inst._timer.es_calls += 1
+        transformer = inst.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, host=inst.request.host)
+        future = inst.web_settings.es_executor.submit(transformer._children_query, missing, has_gene=has_gene)
+        inflight.add([(version, str(_id), has_gene) for _id in missing], future)
+        futures[future] = [str(_id) for _id in missing]
+    futures = list(futures.items())
+    inst._timer.start('children')
+    try:
+        results = yield [future for (future, _) in futures]
+    except Exception:
+        # children are then queried (and errors handled) as usual by the transformer
+        logging.exception("Error prefetching children")
+        return
+    finally:
+        inst._timer.stop('children')
+    prefetch = {}
+    for ((_, keys), children) in zip(futures, results):
+        children = dict([(str(taxid), taxids) for (taxid, taxids) in children.items()])
+        for key in keys:
+            if key in children:
+                prefetch[(key, has_gene, False)] = children[key]
+    inst._children_prefetch = prefetch
+    cursor = kwargs.children_cursor
+    if kwargs.include_children and cursor and (cursor['id'], has_gene, False) in prefetch:
+        # the page children_cursor points to (first pages are cut from lists,
+        # see the transformer's _paginate_children)
+        yield prefetch_children_pages_hook(inst, options, [([cursor['id']], cursor['after'])])
+
+@gen.coroutine
+def prefetch_children_pages_hook(inst, options, pages):
+    ''' Same as prefetch_children_hook for pages of children lists (children_size and
+    children_cursor parameters, see the transformer's _children_page), pages being a list
+    of (ids, after). Results are used by the transformer (see "children_pages"). '''
+    has_gene = bool(options.transform_kwargs.has_gene)
+    transformer = inst.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, host=inst.request.host)
+    size = transformer._page_size()
+    futures = [inst.web_settings.es_executor.submit(transformer._timed_children_page, ids, has_gene=has_gene,
+                                                    after=after, size=size) for (ids, after) in pages]
+    inst._timer.es_calls += len(futures)
+    inst._timer.start('children')
+    try:
+        results = yield futures
+    except Exception:
+        # pages are then queried (and errors handled) as usual by the transformer
+        logging.exception("Error prefetching children pages")
+        return
+    finally:
+        inst._timer.stop('children')
+    inst._children_pages = dict([(transformer._children_page_key(ids, has_gene, after, size), page)
+                                 for ((ids, after), page) in zip(pages, results)])
+
+def sanitize_params_hook(inst, args):
+    if args.get('children_cursor'):
+        try:
+            args['children_cursor'] = decode_cursor(args['children_cursor'])
+        except ValueError as e:
+            raise BiothingParameterTypeError(str(e))
+    return args
+
+class StageMetricsMixin(object):
+    ''' Times ES query, children lookups and transform stages of requests,
+    recorded in web_settings.metrics (see /metrics) once the request is finished '''
+    metrics_endpoint = None
+
+    def _pre_query_GET_hook(self, options, query):
+        return pre_query_hook(self, options, query)
+
+    def _pre_query_POST_hook(self, options, query):
+        return pre_query_hook(self, options, query)
+
+    def _pre_transform_GET_hook(self, options, res):
+        return pre_transform_hook(self, options, res)
+
+    def _pre_transform_POST_hook(self, options, res):
+        return pre_transform_hook(self, options, res)
+
+    def _pre_finish_GET_hook(self, options, res):
+        return pre_finish_hook(self, options, res)
+
+    def _pre_finish_POST_hook(self, options, res):
+        return pre_finish_hook(self, options, res)
+
+    def on_finish(self):
+        record_metrics_hook(self)
+
+class TaxonHandler(StageMetricsMixin, BiothingHandler):
+    ''' This class is for the /taxon endpoint. Taxids merged into another one are
+    transparently resolved to it (documents are marked with "merged_from"), deleted
+    ones are marked as such, using the alias table loaded from the build. Children
+    lists (and pages of them) queried from ES are looked up asynchronously before the
+    request is handled. '''
+    metrics_endpoint = 'taxon'
+
+    @gen.coroutine
+    def _prefetch_children(self, ids=None):
+        if self.web_settings.taxonomy_tree is not None:
+            # children are answered from the tree, nothing to look up
+            self._children_prefetch = None
+            self._children_pages = None
+            return
+        try:
+            options = self.get_cleaned_options(self.get_query_params())
+        except BiothingParameterTypeError:
+            # reported when the request is handled
+            self._children_prefetch = None
+            self._children_pages = None
+            return
+        if ids is None:
+            ids = options.control_kwargs.ids or []
+            if self.web_settings.taxid_aliases is not None:
+                resolved = self.web_settings.taxid_aliases.resolve_ids(ids)
+                ids = [resolved.get(_id) or _id for _id in ids if resolved.get(_id, _id)]
+        yield prefetch_children_hook(self, list(set(ids)), options)
+
+    @gen.coroutine
+    def get(self, bid=None):
+        self._merged_from = None
+        aliases = self.web_settings.taxid_aliases
+        if bid and aliases is not None:
+            resolved = aliases.resolve_ids([bid])
+            if bid in resolved and resolved[bid] is None:
+                self.return_object({'success': False, 'deleted': True,
+                                    'error': self.web_settings.ID_NOT_FOUND_TEMPLATE.format(bid=bid)}, status_code=404)
+                return
+            if bid in resolved:
+                self._merged_from = bid
+                bid = resolved[bid]
+        if bid:
+            yield self._prefetch_children([bid])
+        super(TaxonHandler, self).get(bid)
+
+    @gen.coroutine
+    def post(self, ids=None):
+        yield self._prefetch_children()
+        super(TaxonHandler, self).post(ids)
+
+    def _sanitize_params(self, args):
+        args = super(TaxonHandler, self)._sanitize_params(args)
+        return sanitize_params_hook(self, args)
+
     def _pre_query_builder_GET_hook(self, options):
         return pre_query_builder_hook(self, options)
 
+    def _pre_finish_GET_hook(self, options, res):
+        if self._merged_from and isinstance(res, dict):
+            res['merged_from'] = self._merged_from
+        return super(TaxonHandler, self)._pre_finish_GET_hook(options, res)
+
     def _pre_query_builder_POST_hook(self, options):
+        aliases = self.web_settings.taxid_aliases
+        if aliases is not None:
+            # query resolved ids, results are reported under the ids as posted
+            ids = options.control_kwargs.ids
+            resolved = aliases.resolve_ids(ids)
+            if resolved:
+                options['transform_kwargs']['query_ids'] = ids
+                options['transform_kwargs']['taxid_aliases'] = resolved
+                options['control_kwargs']['ids'] = [resolved.get(_id) or _id for _id in ids]
         return pre_query_builder_hook(self, options)
 
-class QueryHandler(QueryHandler):
-    ''' This class is for the /query endpoint. '''
+class QueryHandler(StageMetricsMixin, QueryHandler):
+    ''' This class is for the /query endpoint. When children are queried from ES, the
+    query itself and children lists of its hits are run asynchronously before the
+    request is handled, the query response being then used as is (see query.PrefetchedQuery). '''
+    metrics_endpoint = 'query'
+
+    def _build_query(self, options, method):
+        ''' Same query as the one built by biothings' pipeline '''
+        builder = self.web_settings.ES_QUERY_BUILDER(options=options.esqb_kwargs, index=self._get_es_index(options),
+            doc_type=self._get_es_doc_type(options), es_options=options.es_kwargs,
+            userquery_dir=self.web_settings.USERQUERY_DIR, default_scopes=self.web_settings.DEFAULT_SCOPES,
+            scroll_options={'scroll': self.web_settings.ES_SCROLL_TIME, 'size': self.web_settings.ES_SCROLL_SIZE})
+        if method == 'GET':
+            return builder.query_GET_query(q=options.control_kwargs.q)
+        return builder.query_POST_query(qs=options.control_kwargs.q, scopes=options.esqb_kwargs.scopes)
+
+    @gen.coroutine
+    def _prefetch_children(self, method):
+        self._query_response = None
+        self._children_prefetch = None
+        self._children_pages = None
+        if self.web_settings.taxonomy_tree is not None:
+            # children are answered from the tree, nothing to look up
+            return
+        try:
+            options = self.get_cleaned_options(self.get_query_params())
+        except BiothingParameterTypeError:
+            # reported when the request is handled
+            return
+        control = options.control_kwargs
+        if not options.transform_kwargs.include_children or not control.q or \
+           control.fetch_all or control.scroll_id:
+            return
+        options = pre_query_builder_hook(self, options)
+        self._timer.start('es')
+        try:
+            query = self._build_query(options, method)
+            backend = self.web_settings.ES_QUERY(client=self.web_settings.es_client, options=options.es_kwargs)
+            res = yield self.web_settings.es_executor.submit(getattr(backend, 'query_{}_query'.format(method)), query)
+        except Exception:
+            # then queried (and errors handled) as usual by biothings' pipeline
+            logging.exception("Error prefetching query")
+            return
+        finally:
+            self._timer.stop('es')
+        self._query_response = res
+        if method == 'GET':
+            hits = res.get('hits', {}).get('hits', [])
+        else:
+            hits = [hit for hit_list in res.get('responses', []) for hit in hit_list.get('hits', {}).get('hits', [])]
+        yield prefetch_children_hook(self, list(set([hit['_id'] for hit in hits])), options)
+
+    @gen.coroutine
+    def get(self):
+        yield self._prefetch_children('GET')
+        super(QueryHandler, self).get()
+
+    @gen.coroutine
+    def post(self):
+        yield self._prefetch_children('POST')
+        super(QueryHandler, self).post()
+
+    def _sanitize_params(self, args):
+        args = super(QueryHandler, self)._sanitize_params(args)
+        return sanitize_params_hook(self, args)
+
     def _pre_query_builder_GET_hook(self, options):
         return pre_query_builder_hook(self, options)
 
     def _pre_query_builder_POST_hook(self, options):
         return pre_query_builder_hook(self, options)
 
+    def _pre_query_GET_hook(self, options, query):
+        query = super(QueryHandler, self)._pre_query_GET_hook(options, query)
+        if getattr(self, '_query_response', None) is not None:
+            return PrefetchedQuery(query, self._query_response)
+        return query
+
+    def _pre_query_POST_hook(self, options, query):
+        query = super(QueryHandler, self)._pre_query_POST_hook(options, query)
+        if getattr(self, '_query_response', None) is not None:
+            return PrefetchedQuery(query, self._query_response)
+        return query
+
 class StatusHandler(StatusHandler):
-    ''' This class is for the /status endpoint. '''
-    pass
+    ''' This class is for the /status endpoint. Body is 'OK' (as expected by health
+    checks), /status?stats=1 returns build version and children cache counters. '''
+    def get(self):
+        self.head()
+        if self.get_argument('stats', '').lower() not in ('1', 'true'):
+            self.write('OK')
+            return
+        self.return_json({'success': True, 'build_version': self.web_settings.build_version,
+                          'children_cache': self.web_settings.children_cache.stats(),
+                          'children_inflight': self.web_settings.children_inflight.stats()})
 
 class MetadataHandler(MetadataHandler):
     ''' This class is for the /metadata endpoint. '''
     pass
+
+class LCAHandler(BaseHandler):
+    ''' This class is for the /lca endpoint, returning the lowest common ancestor
+    of a set of taxids (GET or POST "ids" parameter). '''
+    def _lca(self):
+        tree = self.web_settings.taxonomy_tree
+        if tree is None:
+            self.return_json({'success': False, 'error': 'Taxonomy tree not available'}, status_code=503)
+            return
+        ids = split_ids(self.get_argument('ids', ''))
+        if not ids:
+            self.return_json({'success': False, 'error': 'Missing required parameters.'}, status_code=400)
+            return
+        taxids = [int(_id) for _id in ids if _id.isdigit()]
+        indices = tree.indices(taxids)
+        found = set(tree.taxid[indices[indices >= 0]].tolist())
+        self.return_json({'lca': tree.lca(taxids),
+                          'notfound': [_id for _id in ids if not (_id.isdigit() and int(_id) in found)]})
+
+    def get(self):
+        self._lca()
+
+    def post(self):
+        self._lca()
+
+class SuggestHandler(BaseHandler):
+    ''' This class is for the /suggest endpoint, returning taxa having a name starting
+    with "q" (case insensitive), taxa with genes first then species, below and above
+    species taxa. Answered from the names index of the taxonomy tree (mapped from the
+    build's artifact or built when scanning the index, see load_taxonomy_tree). '''
+    def get(self):
+        tree = self.web_settings.taxonomy_tree
+        if tree is None or tree.name_sorted is None:
+            self.return_json({'success': False, 'error': 'Name index not available'}, status_code=503)
+            return
+        q = self.get_argument('q', '')
+        if not q.strip():
+            self.return_json({'success': False, 'error': 'Missing required parameters.'}, status_code=400)
+            return
+        try:
+            size = min(int(self.get_argument('size', self.web_settings.SUGGEST_DEFAULT_SIZE)),
+                       self.web_settings.SUGGEST_MAX_SIZE)
+        except ValueError:
+            self.return_json({'success': False, 'error': 'Invalid size parameter.'}, status_code=400)
+            return
+        hits = []
+        for (idx, entry) in tree.suggest(q, max(size, 1)):
+            hits.append({'taxid': int(tree.taxid[idx]), 'name': tree.name_text_at(entry),
+                         'name_class': NAME_FIELDS[tree.name_class[entry]],
+                         'scientific_name': dict(tree.names(idx)).get('scientific_name'),
+                         'rank': RANKS[tree.rank[idx]], 'has_gene': bool(tree.has_gene[idx])})
+        self.return_json({'q': q, 'hits': hits})
+
+class ResolveHandler(BaseHandler):
+    ''' This class is for the /resolve endpoint, resolving a batch of organism names
+    (exact match of any name class, case insensitive) to taxids. Names are POSTed as
+    "names", one per line, or as a JSON list {"names": [...]}. All names are looked up
+    at once in the hashed names index of the taxonomy tree (as for /suggest, whether the
+    tree is mapped from an artifact or built from an index scan), results are streamed as
+    a JSON list, one element per match ({"notfound": true} if none) in input order. '''
+    def _get_names(self):
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            names = json.loads(self.request.body.decode()).get('names', [])
+            return [name for name in names if isinstance(name, str) and name.strip()]
+        return [name for name in self.get_argument('names', '').splitlines() if name.strip()]
+
+    @gen.coroutine
+    def post(self):
+        tree = self.web_settings.taxonomy_tree
+        if tree is None or tree.name_hash is None:
+            self.return_json({'success': False, 'error': 'Name index not available'}, status_code=503)
+            return
+        try:
+            names = self._get_names()
+        except (ValueError, AttributeError):
+            self.return_json({'success': False, 'error': 'Invalid JSON body.'}, status_code=400)
+            return
+        if not names:
+            self.return_json({'success': False, 'error': 'Missing required parameters.'}, status_code=400)
+            return
+        if len(names) > self.web_settings.RESOLVE_MAX_NAMES:
+            self.return_json({'success': False, 'error': 'Too many names (max {}).'.format(
+                self.web_settings.RESOLVE_MAX_NAMES)}, status_code=400)
+            return
+        matches = tree.resolve_names(names)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.support_cors()
+        self.write('[')
+        chunk = []
+        sep = ''
+        for (name, found) in zip(names, matches):
+            if not found:
+                chunk.append({'query': name, 'notfound': True})
+            for (idx, entry) in found:
+                chunk.append({'query': name, 'taxid': int(tree.taxid[idx]),
+                              'name_class': NAME_FIELDS[tree.name_class[entry]],
+                              'scientific_name': dict(tree.names(idx)).get('scientific_name'),
+                              'rank': RANKS[tree.rank[idx]]})
+            if len(chunk) >= self.web_settings.RESOLVE_CHUNK_SIZE:
+                self.write(sep + ','.join([json.dumps(res) for res in chunk]))
+                yield self.flush()
+                chunk = []
+                sep = ','
+        if chunk:
+            self.write(sep + ','.join([json.dumps(res) for res in chunk]))
+        self.finish(']')
+
+class MetricsHandler(BaseHandler):
+    ''' This class is for the /metrics endpoint, exposing per-stage latency histograms
+    and ES calls per request of /taxon and /query requests in Prometheus text format. '''
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(self.web_settings.metrics.render())
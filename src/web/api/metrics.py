@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+# latency buckets (seconds) and ES calls per request buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+ES_CALLS_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50]
+# request stages: main ES query, children lookups (ES or tree), transformer post-processing
+# (children lookups excluded) and whole request
+STAGES = ['es', 'children', 'transform', 'total']
+# request options metrics are broken down by
+OPTIONS = ['include_children', 'expand_species', 'has_gene']
+
+class Histogram(object):
+    ''' Cumulative histogram, as exposed in Prometheus text format '''
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            yield '{}_bucket{{{}}} {}'.format(name, _labels(labels + [('le', bound)]), cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, _labels(labels), self.sum)
+        yield '{}_count{{{}}} {}'.format(name, _labels(labels), self.count)
+
+def _labels(labels):
+    return ','.join(['{}="{}"'.format(k, v) for (k, v) in labels])
+
+class Metrics(object):
+    ''' Process-wide web API metrics: per-stage latency histograms and ES calls per
+    request, by endpoint, method and request options. Recording a request is a few
+    dict lookups and increments, cheap enough to be always on. '''
+    def __init__(self, latency_buckets=None):
+        self.latency_buckets = latency_buckets or LATENCY_BUCKETS
+        self._latency = OrderedDict()
+        self._es_calls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, timer, labels):
+        labels = tuple(labels)
+        with self._lock:
+            for (stage, seconds) in timer.stages().items():
+                key = labels + (('stage', stage),)
+                if key not in self._latency:
+                    self._latency[key] = Histogram(self.latency_buckets)
+                self._latency[key].observe(seconds)
+            if labels not in self._es_calls:
+                self._es_calls[labels] = Histogram(ES_CALLS_BUCKETS)
+            self._es_calls[labels].observe(timer.es_calls)
+
+    def render(self):
+        ''' Return metrics in Prometheus text exposition format '''
+        lines = ['# HELP species_request_stage_seconds Time spent per request stage',
+                 '# TYPE species_request_stage_seconds histogram']
+        with self._lock:
+            for (labels, histogram) in self._latency.items():
+                lines.extend(histogram.lines('species_request_stage_seconds', list(labels)))
+            lines.extend(['# HELP species_request_es_calls Elasticsearch calls per request',
+                          '# TYPE species_request_es_calls histogram'])
+            for (labels, histogram) in self._es_calls.items():
+                lines.extend(histogram.lines('species_request_es_calls', list(labels)))
+        return '\n'.join(lines) + '\n'
+
+class RequestTimer(object):
+    ''' Time spent in each stage of one request, and number of ES calls '''
+    def __init__(self):
+        self._elapsed = dict([(stage, 0.0) for stage in STAGES])
+        self._started = {}
+        self.es_calls = 0
+
+    def start(self, stage):
+        self._started[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        started = self._started.pop(stage, None)
+        if started is not None:
+            self._elapsed[stage] += time.perf_counter() - started
+
+    def add(self, stage, seconds):
+        self._elapsed[stage] += seconds
+
+    def timed(self, stage, es_calls=0):
+        ''' Context manager timing a stage, counting es_calls ES calls '''
+        return _Timed(self, stage, es_calls)
+
+    def stages(self):
+        return dict(self._elapsed)
+
+class _Timed(object):
+    def __init__(self, timer, stage, es_calls):
+        self.timer = timer
+        self.stage = stage
+        self.es_calls = es_calls
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.timer.es_calls += self.es_calls
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.started
+        self.timer.add(self.stage, elapsed)
+        # stages are exclusive: children lookups done while transforming aren't transform time
+        for stage in self.timer._started:
+            if stage != self.stage:
+                self.timer.add(stage, -elapsed)
@@ -1,6 +1,21 @@
 # -*- coding: utf-8 -*-
 from biothings.web.api.es.query import ESQuery
 
+class PrefetchedQuery(object):
+    ''' Query already run by the handler (see handlers.QueryHandler), its response
+    being returned as is instead of querying ES again '''
+    def __init__(self, query, response):
+        self.query = query
+        self.response = response
+
 class ESQuery(ESQuery):
     # Add app specific queries here
-    pass
+    def query_GET_query(self, query, *args, **kwargs):
+        if isinstance(query, PrefetchedQuery):
+            return query.response
+        return super(ESQuery, self).query_GET_query(query, *args, **kwargs)
+
+    def query_POST_query(self, query, *args, **kwargs):
+        if isinstance(query, PrefetchedQuery):
+            return query.response
+        return super(ESQuery, self).query_POST_query(query, *args, **kwargs)
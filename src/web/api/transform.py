@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
+import json
 from biothings.web.api.es.transform import ESResultTransformer
 from biothings.utils.common import is_str, is_seq
 from collections import OrderedDict
+from web.api.cursor import encode_cursor
+from web.api.metrics import RequestTimer
 #import logging
 
 class ESResultTransformer(ESResultTransformer):
@@ -10,24 +13,173 @@ class ESResultTransformer(ESResultTransformer):
         super(ESResultTransformer, self).__init__(*args, **kwargs)
         #logging.debug(self.options)
         self.max_taxid_count = max_taxid_count
+        # children lists are sorted and cut at max_taxid_count + 1 entries, an entry
+        # past max_taxid_count telling the list was cut (see _paginate_children)
+        self._children_list_size = max_taxid_count + 1
         self._children_query_dict = {}
+        self._children_next = {}
+
+    def _tree_children_query(self, ids, has_gene=True, include_self=False):
+        ''' Same as _children_query but answered from the in-memory taxonomy tree. '''
+        if is_str(ids) or isinstance(ids, int):
+            ids = [ids]
+        _ret = {}
+        for taxid in ids:
+            try:
+                # only the smallest taxids are kept, the whole subtree isn't listed
+                children = self.options.taxonomy_tree.descendants_page(int(taxid), size=self._children_list_size,
+                                                                       has_gene=has_gene)
+            except ValueError:
+                continue
+            if include_self:
+                children = sorted((children or []) + [int(taxid)])[:self._children_list_size]
+            _ret[taxid] = children or []
+        return _ret
+
+    def _timer(self):
+        # request stages timer (see /metrics), a throwaway one if not given
+        return self.options.request_timer or RequestTimer()
 
     def _children_query(self, ids, has_gene=True, include_self=False, raw=False):
+        with self._timer().timed('children'):
+            return self._timed_children_query(ids, has_gene=has_gene, include_self=include_self, raw=raw)
+
+    def _timed_children_query(self, ids, has_gene=True, include_self=False, raw=False):
+        ''' Return children lists prefetched by the handler (asynchronously, see
+        handlers.prefetch_children_hook) or from the process-wide cache, only
+        querying the missing ones. '''
+        cache = self.options.children_cache
+        prefetched = self.options.children_prefetch or {}
+        if raw or (cache is None and not prefetched):
+            return self._uncached_children_query(ids, has_gene=has_gene, include_self=include_self, raw=raw)
+        _ret = {}
+        misses = []
+        for taxid in ([ids] if is_str(ids) or isinstance(ids, int) else ids):
+            children = prefetched.get((str(taxid), has_gene, include_self))
+            if children is None and cache is not None:
+                children = cache.get((str(taxid), has_gene, include_self))
+            if children is None:
+                misses.append(taxid)
+            else:
+                _ret[taxid] = children
+        if misses:
+            res = self._uncached_children_query(misses, has_gene=has_gene, include_self=include_self)
+            if cache is not None:
+                for (taxid, children) in res.items():
+                    cache.set((str(taxid), has_gene, include_self), children)
+            _ret.update(res)
+        return _ret
+
+    def _page_size(self):
+        return max(1, min(self.options.children_size or self.max_taxid_count, self.max_taxid_count))
+
+    def _children_page(self, ids, has_gene=True, after=None, size=None):
+        ''' Return (taxids, last): sorted taxids greater than after (at most size) found
+        under any of ids (ids themselves excluded), last being the after value of next
+        page (None if there's none). Answered from the tree, or from ES (see _children_es_body).
+        Pages prefetched by the handler (see handlers.prefetch_children_pages_hook) aren't
+        queried again. '''
+        pages = self.options.children_pages or {}
+        key = self._children_page_key(ids, has_gene, after, size)
+        if key in pages:
+            return pages[key]
+        with self._timer().timed('children'):
+            return self._timed_children_page(ids, has_gene=has_gene, after=after, size=size)
+
+    @staticmethod
+    def _children_page_key(ids, has_gene, after, size):
+        return (tuple(sorted(set([str(taxid) for taxid in ids]))), bool(has_gene), after, size)
+
+    def _timed_children_page(self, ids, has_gene=True, after=None, size=None):
+        if self.options.taxonomy_tree is not None:
+            found = set()
+            for taxid in ids:
+                found.update(self.options.taxonomy_tree.descendants_page(int(taxid), after=after, size=size + 1,
+                                                                        has_gene=has_gene) or [])
+            taxids = sorted(found)[:size + 1]
+            return (taxids[:size], taxids[size - 1] if len(taxids) > size else None)
+        self._timer().es_calls += 1
+        res = self.options.es_client.search(body=self._children_es_body(ids, has_gene=has_gene, after=after, size=size),
+                                            index=self.options.index, doc_type=self.options.doc_type)
+        return self._children_es_hits(res)
+
+    def _children_es_body(self, ids, has_gene=True, after=None, size=None):
+        ''' ES query body of taxa found under any of ids, sorted by taxid, next pages being
+        filtered on taxid > after (search_after needs ES 5). At most max_taxid_count hits
+        are asked for, as ES rejects from + size past index.max_result_window (10000). '''
+        _qstring = "lineage:({})".format(" OR ".join([str(taxid) for taxid in ids]))
+        # ids themselves match lineage queries, they're excluded so pages are full
+        query = {"bool": {"must": {"query_string": {"query": _qstring + (" AND has_gene:true" if has_gene else "")}},
+                          "must_not": {"terms": {"taxid": [int(taxid) for taxid in ids]}}}}
+        if after is not None:
+            # taxid is unique, so that's where previous page ended
+            query["bool"]["filter"] = {"range": {"taxid": {"gt": after}}}
+        return {"query": query, "sort": [{"taxid": "asc"}], "size": min(size or self.max_taxid_count, self.max_taxid_count),
+                "_source": False}
+
+    def _children_es_hits(self, res):
+        ''' Return (taxids, last) of a _children_es_body search, last being set if more
+        taxa matched than were returned '''
+        hits = [int(h['_id']) for h in res['hits']['hits']]
+        return (hits, hits[-1] if hits and res['hits']['total'] > len(hits) else None)
+
+    def _paginate_children(self):
+        ''' Cut children lists to the requested page size, replacing the list matching
+        children_cursor with the page it points to, and keep cursors of next pages. '''
+        size = self._page_size()
+        cursor = self.options.children_cursor
+        for (taxid, children) in list(self._children_query_dict.items()):
+            if cursor and cursor['id'] == str(taxid):
+                children, last = self._children_page([taxid], has_gene=self.options.has_gene,
+                                                     after=cursor['after'], size=size)
+            elif len(children) > size:
+                # sorted lists, first page is there
+                children, last = children[:size], children[size - 1]
+            else:
+                last = None
+            self._children_query_dict[taxid] = children
+            if last is not None:
+                self._children_next[taxid] = encode_cursor(taxid, last)
+
+    def _expand_species_page(self, bid_list):
+        ''' Paginated expand_species: sorted page of bid_list taxids and their children. '''
+        size = self._page_size()
+        after = self.options.children_cursor['after'] if self.options.children_cursor else None
+        children, last = self._children_page(bid_list, has_gene=self.options.has_gene, after=after, size=size)
+        taxids = sorted(set(children + [int(x) for x in bid_list if after is None or int(x) > after]))
+        if last is not None:
+            taxids = [taxid for taxid in taxids if taxid <= last]
+        if len(taxids) > size:
+            taxids = taxids[:size]
+            last = taxids[-1]
+        return {'taxids': taxids, 'next': encode_cursor(None, last) if last is not None else None}
+
+    def _es_children_list(self, taxid, res, has_gene=True, include_self=False):
+        ''' Children list of taxid from a _children_es_body search (first max_taxid_count
+        children), with the next child if there are more (see _children_list_size) '''
+        children, last = self._children_es_hits(res)
+        if last is not None:
+            children += self._timed_children_page([taxid], has_gene=has_gene, after=last, size=1)[0]
+        if include_self:
+            children = sorted(children + [int(taxid)])[:self._children_list_size]
+        return children
+
+    def _uncached_children_query(self, ids, has_gene=True, include_self=False, raw=False):
+        if self.options.taxonomy_tree is not None and not raw:
+            return self._tree_children_query(ids, has_gene=has_gene, include_self=include_self)
         if is_str(ids) or isinstance(ids, int) or (is_seq(ids) and len(ids) == 1):
             _ids = ids if is_str(ids) or isinstance(ids, int) else ids[0] 
-            _qstring = "lineage:{} AND has_gene:true".format(_ids) if has_gene else "lineage:{}".format(_ids)
-            res = self.options.es_client.search(body={"query":{"query_string":{"query": _qstring}}},
-                index=self.options.index, doc_type=self.options.doc_type, fields='_id', size=self.max_taxid_count)
+            self._timer().es_calls += 1
+            res = self.options.es_client.search(body=self._children_es_body([_ids], has_gene=has_gene),
+                index=self.options.index, doc_type=self.options.doc_type)
             
             if raw:
                 return res
             
-            taxid_li = [int(x['_id']) for x in res['hits']['hits'] if x['_id'] != _ids or include_self]
-            taxid_li += ([_ids] if include_self and _ids not in taxid_li else [])        
-            return {_ids: sorted(taxid_li)[:self.max_taxid_count]}
+            return {_ids: self._es_children_list(_ids, res, has_gene=has_gene, include_self=include_self)}
         elif is_seq(ids):
-            qs = '\n'.join(['{{}}\n{{"size": {}, "_source": ["_id"], "query": {{"query_string":{{"query": "lineage:{} AND has_gene:true"}}}}}}'.format(self.max_taxid_count, taxid) if has_gene
-                else '{{}}\n{{"size": {}, "_source": ["_id"], "query":{{"query_string":{{"query":"lineage:{}"}}}}}}'.format(self.max_taxid_count, taxid) for taxid in ids])
+            qs = '\n'.join(['{}\n' + json.dumps(self._children_es_body([taxid], has_gene=has_gene)) for taxid in ids])
+            self._timer().es_calls += 1
             res = self.options.es_client.msearch(body=qs, index=self.options.index, doc_type=self.options.doc_type)
             if 'responses' not in res or len(res['responses']) != len(ids):
                 return {}
@@ -35,11 +187,7 @@ class ESResultTransformer(ESResultTransformer):
             _ret = {}
 
             for (taxid, response) in zip(ids, res['responses']):
-                _ret.setdefault(taxid, []).extend([h['_id'] for h in response['hits']['hits'] 
-                                                    if h['_id'] != taxid or include_self])
-            for taxid in _ret.keys():
-                _ret[taxid] = sorted([int(x) for x in list(set(_ret[taxid]))] + 
-                    ([int(taxid)] if include_self and taxid not in _ret[taxid] else []))[:self.max_taxid_count]
+                _ret[taxid] = self._es_children_list(taxid, response, has_gene=has_gene, include_self=include_self)
             return _ret
         else:
             return {}
@@ -48,27 +196,43 @@ class ESResultTransformer(ESResultTransformer):
         if self.options.include_children:
             self._children_query_dict = self._children_query(ids=[o['_id'] for o in res['hits']['hits']], 
                                                             has_gene=self.options.has_gene)
+            self._paginate_children()
         return self._clean_query_GET_response(res)
 
     def clean_query_POST_response(self, qlist, res, single_hit=True):
         if self.options.include_children:
             self._children_query_dict = self._children_query(ids=list(set([hit['_id'] for hit_list in res['responses'] 
                 for hit in hit_list['hits']['hits']])), has_gene=self.options.has_gene)
+            self._paginate_children()
         return self._clean_query_POST_response(qlist, res, single_hit)
 
     def clean_annotation_GET_response(self, res):
         if self.options.include_children:
             self._children_query_dict = self._children_query(ids=res.get('_id', []) if 'hits' not in res 
                              else [o['_id'] for o in res['hits']['hits']], has_gene=self.options.has_gene)
+            self._paginate_children()
         return self._clean_annotation_GET_response(res)
 
     def clean_annotation_POST_response(self, bid_list, res, single_hit=True):
+        if self.options.expand_species and (self.options.children_size or self.options.children_cursor):
+            return self._expand_species_page(bid_list)
         if self.options.include_children or self.options.expand_species:
             self._children_query_dict = self._children_query(ids=list(set([hit['_id'] for hit_list in res['responses'] 
                 for hit in hit_list['hits']['hits']])), has_gene=self.options.has_gene)
             if self.options.expand_species:
                 return sorted(list(set([v for v_list in self._children_query_dict.values() for v in v_list] + [int(x) for x in bid_list])))[:self.max_taxid_count]
-        return self._clean_annotation_POST_response(bid_list, res, single_hit)
+        if not self.options.taxid_aliases:
+            return self._clean_annotation_POST_response(bid_list, res, single_hit)
+        # bid_list has merged taxids resolved, report them as queried
+        aliases = self.options.taxid_aliases
+        _res = self._clean_annotation_POST_response(self.options.query_ids, res, single_hit)
+        for doc in _res:
+            if doc['query'] in aliases:
+                if aliases[doc['query']] is None:
+                    doc['deleted'] = True
+                else:
+                    doc['merged_from'] = doc['query']
+        return _res
 
     def clean_metadata_response(self, res, fields=False):
         _res = self._clean_metadata_response(res, fields=fields)
@@ -79,3 +243,5 @@ class ESResultTransformer(ESResultTransformer):
     def _modify_doc(self, doc):
         if self.options.include_children and doc['_id'] in self._children_query_dict:
             doc['children'] = self._children_query_dict[doc['_id']]
+            if doc['_id'] in self._children_next:
+                doc['children_next'] = self._children_next[doc['_id']]
@@ -1,5 +1,170 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from biothings.web.settings import BiothingESWebSettings
+from utils.tree import TaxonomyTree, NAME_FIELDS
+from utils.aliases import TaxidAliases
+from web.api.cache import ChildrenCache, SingleFlight
+from web.api.metrics import Metrics
 
 class MySpeciesWebSettings(BiothingESWebSettings):
     # Add app-specific settings functions here
-    pass
+    def __init__(self, config='biothings.web.settings.default'):
+        super(MySpeciesWebSettings, self).__init__(config)
+        self.taxonomy_tree = None
+        self.build_version = self.get_build_version()
+        if getattr(self, 'TAXONOMY_TREE_PRELOAD', False):
+            self.taxonomy_tree = self.load_taxonomy_tree(self.build_version)
+        self.taxid_aliases = self.load_taxid_aliases(self.build_version)
+        self._build_version_checked = time.time()
+        self._reloading = False
+        self.children_cache = ChildrenCache(max_size=getattr(self, 'CHILDREN_CACHE_MAX_SIZE', 0),
+                                            version=self.build_version)
+        # threads running blocking ES calls off the IOLoop (see handlers.prefetch_children_hook)
+        self.es_executor = ThreadPoolExecutor(max_workers=getattr(self, 'ES_EXECUTOR_MAX_WORKERS', 16))
+        # children lookups in flight, shared by concurrent requests
+        self.children_inflight = SingleFlight()
+        # per-stage request latencies, exposed by /metrics
+        self.metrics = Metrics(getattr(self, 'METRICS_LATENCY_BUCKETS', None))
+
+    def get_build_file(self, folder, version, ext):
+        ''' Return path to a file stored by the hub for the index behind given build
+        version, named after the index, or None if there's no such folder/version. '''
+        if not folder or not version:
+            return None
+        return os.path.join(folder, "{}.{}".format(version.split(':', 1)[0], ext))
+
+    def load_taxonomy_tree(self, version=None):
+        ''' Memory-map the tree artifact stored by the hub for that build (see
+        TAXONOMY_TREE_FOLDER), or else scan the whole index once to build the in-memory
+        taxonomy tree used to answer include_children/expand_species, and its names index
+        used by /suggest and /resolve. Returns None if it
+        can't be loaded, in which case children are queried from ES. Called at startup or
+        from a reloading thread, never while serving requests. '''
+        t0 = time.time()
+        path = self.get_build_file(getattr(self, 'TAXONOMY_TREE_FOLDER', None), version, "tree")
+        if path:
+            try:
+                tree = TaxonomyTree.load_artifact(path)
+                if tree.name_offsets is not None and tree.name_hash is None:
+                    # too slow to be done here, see hub's "upgrade_artifact" command
+                    logging.warning("No names index in '{}', /suggest and /resolve are disabled".format(path))
+                self.index_lca(tree)
+                logging.info("Taxonomy tree mapped from '{}': {} nodes in {:.1f}s".format(path, len(tree), time.time() - t0))
+                return tree
+            except Exception:
+                logging.exception("Can't load taxonomy tree from '{}', scanning index".format(path))
+        from elasticsearch.helpers import scan
+        # names, for /suggest and /resolve, collected in the same scan
+        names = []
+        def iter_nodes(docs):
+            for d in docs:
+                taxid = int(d['_id'])
+                for field in NAME_FIELDS:
+                    value = d['_source'].get(field)
+                    if type(value) is list:
+                        names.extend([(taxid, field, name) for name in value])
+                    elif value:
+                        names.append((taxid, field, value))
+                yield (taxid, d['_source'].get('parent_taxid', taxid), d['_source'].get('rank'),
+                       d['_source'].get('has_gene', False))
+        try:
+            docs = scan(self.es_client, query={"_source": ["parent_taxid", "rank", "has_gene"] + NAME_FIELDS},
+                        index=self.ES_INDEX, doc_type=self.ES_DOC_TYPE, size=10000)
+            tree = TaxonomyTree.from_nodes(iter_nodes(docs))
+        except Exception:
+            logging.exception("Can't load taxonomy tree, children will be queried from ES")
+            return None
+        tree.set_names(names)
+        del names
+        self.index_lca(tree)
+        logging.info("Taxonomy tree loaded: {} nodes in {:.1f}s".format(len(tree), time.time() - t0))
+        return tree
+
+    def index_lca(self, tree):
+        ''' Build /lca index of a tree without one (scanned from the index, or artifact
+        from a build predating it), privately to this process. '''
+        if tree.sparse_table is None:
+            t0 = time.time()
+            tree.compute_lca_index()
+            logging.info("LCA index built in {:.1f}s".format(time.time() - t0))
+
+    def load_taxid_aliases(self, version):
+        ''' Load merged/deleted taxids alias table stored by the hub for the index
+        behind given build version, from TAXID_ALIASES_FOLDER. Returns None if there's
+        none, in which case old taxids are just not found. '''
+        path = self.get_build_file(getattr(self, 'TAXID_ALIASES_FOLDER', None), version, "npz")
+        if not path:
+            return None
+        try:
+            aliases = TaxidAliases.load(path)
+        except Exception:
+            logging.exception("Can't load taxid aliases from '{}'".format(path))
+            return None
+        logging.info("{} taxid aliases loaded from '{}'".format(len(aliases), path))
+        return aliases
+
+    def get_build_version(self):
+        ''' Return "<index>:<build_version>" of the index currently behind ES_INDEX
+        (which can be an alias), from the metadata stored in its mapping. '''
+        try:
+            res = self.es_client.indices.get_mapping(index=self.ES_INDEX, doc_type=self.ES_DOC_TYPE)
+            index_name, mappings = list(res.items())[0]
+            _meta = mappings['mappings'][self.ES_DOC_TYPE].get('_meta', {})
+            return "{}:{}".format(index_name, _meta.get('build_version', _meta.get('build_date', '')))
+        except Exception:
+            logging.exception("Can't get build version")
+            return None
+
+    def check_build_version(self):
+        ''' Called for each request, checks every BUILD_VERSION_CHECK_INTERVAL seconds
+        (in a thread of the ES executor, not to block the IOLoop) whether a new build
+        was published. If so, the taxonomy tree is reloaded in the background and children
+        cache invalidated once the new tree is in place. A tree which couldn't be loaded
+        (TAXONOMY_TREE_PRELOAD) is retried the same way until it is. '''
+        if self._reloading or time.time() - self._build_version_checked < getattr(self, 'BUILD_VERSION_CHECK_INTERVAL', 60):
+            return
+        self._build_version_checked = time.time()
+        self._reloading = True
+        self.es_executor.submit(self._check_build)
+
+    def _check_build(self):
+        reload_tree = False
+        try:
+            version = self.get_build_version()
+            if version is None:
+                return
+            preload = getattr(self, 'TAXONOMY_TREE_PRELOAD', False)
+            if version != self.build_version:
+                logging.info("New build published ({} -> {})".format(self.build_version, version))
+                reload_tree = self.taxonomy_tree is not None or preload
+                if not reload_tree:
+                    self._switch_build(version, aliases=self.load_taxid_aliases(version))
+            elif self.taxonomy_tree is None and preload:
+                logging.info("Retrying to load taxonomy tree of build {}".format(version))
+                reload_tree = True
+            if reload_tree:
+                threading.Thread(target=self._reload_build, args=(version,), daemon=True).start()
+        finally:
+            if not reload_tree:
+                self._reloading = False
+
+    def _reload_build(self, version):
+        # if the tree can't be reloaded, we keep the current one and retry later,
+        # without one the new build is still switched to (children queried from ES)
+        try:
+            tree = self.load_taxonomy_tree(version)
+            if tree is not None or (self.taxonomy_tree is None and version != self.build_version):
+                self._switch_build(version, tree, self.load_taxid_aliases(version))
+        finally:
+            self._reloading = False
+
+    def _switch_build(self, version, tree=None, aliases=None):
+        if tree is not None:
+            self.taxonomy_tree = tree
+        self.taxid_aliases = aliases
+        self.build_version = version
+        self.children_cache.reset(version)